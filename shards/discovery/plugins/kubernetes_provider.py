@@ -14,7 +14,10 @@ import enum
 from functools import partial
 from collections import defaultdict
 from kubernetes import client, config as kconfig, watch
+from milvus.client.exceptions import NotConnectError
+from mishards.exceptions import ConnectionConnectError
 from mishards.topology import StatusType
+from mishards.connections import ConnectionGroup
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +27,21 @@ INCLUSTER_NAMESPACE_PATH = '/var/run/secrets/kubernetes.io/serviceaccount/namesp
 class EventType(enum.Enum):
     PodHeartBeat = 1
     Watch = 2
+    PodInformer = 3
+
+
+class DiscoveryMode:
+    POLL = 'poll'
+    INFORMER = 'informer'
+
+
+def is_pod_ready(pod):
+    if pod.metadata.deletion_timestamp or not pod.status.pod_ip:
+        return False
+    for condition in (pod.status.conditions or []):
+        if condition.type == 'Ready':
+            return condition.status == 'True'
+    return False
 
 
 class K8SMixin:
@@ -135,6 +153,100 @@ class K8SEventListener(threading.Thread, K8SMixin):
             self.queue.put(info)
 
 
+class K8SPodInformer(threading.Thread, K8SMixin):
+    """List pods once and then watch them from the listed resourceVersion.
+
+    The local cache is rebuilt by a relist only when the watch falls too far
+    behind (HTTP 410 Gone), so the API server load is proportional to pod changes.
+    """
+    def __init__(self,
+                 message_queue,
+                 namespace,
+                 label_selector,
+                 in_cluster=False,
+                 **kwargs):
+        K8SMixin.__init__(self,
+                          namespace=namespace,
+                          in_cluster=in_cluster,
+                          **kwargs)
+        threading.Thread.__init__(self)
+        self.queue = message_queue
+        self.terminate = False
+        self.label_selector = label_selector
+        self.watch_timeout = kwargs.get('watch_timeout', 300)
+        self.retry_interval = kwargs.get('retry_interval', 1)
+        self.resource_version = None
+        self.cache = {}
+        self.watcher = None
+
+    def pod_event(self, pod):
+        return dict(pod=pod.metadata.name,
+                    ip=pod.status.pod_ip,
+                    ready=is_pod_ready(pod),
+                    reason=pod.status.reason,
+                    message=pod.status.message)
+
+    def relist(self):
+        pods = self.v1.list_namespaced_pod(namespace=self.namespace,
+                                           label_selector=self.label_selector)
+        self.cache = {pod.metadata.name: self.pod_event(pod) for pod in pods.items}
+        self.resource_version = pods.metadata.resource_version
+        self.queue.put({'eType': EventType.PodInformer,
+                        'snapshot': True,
+                        'events': list(self.cache.values())})
+
+    def on_watch_event(self, event):
+        pod = event['object']
+        pod_event = self.pod_event(pod)
+        if event['type'] == 'DELETED':
+            self.cache.pop(pod_event['pod'], None)
+            pod_event['ready'] = False
+        else:
+            previous = self.cache.get(pod_event['pod'], None)
+            self.cache[pod_event['pod']] = pod_event
+            if previous and previous['ready'] == pod_event['ready'] and previous['ip'] == pod_event['ip']:
+                return
+        self.queue.put({'eType': EventType.PodInformer,
+                        'snapshot': False,
+                        'events': [pod_event]})
+
+    def watch(self):
+        self.watcher = watch.Watch()
+        for event in self.watcher.stream(self.v1.list_namespaced_pod,
+                                         namespace=self.namespace,
+                                         label_selector=self.label_selector,
+                                         resource_version=self.resource_version,
+                                         timeout_seconds=self.watch_timeout):
+            if self.terminate:
+                break
+            if event['type'] == 'ERROR':
+                # Mostly 410 Gone: the resourceVersion is compacted away
+                logger.warning('Pod watch error: {}, relist pods'.format(event['raw_object']))
+                self.resource_version = None
+                break
+            self.resource_version = event['object'].metadata.resource_version
+            self.on_watch_event(event)
+
+    def run(self):
+        while not self.terminate:
+            try:
+                if self.resource_version is None:
+                    self.relist()
+                self.watch()
+            except client.rest.ApiException as exc:
+                logger.error(exc)
+                if exc.status == 410:
+                    self.resource_version = None
+                time.sleep(self.retry_interval)
+            except Exception as exc:
+                logger.error(exc)
+                time.sleep(self.retry_interval)
+
+    def stop(self):
+        self.terminate = True
+        self.watcher and self.watcher.stop()
+
+
 class EventHandler(threading.Thread):
     PENDING_THRESHOLD = 3
     def __init__(self, mgr, message_queue, namespace, pod_patt, **kwargs):
@@ -230,10 +342,37 @@ class EventHandler(threading.Thread):
 
         logger.debug('All Pods: {}'.format(list(latest)))
 
+    def on_pod_informer(self, event, **kwargs):
+        names = set(self.mgr.readonly_topo.group_names)
+
+        for each_event in event['events']:
+            if not re.match(self.pod_patt, each_event['pod']):
+                continue
+            if each_event['ready']:
+                self.mgr.add_pod(each_event['pod'], each_event['ip'])
+            elif each_event['pod'] in names:
+                self.mgr.delete_pod(each_event['pod'])
+
+        if event['snapshot']:
+            listed = set(each_event['pod'] for each_event in event['events'])
+            for name in names - listed:
+                self.mgr.delete_pod(name)
+
+        latest = set(self.mgr.readonly_topo.group_names)
+        deleted = names - latest
+        added = latest - names
+        if deleted:
+            logger.info('Deleted Pods: {}'.format(list(deleted)))
+        if added:
+            logger.info('Added Pods: {}'.format(list(added)))
+
     def handle_event(self, event):
         if event['eType'] == EventType.PodHeartBeat:
             return self.on_pod_heartbeat(event)
 
+        if event['eType'] == EventType.PodInformer:
+            return self.on_pod_informer(event)
+
         if not event or (event['reason'] not in ('Started', 'Killing')):
             return self.on_drop(event)
 
@@ -258,13 +397,14 @@ class EventHandler(threading.Thread):
 
 class KubernetesProviderSettings:
     def __init__(self, namespace, pod_patt, label_selector, in_cluster,
-                 poll_interval, port=None, **kwargs):
+                 poll_interval, port=None, mode=None, **kwargs):
         self.namespace = namespace
         self.pod_patt = pod_patt
         self.label_selector = label_selector
         self.in_cluster = in_cluster
         self.poll_interval = poll_interval
         self.port = int(port) if port else 19530
+        self.mode = mode if mode else DiscoveryMode.POLL
 
 
 class KubernetesProvider(object):
@@ -280,7 +420,9 @@ class KubernetesProvider(object):
         self.poll_interval = int(self.poll_interval) if self.poll_interval else 5
         self.port = config.DISCOVERY_KUBERNETES_PORT
         self.port = int(self.port) if self.port else 19530
+        self.mode = (config.DISCOVERY_KUBERNETES_MODE or DiscoveryMode.POLL).lower()
         self.kwargs = kwargs
+        self.pod_ips = {}
         self.queue = queue.Queue()
 
         self.readonly_topo = readonly_topo
@@ -292,20 +434,31 @@ class KubernetesProvider(object):
         ) if self.in_cluster else kconfig.load_kube_config()
         self.v1 = client.CoreV1Api()
 
-        self.listener = K8SEventListener(message_queue=self.queue,
-                                         namespace=self.namespace,
-                                         in_cluster=self.in_cluster,
-                                         v1=self.v1,
-                                         **kwargs)
-
-        self.pod_heartbeater = K8SHeartbeatHandler(
-            message_queue=self.queue,
-            namespace=self.namespace,
-            label_selector=self.label_selector,
-            in_cluster=self.in_cluster,
-            v1=self.v1,
-            poll_interval=self.poll_interval,
-            **kwargs)
+        self.informer = None
+        self.listener = None
+        self.pod_heartbeater = None
+        if self.mode == DiscoveryMode.INFORMER:
+            self.informer = K8SPodInformer(message_queue=self.queue,
+                                           namespace=self.namespace,
+                                           label_selector=self.label_selector,
+                                           in_cluster=self.in_cluster,
+                                           v1=self.v1,
+                                           **kwargs)
+        else:
+            self.listener = K8SEventListener(message_queue=self.queue,
+                                             namespace=self.namespace,
+                                             in_cluster=self.in_cluster,
+                                             v1=self.v1,
+                                             **kwargs)
+
+            self.pod_heartbeater = K8SHeartbeatHandler(
+                message_queue=self.queue,
+                namespace=self.namespace,
+                label_selector=self.label_selector,
+                in_cluster=self.in_cluster,
+                v1=self.v1,
+                poll_interval=self.poll_interval,
+                **kwargs)
 
         self.event_handler = EventHandler(mgr=self,
                                           message_queue=self.queue,
@@ -314,28 +467,47 @@ class KubernetesProvider(object):
                                           **kwargs)
 
     def add_pod(self, name, ip):
+        if self.readonly_topo.has_group(name):
+            if self.pod_ips.get(name, ip) == ip:
+                return True
+            # Pod is recreated with a new IP under the same name
+            self.delete_pod(name)
+
         logger.debug('Register POD {} with IP {}'.format(
             name, ip))
         ok = True
         status = StatusType.OK
         try:
             uri = 'tcp://{}:{}'.format(ip, self.port)
-            status, group = self.readonly_topo.create(name=name)
+            # Publish the group into topology only after its connection is verified
+            group = ConnectionGroup(name)
+            status, pool = group.create(name=name, uri=uri)
             if status == StatusType.OK:
-                status, pool = group.create(name=name, uri=uri)
-        except ConnectionConnectError as exc:
+                status = self.readonly_topo.add_group(group)
+            if status not in (StatusType.OK, StatusType.DUPLICATED):
+                ok = False
+        except (ConnectionConnectError, NotConnectError) as exc:
             ok = False
-            logger.error('Connection error to: {}'.format(addr))
+            logger.error('Connection error to: {}'.format(ip))
 
+        if ok:
+            self.pod_ips[name] = ip
         # if ok and status == StatusType.OK:
         #     logger.info('KubernetesProvider Add Group \"{}\" Of 1 Address: {}'.format(name, uri))
         return ok
 
     def delete_pod(self, name):
+        self.pod_ips.pop(name, None)
         pool = self.readonly_topo.delete_group(name)
         return True
 
     def start(self):
+        if self.informer:
+            self.informer.daemon = True
+            self.informer.start()
+            self.event_handler.start()
+            return True
+
         self.listener.daemon = True
         self.listener.start()
         self.event_handler.start()
@@ -344,8 +516,8 @@ class KubernetesProvider(object):
         return True
 
     def stop(self):
-        self.listener.stop()
-        self.pod_heartbeater.stop()
+        for worker in (self.informer, self.listener, self.pod_heartbeater):
+            worker and worker.stop()
         self.event_handler.stop()
 
     @classmethod
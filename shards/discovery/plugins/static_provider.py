@@ -5,9 +5,13 @@ if __name__ == '__main__':
 
 import logging
 import socket
+import threading
+from concurrent import futures
 from environs import Env
+from milvus.client.exceptions import NotConnectError
 from mishards.exceptions import ConnectionConnectError
 from mishards.topology import StatusType
+from mishards.connections import ConnectionGroup
 
 logger = logging.getLogger(__name__)
 env = Env()
@@ -31,33 +35,92 @@ class StaticDiscovery(object):
         self.readonly_topo = readonly_topo
         hosts = map(str.strip, env.list('DISCOVERY_STATIC_HOSTS', []))
         self.port = env.int('DISCOVERY_STATIC_PORT', 19530)
+        self.probe_timeout = env.float('DISCOVERY_STATIC_PROBE_TIMEOUT', 5)
+        self.retry_interval = env.float('DISCOVERY_STATIC_RETRY_INTERVAL', 10)
+        self.probe_workers = env.int('DISCOVERY_STATIC_PROBE_WORKERS', 16)
         self.hosts = [resolve_address(host, self.port) for host in hosts]
+        self.unreachable = set()
+        self.probing = set()
+        self.cv = threading.Condition()
+        self.terminate = False
+        self.executor = None
+        self.retrier = None
+
+    def _probe(self, host):
+        with self.cv:
+            if host in self.probing:
+                return None
+            self.probing.add(host)
+        ok = False
+        try:
+            ok = self.add_pod(host, host)
+        except Exception as exc:
+            logger.error('Probe address {} failed: {}'.format(host, exc))
+        finally:
+            with self.cv:
+                self.probing.discard(host)
+                if ok:
+                    self.unreachable.discard(host)
+                else:
+                    self.unreachable.add(host)
+        return ok
+
+    def _retry_unreachable(self):
+        while True:
+            with self.cv:
+                self.cv.wait(self.retry_interval)
+                if self.terminate:
+                    return
+                hosts = list(self.unreachable - self.probing)
+            for host in hosts:
+                logger.info('StaticDiscovery retry to probe unreachable address: {}'.format(host))
+                self.executor.submit(self._probe, host)
 
     def start(self):
-        ok = True
-        for host in self.hosts:
-            ok &= self.add_pod(host, host)
-            if not ok: break
-        if ok and len(self.hosts) == 0:
+        if len(self.hosts) == 0:
             logger.error('No address is specified')
-            ok = False
-        return ok
+            return False
+
+        self.executor = futures.ThreadPoolExecutor(max_workers=max(1, min(len(self.hosts), self.probe_workers)),
+                                                   thread_name_prefix='StaticDiscoveryProbe')
+        probes = {self.executor.submit(self._probe, host): host for host in self.hosts}
+        done, not_done = futures.wait(probes, timeout=self.probe_timeout)
+
+        failed = [probes[f] for f in done if not f.result()]
+        pending = [probes[f] for f in not_done]
+        logger.info('StaticDiscovery probed {} addresses in {}s: {} ready, {} unreachable, {} pending'.format(
+            len(self.hosts), self.probe_timeout, len(done) - len(failed), len(failed), len(pending)))
+        failed and logger.warning('Unreachable addresses will be retried in background: {}'.format(failed))
+
+        self.retrier = threading.Thread(target=self._retry_unreachable, name='StaticDiscoveryRetry', daemon=True)
+        self.retrier.start()
+        return True
 
     def stop(self):
+        with self.cv:
+            self.terminate = True
+            self.cv.notify_all()
+        self.executor and self.executor.shutdown(wait=False)
         for host in self.hosts:
             self.delete_pod(host)
 
     def add_pod(self, name, addr):
+        if self.readonly_topo.has_group(name):
+            return True
         ok = True
         status = StatusType.OK
         try:
             uri = 'tcp://{}'.format(addr)
-            status, group = self.readonly_topo.create(name=name)
+            # Publish the group into topology only after its connection is verified
+            group = ConnectionGroup(name, probe_timeout=self.probe_timeout)
+            status, pool = group.create(name=name, uri=uri)
+            if status == StatusType.OK and self.terminate:
+                return False
             if status == StatusType.OK:
-                status, pool = group.create(name=name, uri=uri)
+                status = self.readonly_topo.add_group(group)
             if status not in (StatusType.OK, StatusType.DUPLICATED):
                 ok = False
-        except ConnectionConnectError as exc:
+        except (ConnectionConnectError, NotConnectError) as exc:
             ok = False
             logger.error('Connection error to: {}'.format(addr))
 
@@ -7,6 +7,10 @@ class DBHandler:
     def create_all(cls):
         db.create_all()
 
+    @classmethod
+    def create_indexes(cls):
+        db.create_indexes()
+
     @classmethod
     def drop_all(cls):
         db.drop_all()
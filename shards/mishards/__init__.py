@@ -9,39 +9,118 @@ from mishards.server import Server
 grpc_server = Server()
 
 
-def create_app(testing_config=None):
+def create_app(testing_config=None, bus=None):
+    from mishards.perf import RequestTimer
+    timer = grpc_server.startup_timer = RequestTimer()
     config = testing_config if testing_config else settings.DefaultConfig
     db.init_db(uri=config.SQLALCHEMY_DATABASE_URI, echo=config.SQL_ECHO, pool_size=config.SQL_POOL_SIZE,
                pool_recycle=config.SQL_POOL_RECYCLE, pool_timeout=config.SQL_POOL_TIMEOUT,
                pool_pre_ping=config.SQL_POOL_PRE_PING, max_overflow=config.SQL_MAX_OVERFLOW)
+    if config.SQLALCHEMY_DATABASE_REPLICA_URIS:
+        db.init_replicas(config.SQLALCHEMY_DATABASE_REPLICA_URIS, max_lag=config.SQL_REPLICA_MAX_LAG,
+                         check_interval=config.SQL_REPLICA_CHECK_INTERVAL, echo=config.SQL_ECHO,
+                         pool_size=config.SQL_REPLICA_POOL_SIZE, pool_recycle=config.SQL_POOL_RECYCLE,
+                         pool_timeout=config.SQL_POOL_TIMEOUT, pool_pre_ping=config.SQL_POOL_PRE_PING,
+                         max_overflow=config.SQL_REPLICA_MAX_OVERFLOW)
+        grpc_server.register_pre_run_handler(db.start_replica_check)
+    timer.lap('db')
 
     from mishards.connections import ConnectionTopology
 
-    readonly_topo = ConnectionTopology()
+    readonly_topo = ConnectionTopology(drain_timeout=settings.READONLY_DRAIN_TIMEOUT,
+                                       join_timeout=settings.READONLY_PREWARM_TIMEOUT)
     writable_topo = ConnectionTopology()
 
     from discovery.factory import DiscoveryFactory
     discover = DiscoveryFactory(config.DISCOVERY_PLUGIN_PATH).create(config.DISCOVERY_CLASS_NAME,
                                                                      readonly_topo=readonly_topo)
+    timer.lap('discovery')
 
     from mishards.grpc_utils import GrpcSpanDecorator
     from tracer.factory import TracerFactory
     tracer = TracerFactory(config.TRACER_PLUGIN_PATH).create(config.TRACER_CLASS_NAME,
                                                              plugin_config=settings.TracingConfig,
                                                              span_decorator=GrpcSpanDecorator())
+    timer.lap('tracer')
 
     from mishards.router.factory import RouterFactory
     router = RouterFactory(config.ROUTER_PLUGIN_PATH).create(config.ROUTER_CLASS_NAME,
                                                              readonly_topo=readonly_topo,
                                                              writable_topo=writable_topo)
+    if settings.READONLY_PREWARM_ON_JOIN:
+        readonly_topo.register_join_handler(router.prewarm)
+    if settings.METADATA_MIRROR:
+        from mishards.metadata_mirror import MetadataMirror
+        router.mirror = MetadataMirror(db, poll_interval=settings.METADATA_MIRROR_POLL_INTERVAL,
+                                       reconcile_interval=settings.METADATA_MIRROR_RECONCILE_INTERVAL,
+                                       max_staleness=settings.METADATA_MIRROR_MAX_STALENESS)
+        grpc_server.register_pre_run_handler(router.mirror.start)
+    timer.lap('router')
+
+    from mishards.workers import WorkerBus
+    from mishards.router import (file_update_listeners, file_forget_listeners,
+                                 merge_file_updates, drop_file_updates)
+    bus = bus if bus else WorkerBus(stats_interval=settings.WORKER_STATS_INTERVAL)
+    if bus.enabled:
+        file_update_listeners.append(lambda host, files: bus.publish('files_updated', (host, files)))
+        bus.subscribe('files_updated', lambda payload: merge_file_updates(*payload))
+        file_forget_listeners.append(lambda host, files: bus.publish('files_forgotten', (host, files)))
+        bus.subscribe('files_forgotten', lambda payload: drop_file_updates(*payload))
+        bus.register_close_handler(grpc_server.stop)
+    if router.mirror:
+        bus.register_stats_provider(lambda: {'metadata_mirror': router.mirror.stats()})
+    if db.replicas:
+        bus.register_stats_provider(lambda: {'metadata_replicas': db.replica_stats()})
+
+    from mishards.lanes import Lanes, Lane, SEARCH, WRITE, ADMIN
+    queue_timeout = settings.LANE_QUEUE_TIMEOUT if settings.LANE_QUEUE_TIMEOUT > 0 else None
+    search_limiter = None
+    if settings.LANE_SEARCH_ADAPTIVE:
+        from mishards.limiter import GradientLimit
+        search_limiter = GradientLimit(settings.MAX_WORKERS,
+                                       min_limit=settings.LANE_SEARCH_MIN_WORKERS,
+                                       max_limit=settings.LANE_SEARCH_MAX_WORKERS)
+    lanes = Lanes([
+        Lane(SEARCH, settings.MAX_WORKERS, settings.LANE_SEARCH_QUEUE, queue_timeout, limiter=search_limiter),
+        Lane(WRITE, settings.LANE_WRITE_WORKERS, settings.LANE_WRITE_QUEUE, queue_timeout),
+        Lane(ADMIN, settings.LANE_ADMIN_WORKERS, settings.LANE_ADMIN_QUEUE, queue_timeout),
+    ])
+
+    snapshot = None
+    if settings.SNAPSHOT_PATH:
+        from mishards.snapshot import StateSnapshot, ring_epoch
+        from mishards.router import dump_file_updates, restore_file_updates
+        snapshot = StateSnapshot(settings.SNAPSHOT_PATH, interval=settings.SNAPSHOT_INTERVAL,
+                                 max_age=settings.SNAPSHOT_MAX_AGE)
+        snapshot.register('file_updates', dump_file_updates, restore_file_updates)
+        snapshot.register('ring', lambda: {'nodes': sorted(readonly_topo.routable_names),
+                                           'epoch': ring_epoch(readonly_topo.routable_names)},
+                          lambda ring: setattr(snapshot, 'restored_ring', ring))
+
+    outliers = None
+    if settings.OUTLIER_DETECTION:
+        from mishards.outlier import OutlierDetector
+        outliers = OutlierDetector(readonly_topo,
+                                   alpha=settings.OUTLIER_EWMA_ALPHA,
+                                   latency_factor=settings.OUTLIER_LATENCY_FACTOR,
+                                   min_latency=settings.OUTLIER_MIN_LATENCY,
+                                   error_rate=settings.OUTLIER_ERROR_RATE,
+                                   min_requests=settings.OUTLIER_MIN_REQUESTS,
+                                   base_ejection=settings.OUTLIER_BASE_EJECTION,
+                                   max_ejection=settings.OUTLIER_MAX_EJECTION,
+                                   max_ejected_percent=settings.OUTLIER_MAX_EJECTED_PERCENT)
 
     grpc_server.init_app(writable_topo=writable_topo,
                          readonly_topo=readonly_topo,
                          tracer=tracer,
                          router=router,
                          discover=discover,
-                         max_workers=settings.MAX_WORKERS)
+                         bus=bus,
+                         lanes=lanes,
+                         outliers=outliers,
+                         snapshot=snapshot)
 
     from mishards import exception_handlers
+    timer.lap('server')
 
     return grpc_server
@@ -226,20 +226,20 @@ logger = logging.getLogger(__name__)
 
 
 class ConnectionGroup(topology.TopoGroup):
-    def __init__(self, name):
+    def __init__(self, name, probe_timeout=30):
         super().__init__(name)
+        self.probe_timeout = probe_timeout
 
     def stats(self):
-        out = {}
-        for name, item in self.items.items():
-            out[name] = item.stats()
-
-        return out
+        return {
+            'connections': list(self.items.keys()),
+            'inflight': self.inflight
+        }
 
     def on_pre_add(self, topo_object):
         # conn = topo_object.fetch()
         # conn.on_connect(metadata=None)
-        status, version = topo_object.server_version()
+        status, version = topo_object.server_version(timeout=self.probe_timeout)
         if not status.OK():
             logger.error('Cannot connect to newly added address: {}. Remove it now'.format(topo_object.name))
             return False
@@ -264,13 +264,17 @@ class ConnectionGroup(topology.TopoGroup):
 
 
 class ConnectionTopology(topology.Topology):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
     def stats(self):
         out = {}
-        for name, group in self.topo_groups.items():
-            out[name] = group.stats()
+        for state, groups in (('active', self.topo_groups), ('joining', self.joining_groups),
+                              ('draining', self.draining_groups)):
+            for name, group in list(groups.items()):
+                out[name] = group.stats()
+                out[name]['state'] = state
+                out[name]['ejected'] = round(self.ejected_remaining(name), 3)
 
         return out
 
@@ -1,5 +1,7 @@
 import logging
-from sqlalchemy import create_engine
+import threading
+from sqlalchemy import create_engine, inspect, func, select
+from sqlalchemy import exc as sqlalchemy_exc
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
@@ -9,33 +11,117 @@ logger = logging.getLogger(__name__)
 
 
 class LocalSession(SessionBase):
-    def __init__(self, db, autocommit=False, autoflush=True, **options):
+    def __init__(self, db, autocommit=False, autoflush=True, replica=False, **options):
         self.db = db
-        bind = options.pop('bind', None) or db.engine
+        bind = options.pop('bind', None) or (db.read_engine() if replica else db.engine)
         SessionBase.__init__(self, autocommit=autocommit, autoflush=autoflush, bind=bind, **options)
 
 
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.stale = False
+        self.lag = None
+
+    def __repr__(self):
+        return repr(self.engine.url)
+
+
 class DB:
     Model = declarative_base()
 
     def __init__(self, uri=None, echo=False):
         self.echo = echo
+        self.replicas = []
+        self.replica_check_stop = threading.Event()
         uri and self.init_db(uri, echo)
         self.session_factory = scoped_session(sessionmaker(class_=LocalSession, db=self))
+        self.read_session_factory = scoped_session(sessionmaker(class_=LocalSession, db=self, replica=True))
 
-    def init_db(self, uri, echo=False, pool_size=100, pool_recycle=5, pool_timeout=30, pool_pre_ping=True, max_overflow=0):
+    @staticmethod
+    def _create_engine(uri, echo=False, pool_size=100, pool_recycle=5, pool_timeout=30, pool_pre_ping=True,
+                       max_overflow=0):
         url = make_url(uri)
         if url.get_backend_name() == 'sqlite':
-            self.engine = create_engine(url)
-        else:
-            self.engine = create_engine(uri, pool_size=pool_size,
-                                        pool_recycle=pool_recycle,
-                                        pool_timeout=pool_timeout,
-                                        pool_pre_ping=pool_pre_ping,
-                                        echo=echo,
-                                        max_overflow=max_overflow)
+            return create_engine(url)
+        return create_engine(uri, pool_size=pool_size,
+                             pool_recycle=pool_recycle,
+                             pool_timeout=pool_timeout,
+                             pool_pre_ping=pool_pre_ping,
+                             echo=echo,
+                             max_overflow=max_overflow)
+
+    def init_db(self, uri, echo=False, pool_size=100, pool_recycle=5, pool_timeout=30, pool_pre_ping=True, max_overflow=0):
+        self.engine = self._create_engine(uri, echo=echo, pool_size=pool_size, pool_recycle=pool_recycle,
+                                          pool_timeout=pool_timeout, pool_pre_ping=pool_pre_ping,
+                                          max_overflow=max_overflow)
         self.uri = uri
-        self.url = url
+        self.url = make_url(uri)
+
+    def init_replicas(self, uris, max_lag=5, check_interval=10, **engine_kwargs):
+        """Serve `ReadSession` from the read replicas at `uris` in turn.
+
+        Once `start_replica_check` is called, a background thread compares every
+        `check_interval` seconds the newest segment update time of each replica
+        with the primary's. A replica behind by more than `max_lag` seconds, or
+        failing, is skipped until a later check finds it caught up. Reads go to
+        the primary when no replica is usable.
+        """
+        self.replicas = [Replica(self._create_engine(uri, **engine_kwargs)) for uri in uris]
+        self.replica_index = 0
+        self.replica_max_lag = max_lag
+        self.replica_check_interval = check_interval
+        logger.info('Metadata reads go to {} replicas'.format(len(self.replicas)))
+
+    def _watermark(self, engine):
+        from mishards.models import TableFiles
+        with engine.connect() as conn:
+            return conn.execute(select([func.max(TableFiles.updated_time)])).scalar() or 0
+
+    def check_replicas(self):
+        try:
+            primary = self._watermark(self.engine)
+        except sqlalchemy_exc.SQLAlchemyError as e:
+            logger.warning('Cannot check replicas, primary fails: {}'.format(e))
+            return
+        for replica in self.replicas:
+            try:
+                # Milvus stamps segment updates in microseconds
+                replica.lag = max(0, primary - self._watermark(replica.engine)) / 1000000.0
+                stale = replica.lag > self.replica_max_lag
+            except sqlalchemy_exc.SQLAlchemyError as e:
+                logger.warning('Replica {} fails: {}'.format(replica, e))
+                replica.lag = None
+                stale = True
+            if stale != replica.stale:
+                logger.warning('Replica {} is {}, lag {}s'.format(replica, 'stale' if stale else 'usable again',
+                                                                  replica.lag))
+            replica.stale = stale
+
+    def _run_replica_check(self):
+        while not self.replica_check_stop.wait(self.replica_check_interval):
+            self.check_replicas()
+
+    def start_replica_check(self):
+        self.check_replicas()
+        thread = threading.Thread(target=self._run_replica_check, name='ReplicaCheck', daemon=True)
+        thread.start()
+
+    def stop_replica_check(self):
+        self.replica_check_stop.set()
+
+    def read_engine(self):
+        if not self.replicas:
+            return self.engine
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self.replica_index % len(self.replicas)]
+            self.replica_index += 1
+            if not replica.stale:
+                return replica.engine
+        return self.engine
+
+    def replica_stats(self):
+        return [{'url': repr(replica), 'stale': replica.stale, 'lag': replica.lag} for replica in self.replicas]
 
     def __str__(self):
         return '<DB: backend={};database={}>'.format(self.url.get_backend_name(), self.url.database)
@@ -44,11 +130,32 @@ class DB:
     def Session(self):
         return self.session_factory()
 
+    @property
+    def ReadSession(self):
+        """Session on a read replica when configured, on the primary otherwise"""
+        return self.read_session_factory()
+
     def remove_session(self):
         self.session_factory.remove()
 
+    def remove_read_session(self):
+        self.read_session_factory.remove()
+
     def drop_all(self):
         self.Model.metadata.drop_all(self.engine)
 
     def create_all(self):
         self.Model.metadata.create_all(self.engine)
+
+    def create_indexes(self):
+        """Create the indexes of the models missing from an existing database"""
+        inspector = inspect(self.engine)
+        table_names = set(inspector.get_table_names())
+        for table in self.Model.metadata.sorted_tables:
+            if table.name not in table_names:
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    logger.info('Create index {} on {}'.format(index.name, table.name))
+                    index.create(self.engine)
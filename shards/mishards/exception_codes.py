@@ -3,6 +3,8 @@ INVALID_CODE = -1
 CONNECT_ERROR_CODE = 10001
 CONNECTTION_NOT_FOUND_CODE = 10002
 DB_ERROR_CODE = 10003
+LANE_OVERLOAD_CODE = 10004
+REQUEST_CANCELLED_CODE = 10005
 
 COLLECTION_NOT_FOUND_CODE = 20001
 INVALID_ARGUMENT_CODE = 20002
@@ -51,6 +51,12 @@ def resp_handler(err, error_code):
             )
         )
 
+    if resp_class == status_pb2.Status:
+        return status
+
+    if 'status' in resp_class.DESCRIPTOR.fields_by_name:
+        return resp_class(status=status)
+
     status.error_code = status_pb2.UNEXPECTED_ERROR
     return status
 
@@ -89,3 +95,15 @@ def InvalidArgumentErrorHandler(err):
 def InvalidArgumentErrorHandler(err):
     logger.error(err)
     return resp_handler(err, status_pb2.UNEXPECTED_ERROR)
+
+
+@server.errorhandler(exceptions.LaneOverloadError)
+def LaneOverloadErrorHandler(err):
+    logger.warning(err)
+    return resp_handler(err, status_pb2.UNEXPECTED_ERROR)
+
+
+@server.errorhandler(exceptions.RequestCancelledError)
+def RequestCancelledErrorHandler(err):
+    logger.warning(err)
+    return resp_handler(err, status_pb2.UNEXPECTED_ERROR)
@@ -45,3 +45,11 @@ class InvalidArgumentError(BaseException):
 
 class InvalidRangeError(BaseException):
     code = codes.INVALID_DATE_RANGE_CODE
+
+
+class LaneOverloadError(BaseException):
+    code = codes.LANE_OVERLOAD_CODE
+
+
+class RequestCancelledError(BaseException):
+    code = codes.REQUEST_CANCELLED_CODE
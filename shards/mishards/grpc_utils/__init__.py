@@ -26,6 +26,12 @@ class GrpcSpanDecorator(SpanDecorator):
         span.log_kv(error_log)
 
 
+def add_done_callback(future, callback):
+    """Call `callback(grpc_future)` once the async SDK call `future` is done"""
+    # The SDK future does not expose done callbacks, register on its gRPC future
+    future._future.add_done_callback(callback)
+
+
 def mark_grpc_method(func):
     setattr(func, 'grpc_method', True)
     return func
@@ -0,0 +1,182 @@
+import logging
+import itertools
+import threading
+import time
+from concurrent import futures
+
+logger = logging.getLogger(__name__)
+
+
+class JobState:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+class Job:
+    def __init__(self, job_id, kind, key, func, progress=None, **kwargs):
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.func = func
+        self.progress_func = progress
+        self.kwargs = kwargs
+        self.state = JobState.PENDING
+        self.message = ''
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.state in (JobState.SUCCEEDED, JobState.FAILED)
+
+    def run(self, on_start=None):
+        self.state = JobState.RUNNING
+        self.started_at = time.time()
+        on_start and on_start()
+        try:
+            status = self.func()
+            self.state = JobState.SUCCEEDED if status.OK() else JobState.FAILED
+            self.message = status.message
+        except Exception as exc:
+            logger.error('Job {} {} failed: {}'.format(self.id, self.kind, exc))
+            self.state = JobState.FAILED
+            self.message = str(exc)
+        self.finished_at = time.time()
+        logger.info('Job {} {} {} in {:.3f}s'.format(self.id, self.kind, self.state,
+                                                      self.finished_at - self.started_at))
+
+    def progress(self):
+        if self.state == JobState.SUCCEEDED:
+            return 1.0
+        if self.state != JobState.RUNNING or not self.progress_func:
+            return None
+        try:
+            return self.progress_func()
+        except Exception as exc:
+            logger.warning('Job {} cannot report progress: {}'.format(self.id, exc))
+            return None
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.kwargs,
+            'state': self.state,
+            'progress': self.progress(),
+            'elapsed': round(end - (self.started_at or end), 3),
+            'queued': round((self.started_at or end) - self.created_at, 3),
+            'message': self.message
+        }
+
+
+class PeerJob:
+    """Last known state of a job run by another worker"""
+    def __init__(self, key, state):
+        self.key = key
+        self.id = state['id']
+        self.state = state
+        self.updated_at = time.time()
+
+    @property
+    def done(self):
+        return self.state['state'] in (JobState.SUCCEEDED, JobState.FAILED)
+
+    def to_dict(self):
+        return self.state
+
+
+class JobManager:
+    """Runs long operations in background and dedupes identical in-flight ones.
+
+    A job is identified by `key`. Submitting a key whose job is still pending or
+    running returns the existing job instead of starting the operation again.
+    Finished jobs are kept for `retention` seconds.
+
+    Job ids start with `id_prefix`, e.g. the process id, so that workers sharing
+    a port never hand out the same id. Every state change of a local job is
+    passed to the `listeners` as (key, job dict); feeding those of the other
+    workers to `on_peer_job` makes their jobs visible and deduped here too. A
+    peer job not updated for `retention` seconds is forgotten.
+    """
+    def __init__(self, max_workers=2, retention=3600, id_prefix=None):
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                   thread_name_prefix='Job')
+        self.retention = retention
+        self.id_prefix = id_prefix
+        self.jobs = {}
+        self.inflight = {}
+        self.peer_jobs = {}
+        self.listeners = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _next_id(self):
+        n = next(self.ids)
+        return n if self.id_prefix is None else '{}-{}'.format(self.id_prefix, n)
+
+    def _notify(self, job):
+        state = job.to_dict()
+        for listener in self.listeners:
+            try:
+                listener(job.key, state)
+            except Exception as exc:
+                logger.warning('Job {} cannot notify its state: {}'.format(job.id, exc))
+
+    def _prune_no_lock(self):
+        expired = time.time() - self.retention
+        for job_id, job in list(self.jobs.items()):
+            if job.done and job.finished_at < expired:
+                self.jobs.pop(job_id)
+        for job_id, job in list(self.peer_jobs.items()):
+            if job.updated_at < expired:
+                self.peer_jobs.pop(job_id)
+
+    def _run(self, job):
+        try:
+            job.run(on_start=lambda: self._notify(job))
+        finally:
+            with self.lock:
+                if self.inflight.get(job.key, None) is job:
+                    self.inflight.pop(job.key)
+            self._notify(job)
+
+    def on_peer_job(self, key, state):
+        job = PeerJob(key, state)
+        with self.lock:
+            self.peer_jobs[job.id] = job
+
+    def _peer_inflight_no_lock(self, key):
+        for job in self.peer_jobs.values():
+            if job.key == key and not job.done:
+                return job
+        return None
+
+    def submit(self, kind, key, func, progress=None, **kwargs):
+        with self.lock:
+            self._prune_no_lock()
+            job = self.inflight.get(key, None) or self._peer_inflight_no_lock(key)
+            if job is not None:
+                logger.info('Job {} {} is in flight, dedupe {}'.format(job.id, kind, kwargs))
+                return job, False
+            job = Job(self._next_id(), kind, key, func, progress=progress, **kwargs)
+            self.jobs[job.id] = job
+            self.inflight[key] = job
+        self._notify(job)
+        self.executor.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id):
+        return self.jobs.get(job_id, None) or self.peer_jobs.get(job_id, None)
+
+    def stats(self):
+        with self.lock:
+            self._prune_no_lock()
+            jobs = list(self.jobs.values()) + list(self.peer_jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from milvus.grpc_gen import milvus_pb2, status_pb2
+from mishards import exceptions
+
+logger = logging.getLogger(__name__)
+
+SEARCH = 'search'
+WRITE = 'write'
+ADMIN = 'admin'
+
+# Methods not listed here run in the search lane
+METHOD_LANES = {
+    'Insert': WRITE,
+    'DeleteByID': WRITE,
+    'CreateCollection': WRITE,
+    'CreatePartition': WRITE,
+    'DropPartition': WRITE,
+    'InsertEntity': WRITE,
+    'DeleteEntitiesByID': WRITE,
+    'CreateHybridCollection': WRITE,
+    'CreateIndex': ADMIN,
+    'DropIndex': ADMIN,
+    'Compact': ADMIN,
+    'Flush': ADMIN,
+    'PreloadCollection': ADMIN,
+    'PreloadHybridCollection': ADMIN,
+    'ReloadSegments': ADMIN,
+    'DropCollection': ADMIN,
+    'DropHybridCollection': ADMIN,
+}
+
+_service = milvus_pb2.DESCRIPTOR.services_by_name['MilvusService']
+
+
+# Latency of these methods drives an adaptive lane limit
+SAMPLED_METHODS = {'Search', 'SearchInFiles', 'SearchByID'}
+
+
+def lane_of(method_name):
+    return METHOD_LANES.get(method_name, SEARCH)
+
+
+def resp_class_of(method_name):
+    method = _service.methods_by_name.get(method_name, None)
+    if method is None:
+        return None
+    module = status_pb2 if method.output_type.name == 'Status' else milvus_pb2
+    return getattr(module, method.output_type.name, None)
+
+
+class Lane:
+    """Bounds the requests of one class of RPCs.
+
+    At most `workers` requests run at the same time and at most `queue` more wait
+    up to `timeout` seconds for a slot. Anything beyond that is rejected at once
+    with LaneOverloadError, so the lane never holds more than `workers + queue`
+    threads of the server pool. With a `limiter`, `workers` follows the limit the
+    limiter derives from the latency of sampled requests, up to its `max_limit`.
+    """
+    def __init__(self, name, workers, queue=0, timeout=None, limiter=None):
+        self.name = name
+        self.limiter = limiter
+        self.workers = int(limiter.limit) if limiter else workers
+        self.queue = queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.cv = threading.Condition()
+
+    @property
+    def capacity(self):
+        workers = self.limiter.max_limit if self.limiter else self.workers
+        return workers + self.queue
+
+    def _reject(self, reason, metadata):
+        self.rejected += 1
+        raise exceptions.LaneOverloadError(
+            message='Lane {} is overloaded: {}'.format(self.name, reason), metadata=metadata)
+
+    def acquire(self, metadata=None):
+        with self.cv:
+            if self.running < self.workers:
+                self.running += 1
+                return
+            if self.waiting >= self.queue:
+                self._reject('{} running, {} waiting'.format(self.running, self.waiting), metadata)
+            self.waiting += 1
+            try:
+                ok = self.cv.wait_for(lambda: self.running < self.workers, self.timeout)
+            finally:
+                self.waiting -= 1
+            if not ok:
+                self._reject('waited over {}s'.format(self.timeout), metadata)
+            self.running += 1
+
+    def release(self, rtt=None):
+        with self.cv:
+            inflight = self.running
+            self.running -= 1
+            if rtt is not None and self.limiter:
+                workers = self.limiter.on_sample(rtt, inflight)
+                if workers > self.workers:
+                    self.cv.notify(workers - self.workers)
+                self.workers = workers
+            self.cv.notify()
+
+    @contextmanager
+    def enter(self, metadata=None, sample=False):
+        self.acquire(metadata=metadata)
+        start = time.time()
+        rtt = None
+        try:
+            yield self
+            rtt = time.time() - start if sample else None
+        finally:
+            self.release(rtt=rtt)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue': self.queue,
+            'running': self.running,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+            'limiter': self.limiter.stats() if self.limiter else None
+        }
+
+
+class Lanes:
+    def __init__(self, lanes):
+        self.lanes = {lane.name: lane for lane in lanes}
+
+    @property
+    def capacity(self):
+        return sum(lane.capacity for lane in self.lanes.values())
+
+    def get(self, method_name):
+        return self.lanes[lane_of(method_name)]
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self.lanes.items()}
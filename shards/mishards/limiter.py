@@ -0,0 +1,52 @@
+import math
+
+
+class GradientLimit:
+    """Concurrency limit following the gradient of request latency.
+
+    A fast EWMA of the latency is compared with a slow one tracking the no-load
+    baseline. While latency stays near the baseline the limit grows by about
+    sqrt(limit) per sample; once requests start to queue somewhere and latency
+    rises, the limit shrinks in proportion, down to half per sample. Samples taken
+    while less than half the limit is in use do not grow the limit, as they say
+    nothing about the capacity. Not thread safe, callers serialise `on_sample`.
+    """
+    def __init__(self, initial, min_limit=1, max_limit=1000, tolerance=1.5,
+                 smoothing=0.2, short_window=10, long_window=600):
+        self.limit = float(max(min_limit, min(max_limit, initial)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.short_alpha = 2.0 / (short_window + 1)
+        self.long_alpha = 2.0 / (long_window + 1)
+        self.short_rtt = None
+        self.long_rtt = None
+
+    def on_sample(self, rtt, inflight):
+        if self.short_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+            return int(self.limit)
+
+        self.short_rtt = self.short_alpha * rtt + (1 - self.short_alpha) * self.short_rtt
+        self.long_rtt = self.long_alpha * rtt + (1 - self.long_alpha) * self.long_rtt
+
+        # The baseline drifted up under sustained load, let it recover faster
+        if self.long_rtt > 2 * self.short_rtt:
+            self.long_rtt *= 0.95
+
+        if inflight < self.limit / 2:
+            return int(self.limit)
+
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        new_limit = self.limit * (1 - self.smoothing) + new_limit * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, new_limit))
+        return int(self.limit)
+
+    def stats(self):
+        return {
+            'limit': round(self.limit, 2),
+            'short_rtt': None if self.short_rtt is None else round(self.short_rtt, 4),
+            'long_rtt': None if self.long_rtt is None else round(self.long_rtt, 4)
+        }
@@ -1,15 +1,31 @@
 import os
 import sys
+import time
+import signal
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import_start = time.perf_counter()
 from mishards import (settings, create_app)
+import_time = time.perf_counter() - import_start
 
 
-def main():
-    server = create_app(settings.DefaultConfig)
+def run_worker(bus=None):
+    server = create_app(settings.DefaultConfig, bus=bus)
+    server.startup_timer.add('imports', import_time)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
     server.run(port=settings.SERVER_PORT)
     return 0
 
 
+def main():
+    if settings.WORKER_PROCESSES <= 1:
+        return run_worker()
+
+    from mishards.workers import Master
+    master = Master(settings.WORKER_PROCESSES, run_worker,
+                    stats_interval=settings.WORKER_STATS_INTERVAL)
+    return master.run()
+
+
 if __name__ == '__main__':
     sys.exit(main())
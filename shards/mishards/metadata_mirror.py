@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+from array import array
+from collections import namedtuple
+from sqlalchemy import select
+from sqlalchemy import exc as sqlalchemy_exc
+from mishards.models import Tables, TableFiles
+
+logger = logging.getLogger(__name__)
+
+FileRow = namedtuple('FileRow', ['id', 'table_id', 'file_type', 'file_size', 'row_count', 'updated_time'])
+TableRow = namedtuple('TableRow', ['table_id', 'owner_table', 'partition_tag', 'state'])
+
+SEARCHABLE_FILE_TYPES = (TableFiles.FILE_TYPE_RAW, TableFiles.FILE_TYPE_TO_INDEX, TableFiles.FILE_TYPE_INDEX)
+
+TABLE_COLUMNS = [Tables.table_id, Tables.owner_table, Tables.partition_tag, Tables.state]
+FILE_COLUMNS = [TableFiles.id, TableFiles.table_id, TableFiles.file_type, TableFiles.file_size,
+                TableFiles.row_count, TableFiles.updated_time, TableFiles.date]
+
+
+class FileArray:
+    """Segments of one table kept column by column in typed arrays"""
+    def __init__(self, table_id):
+        self.table_id = table_id
+        self.positions = {}
+        self.ids = array('q')
+        self.types = array('b')
+        self.sizes = array('q')
+        self.rows = array('q')
+        self.updated = array('q')
+        self.dates = array('q')
+        self.version = 0
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, file_id, file_type, file_size, row_count, updated_time, date):
+        values = (file_id, file_type or 0, file_size or 0, row_count or 0, updated_time or 0, date or 0)
+        pos = self.positions.get(file_id, None)
+        if pos is None:
+            self.positions[file_id] = len(self.ids)
+            for column, value in zip(self.columns(), values):
+                column.append(value)
+        else:
+            for column, value in zip(self.columns(), values):
+                column[pos] = value
+        self.version += 1
+
+    def columns(self):
+        return self.ids, self.types, self.sizes, self.rows, self.updated, self.dates
+
+    def searchable(self, prune_empty=True, range_array=None):
+        key = (self.version, prune_empty)
+        if not range_array and key in self.cache:
+            return self.cache[key]
+
+        files = []
+        for pos in range(len(self.ids)):
+            if self.types[pos] not in SEARCHABLE_FILE_TYPES:
+                continue
+            if prune_empty and self.rows[pos] <= 0:
+                continue
+            if range_array and not any(low <= self.dates[pos] < high for low, high in range_array):
+                continue
+            files.append(FileRow(self.ids[pos], self.table_id, self.types[pos], self.sizes[pos],
+                                 self.rows[pos], self.updated[pos]))
+        if not range_array:
+            self.cache = {key: files}
+        return files
+
+
+class MetadataMirror:
+    """In-memory copy of the Tables and TableFiles rows routing reads.
+
+    `start` loads everything once. A background thread then polls, every
+    `poll_interval` seconds, the whole Tables table, which is small, and the
+    TableFiles rows updated since the last watermark. Rows removed from the
+    database are only noticed by a full reload every `reconcile_interval`
+    seconds, until then their file type already keeps them out of searches.
+    The mirror is `ready` while its last successful sync is less than
+    `max_staleness` seconds old, callers query the database otherwise.
+    """
+    # Rows committed late with an older updated_time than the watermark are
+    # caught by re-reading this many microseconds, upserts are idempotent
+    WATERMARK_OVERLAP = 1000000
+
+    def __init__(self, db, poll_interval=1.0, reconcile_interval=300, max_staleness=30):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.max_staleness = max_staleness
+        self.tables = {}
+        self.partitions = {}
+        self.files = {}
+        self.watermark = 0
+        self.synced_at = None
+        self.reconciled_at = None
+        self.polls = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def ready(self):
+        return self.synced_at is not None and time.time() - self.synced_at < self.max_staleness
+
+    def _fetch(self, stmt):
+        with self.db.read_engine().connect() as conn:
+            return conn.execute(stmt).fetchall()
+
+    def _load_tables(self):
+        tables = {}
+        partitions = {}
+        for row in self._fetch(select(TABLE_COLUMNS)):
+            table = TableRow(row.table_id, row.owner_table, row.partition_tag, row.state)
+            tables[table.table_id] = table
+            if table.owner_table:
+                partitions.setdefault(table.owner_table, []).append(table)
+        return tables, partitions
+
+    def reconcile(self):
+        start = time.time()
+        tables, partitions = self._load_tables()
+        files = {}
+        watermark = 0
+        for row in self._fetch(select(FILE_COLUMNS)):
+            file_array = files.get(row.table_id, None)
+            if file_array is None:
+                file_array = files[row.table_id] = FileArray(row.table_id)
+            file_array.upsert(row.id, row.file_type, row.file_size, row.row_count, row.updated_time, row.date)
+            watermark = max(watermark, row.updated_time or 0)
+
+        with self.lock:
+            self.tables, self.partitions, self.files = tables, partitions, files
+            self.watermark = watermark
+            self.synced_at = self.reconciled_at = start
+        logger.info('Metadata mirror loads %s tables and %s files in %.3fs', len(tables),
+                    sum(len(f) for f in files.values()), time.time() - start)
+
+    def poll(self):
+        start = time.time()
+        tables, partitions = self._load_tables()
+        rows = self._fetch(select(FILE_COLUMNS).where(
+            TableFiles.updated_time > self.watermark - self.WATERMARK_OVERLAP))
+
+        with self.lock:
+            self.tables, self.partitions = tables, partitions
+            for row in rows:
+                file_array = self.files.get(row.table_id, None)
+                if file_array is None:
+                    file_array = self.files[row.table_id] = FileArray(row.table_id)
+                file_array.upsert(row.id, row.file_type, row.file_size, row.row_count, row.updated_time, row.date)
+                self.watermark = max(self.watermark, row.updated_time or 0)
+            self.synced_at = start
+        self.polls += 1
+
+    def _run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                if time.time() - self.reconciled_at >= self.reconcile_interval:
+                    self.reconcile()
+                else:
+                    self.poll()
+            except sqlalchemy_exc.SQLAlchemyError as e:
+                logger.warning('Metadata mirror cannot sync: %s', e)
+
+    def start(self):
+        try:
+            self.reconcile()
+        except sqlalchemy_exc.SQLAlchemyError as e:
+            # Keep polling, routing reads the database until the mirror syncs
+            logger.error('Metadata mirror cannot load: %s', e)
+            self.reconciled_at = 0
+        self.thread = threading.Thread(target=self._run, name='MetadataMirror', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def collections(self, collection_name):
+        """Rows of the collection and of its partitions, deleted ones excluded"""
+        with self.lock:
+            table = self.tables.get(collection_name, None)
+            partitions = self.partitions.get(collection_name, [])
+        rows = [table] if table else []
+        rows += partitions
+        return [row for row in rows if row.state != Tables.TO_DELETE]
+
+    def collection_names(self):
+        with self.lock:
+            tables = list(self.tables.values())
+        return [table.table_id for table in tables if not table.owner_table and table.state != Tables.TO_DELETE]
+
+    def query_files(self, table_ids, range_array=None, prune_empty=True):
+        files = []
+        with self.lock:
+            for table_id in table_ids:
+                file_array = self.files.get(table_id, None)
+                if file_array is not None:
+                    files.extend(file_array.searchable(prune_empty=prune_empty, range_array=range_array))
+        return files
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'tables': len(self.tables),
+            'files': sum(len(f) for f in list(self.files.values())),
+            'watermark': self.watermark,
+            'synced_ago': None if self.synced_at is None else round(time.time() - self.synced_at, 3),
+            'polls': self.polls
+        }
@@ -1,7 +1,7 @@
 import logging
 from sqlalchemy import (Integer, Boolean, Text,
                         String, BigInteger, and_, or_,
-                        Column)
+                        Column, Index)
 from sqlalchemy.orm import relationship, backref
 
 from mishards import db
@@ -20,6 +20,9 @@ class TableFiles(db.Model):
     FILE_TYPE_BACKUP = 7
 
     __tablename__ = 'TableFiles'
+    __table_args__ = (
+        Index('idx_tablefiles_table_id_file_type', 'table_id', 'file_type'),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     table_id = Column(String(50))
@@ -40,12 +43,31 @@ class TableFiles(db.Model):
         backref=backref('files', uselist=True, lazy='dynamic')
     )
 
+    @classmethod
+    def files_to_search_cond(cls, date_range=None):
+        cond = cls.file_type.in_([
+            cls.FILE_TYPE_RAW,
+            cls.FILE_TYPE_TO_INDEX,
+            cls.FILE_TYPE_INDEX,
+        ])
+        if date_range:
+            cond = and_(
+                cond,
+                or_(
+                    and_(cls.date >= d[0], cls.date < d[1]) for d in date_range
+                )
+            )
+        return cond
+
 
 class Tables(db.Model):
     TO_DELETE = 1
     NORMAL = 0
 
     __tablename__ = 'Tables'
+    __table_args__ = (
+        Index('idx_tables_owner_table_state', 'owner_table', 'state'),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     table_id = Column(String(50), unique=True)
@@ -63,18 +85,7 @@ class Tables(db.Model):
     flush_lsn = Column(Integer)
 
     def files_to_search(self, date_range=None):
-        cond = or_(
-            TableFiles.file_type == TableFiles.FILE_TYPE_RAW,
-            TableFiles.file_type == TableFiles.FILE_TYPE_TO_INDEX,
-            TableFiles.file_type == TableFiles.FILE_TYPE_INDEX,
-        )
-        if date_range:
-            cond = and_(
-                cond,
-                or_(
-                    and_(TableFiles.date >= d[0], TableFiles.date < d[1]) for d in date_range
-                )
-            )
+        cond = TableFiles.files_to_search_cond(date_range)
 
         files = self.files.filter(cond)
 
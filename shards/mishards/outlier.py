@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+import statistics
+import grpc
+from mishards.grpc_utils import add_done_callback
+
+logger = logging.getLogger(__name__)
+
+
+class NodeHealth:
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.ejections = 0
+
+    def record(self, latency, ok):
+        self.samples += 1
+        if ok:
+            self.latency = latency if self.latency is None else \
+                self.alpha * latency + (1 - self.alpha) * self.latency
+        self.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+
+    def reset(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+    def to_dict(self):
+        return {
+            'latency': None if self.latency is None else round(self.latency, 4),
+            'error_rate': round(self.error_rate, 4),
+            'samples': self.samples,
+            'ejections': self.ejections
+        }
+
+
+class OutlierDetector:
+    """Ejects readonly nodes that are much slower or fail much more than their peers.
+
+    Every shard call updates an EWMA of the node's latency and error rate. Once a node
+    has `min_requests` samples, it is ejected from routing when its error rate is over
+    `error_rate`, or when its latency is over `latency_factor` times the median of its
+    routable peers and over `min_latency`. An ejection lasts `base_ejection` seconds,
+    doubled for each consecutive ejection up to `max_ejection`. When it ends the node
+    is routable again with fresh stats; staying healthy for `min_requests` calls
+    clears its ejection count. At most `max_ejected_percent` of the nodes are ejected.
+    """
+    def __init__(self, topo, alpha=0.2, latency_factor=3.0, min_latency=0.05, error_rate=0.5,
+                 min_requests=20, base_ejection=30, max_ejection=300, max_ejected_percent=34):
+        self.topo = topo
+        self.alpha = alpha
+        self.latency_factor = latency_factor
+        self.min_latency = min_latency
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+        self.max_ejected_percent = max_ejected_percent
+        self.nodes = {}
+        # SDK future -> (host, start) of the tracked calls still running
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def _health_no_lock(self, host):
+        health = self.nodes.get(host, None)
+        if health is None:
+            for name in [name for name in self.nodes if self.topo.get_group(name) is None]:
+                self.nodes.pop(name)
+            health = self.nodes[host] = NodeHealth(self.alpha)
+        return health
+
+    def _is_outlier_no_lock(self, host, health):
+        if health.samples < self.min_requests:
+            return False
+        if health.error_rate > self.error_rate:
+            return True
+        if health.latency is None or health.latency <= self.min_latency:
+            return False
+        peers = [self.nodes[name].latency for name in self.topo.routable_names
+                 if name != host and name in self.nodes and self.nodes[name].latency is not None]
+        if not peers:
+            return False
+        return health.latency > self.latency_factor * statistics.median(peers)
+
+    def _can_eject_no_lock(self):
+        members = list(self.topo.group_names)
+        ejected = len(members) - len(self.topo.routable_names)
+        return (ejected + 1) * 100 <= len(members) * self.max_ejected_percent
+
+    def record(self, host, latency, ok):
+        with self.lock:
+            health = self._health_no_lock(host)
+            if self.topo.ejected.get(host, None) is not None and not self.topo.is_ejected(host):
+                # Back from ejection, judge the node on its new calls only
+                self.topo.readmit(host)
+                health.reset()
+            health.record(latency, ok)
+
+            if not self._is_outlier_no_lock(host, health):
+                if health.ejections and health.samples >= self.min_requests:
+                    logger.info('Node <{}> is healthy again'.format(host))
+                    health.ejections = 0
+                return False
+            if self.topo.is_ejected(host) or not self._can_eject_no_lock():
+                return False
+
+            health.ejections += 1
+            duration = min(self.max_ejection, self.base_ejection * 2 ** (health.ejections - 1))
+            logger.warning('Node <{}> is an outlier: {}'.format(host, health.to_dict()))
+            self.topo.eject(host, duration)
+            health.reset()
+            return True
+
+    def track(self, host, future, start=None):
+        """Record the outcome of an async shard call once it is done"""
+        start = time.time() if start is None else start
+        with self.lock:
+            self.pending[future] = (host, start)
+
+        def on_done(grpc_future):
+            with self.lock:
+                tracked = self.pending.pop(future, None)
+            # Dropped calls are recorded by `drop`, calls cancelled because the client went away say nothing
+            if tracked is None or grpc_future.cancelled():
+                return
+            exc = grpc_future.exception()
+            if exc is not None:
+                # A call cut short by the deadline took at least that long, keep it as a latency sample
+                ok = isinstance(exc, grpc.RpcError) and exc.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+            else:
+                ok = grpc_future.result().status.error_code == 0
+            self.record(host, time.time() - start, ok)
+
+        add_done_callback(future, on_done)
+
+    def drop(self, future):
+        """Record a tracked call the proxy stops waiting for, as slow as it has been so far"""
+        with self.lock:
+            tracked = self.pending.pop(future, None)
+        if tracked is not None:
+            host, start = tracked
+            self.record(host, time.time() - start, True)
+
+    def stats(self):
+        with self.lock:
+            return {host: health.to_dict() for host, health in self.nodes.items()}
@@ -0,0 +1,193 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from mishards.grpc_utils import add_done_callback
+
+
+class RequestTimer:
+    """Accumulates the wall time a single request spends in each stage.
+
+    Every stage, lap and tracked call is also kept as a span, a
+    (name, start offset, duration, tags) tuple, for the slow request recorder.
+    """
+    def __init__(self):
+        self.wall_start = time.time()
+        self.start = self.mark = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.spans = []
+
+    def add_span(self, name, start, end, tags=None):
+        self.spans.append((name, start - self.start, end - start, tags))
+
+    def lap(self, name=None):
+        """Charge the time since the previous lap to `name`, or drop it if no name"""
+        now = time.perf_counter()
+        if name:
+            self.stages[name] += now - self.mark
+            self.add_span(name, self.mark, now)
+        self.mark = now
+
+    @contextmanager
+    def stage(self, name, **tags):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.stages[name] += end - start
+            self.add_span(name, start, end, tags or None)
+
+    def add(self, name, elapsed):
+        self.stages[name] += elapsed
+
+    def track(self, name, future, **tags):
+        """Keep a span of an async SDK call, ending when its gRPC future is done"""
+        start = time.perf_counter()
+        add_done_callback(future, lambda _: self.add_span(name, start, time.perf_counter(), tags or None))
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+# Latencies exported to other workers are counted in buckets growing by 2%, percentiles merged
+# from them are within 1% of the exact ones
+HISTOGRAM_BASE = 1.02
+HISTOGRAM_FLOOR = 1e-6
+
+
+def _bucket(value):
+    return int(math.floor(math.log(max(value, HISTOGRAM_FLOOR), HISTOGRAM_BASE)))
+
+
+def _bucket_percentile(buckets, count, p):
+    rank = int(round(p / 100.0 * (count - 1)))
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen > rank:
+            return HISTOGRAM_BASE ** (bucket + 0.5)
+    return None
+
+
+class PerfStats:
+    """Rolling per collection and stage latency summaries over the last `window` requests.
+
+    `export` condenses the samples into histograms other workers can `merge`
+    with their own into one summary.
+    """
+    def __init__(self, window=1024):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, collection_name, timer):
+        total = timer.total()
+        with self.lock:
+            stages = self.samples.get(collection_name, None)
+            if stages is None:
+                stages = self.samples[collection_name] = defaultdict(lambda: deque(maxlen=self.window))
+            for name, elapsed in timer.stages.items():
+                stages[name].append(elapsed)
+            stages['total'].append(total)
+
+    def summary(self):
+        with self.lock:
+            snapshot = {collection_name: {name: list(values) for name, values in stages.items()}
+                        for collection_name, stages in self.samples.items()}
+
+        out = {}
+        for collection_name, stages in snapshot.items():
+            out[collection_name] = {}
+            for name, values in stages.items():
+                values.sort()
+                out[collection_name][name] = {
+                    'count': len(values),
+                    'mean': round(sum(values) / len(values), 6),
+                    'p50': round(percentile(values, 50), 6),
+                    'p90': round(percentile(values, 90), 6),
+                    'p99': round(percentile(values, 99), 6),
+                    'max': round(values[-1], 6)
+                }
+        return out
+
+    def export(self):
+        with self.lock:
+            snapshot = {collection_name: {name: list(values) for name, values in stages.items()}
+                        for collection_name, stages in self.samples.items()}
+
+        out = {}
+        for collection_name, stages in snapshot.items():
+            out[collection_name] = {}
+            for name, values in stages.items():
+                buckets = defaultdict(int)
+                for value in values:
+                    buckets[_bucket(value)] += 1
+                out[collection_name][name] = {'count': len(values), 'sum': sum(values),
+                                              'max': max(values), 'buckets': dict(buckets)}
+        return out
+
+    @staticmethod
+    def merge(exports):
+        merged = {}
+        for export in exports:
+            for collection_name, stages in export.items():
+                for name, hist in stages.items():
+                    into = merged.setdefault(collection_name, {}).setdefault(
+                        name, {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': defaultdict(int)})
+                    into['count'] += hist['count']
+                    into['sum'] += hist['sum']
+                    into['max'] = max(into['max'], hist['max'])
+                    for bucket, count in hist['buckets'].items():
+                        into['buckets'][bucket] += count
+
+        out = {}
+        for collection_name, stages in merged.items():
+            out[collection_name] = {}
+            for name, hist in stages.items():
+                count = hist['count']
+                out[collection_name][name] = {'count': count, 'mean': round(hist['sum'] / count, 6)}
+                for p in (50, 90, 99):
+                    value = min(hist['max'], _bucket_percentile(hist['buckets'], count, p))
+                    out[collection_name][name]['p{}'.format(p)] = round(value, 6)
+                out[collection_name][name]['max'] = round(hist['max'], 6)
+        return out
+
+
+class SlowRequestRecorder:
+    """Keeps the span trees of the latest `capacity` requests slower than `threshold` or failed"""
+    def __init__(self, threshold=1.0, capacity=100):
+        self.threshold = threshold
+        self.records = deque(maxlen=capacity)
+
+    def observe(self, method, collection_name, timer, error=None):
+        total = timer.total()
+        if total < self.threshold and error is None:
+            return None
+        record = {
+            'time': timer.wall_start,
+            'method': method,
+            'collection': collection_name,
+            'total': round(total, 6),
+            'error': error,
+            'spans': [{'name': name, 'start': round(start, 6), 'duration': round(duration, 6), 'tags': tags}
+                      for name, start, duration, tags in sorted(list(timer.spans), key=lambda span: span[1])]
+        }
+        self.records.append(record)
+        return record
+
+    def list(self):
+        return list(self.records)
+
+    @staticmethod
+    def merge(record_lists, capacity):
+        records = [record for records in record_lists for record in records]
+        return sorted(records, key=lambda record: record['time'])[-capacity:]
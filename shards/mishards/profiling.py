@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_name, code.co_firstlineno)
+
+
+def _report_path(output_dir, kind, ext):
+    os.makedirs(output_dir, exist_ok=True)
+    now = time.time()
+    name = 'mishards-{}-{}-{}.{:03d}.{}'.format(kind, os.getpid(), time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+                                               int(now * 1000) % 1000, ext)
+    return os.path.join(output_dir, name)
+
+
+class _Window:
+    """Runs `on_expire` once after `duration` seconds unless cancelled first"""
+    def __init__(self, duration, on_expire):
+        self.started_at = time.time()
+        self.duration = duration
+        self.timer = threading.Timer(duration, on_expire)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def remaining(self):
+        return max(0.0, self.started_at + self.duration - time.time())
+
+    def cancel(self):
+        self.timer.cancel()
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads every `interval` seconds.
+
+    cProfile only instruments the thread that enables it, so the stacks of the
+    gRPC worker threads are sampled from a separate thread instead. A run stops
+    by itself after at most `max_duration` seconds and its reports are written
+    to `output_dir`: a collapsed stack file for flame graphs and a flat summary
+    of the functions seen most often, on CPU or not.
+    """
+    def __init__(self, output_dir, interval=0.01, max_duration=300):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_duration = max_duration
+        self.stacks = Counter()
+        self.samples = 0
+        self.window = None
+        self.thread = None
+        self.stop_event = None
+        self.last_reports = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.window is not None
+
+    def _sample(self, stop_event):
+        me = threading.get_ident()
+        while not stop_event.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self, duration=None):
+        duration = min(self.max_duration, duration or self.max_duration)
+        if duration <= 0:
+            raise ValueError('Profile duration should be positive')
+        with self.lock:
+            if self.running:
+                raise ValueError('Profiler is already running, {:.0f}s left'.format(self.window.remaining()))
+            self.stacks = Counter()
+            self.samples = 0
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self._sample, args=(self.stop_event,),
+                                           name='Profiler', daemon=True)
+            self.thread.start()
+            self.window = _Window(duration, self._expire)
+        logger.info('Profiler started for %ss', duration)
+        return self.stats()
+
+    def _expire(self):
+        try:
+            self.stop()
+        except ValueError:
+            # Stopped by hand meanwhile
+            return
+        logger.warning('Profiler reached its time limit and was stopped')
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                raise ValueError('Profiler is not running')
+            self.window.cancel()
+            self.window = None
+            self.stop_event.set()
+            self.thread.join()
+            self.last_reports = self._write_reports()
+        logger.info('Profiler stopped after %s samples: %s', self.samples, self.last_reports)
+        return self.stats()
+
+    def _write_reports(self):
+        collapsed = _report_path(self.output_dir, 'profile', 'collapsed')
+        with open(collapsed, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+        own = Counter()
+        cumulative = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                cumulative[name] += count
+
+        summary = _report_path(self.output_dir, 'profile', 'txt')
+        total = sum(self.stacks.values()) or 1
+        with open(summary, 'w') as f:
+            f.write('{} samples every {}s\n\n'.format(self.samples, self.interval))
+            f.write('{:>8} {:>8}  {}\n'.format('own%', 'cum%', 'function'))
+            for name, _ in cumulative.most_common(100):
+                f.write('{:>8.2f} {:>8.2f}  {}\n'.format(100.0 * own[name] / total,
+                                                          100.0 * cumulative[name] / total, name))
+        return [collapsed, summary]
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'remaining': round(self.window.remaining(), 1) if self.running else None,
+            'samples': self.samples,
+            'reports': self.last_reports
+        }
+
+
+class HeapTracer:
+    """Traces allocations with tracemalloc for at most `max_duration` seconds.
+
+    Each snapshot writes the `top` allocation sites to `output_dir`, and the
+    growth since the previous snapshot of the same run.
+    """
+    def __init__(self, output_dir, max_duration=300, frames=1, top=50):
+        self.output_dir = output_dir
+        self.max_duration = max_duration
+        self.frames = frames
+        self.top = top
+        self.window = None
+        self.previous = None
+        self.last_report = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.window is not None
+
+    def start(self, duration=None):
+        duration = min(self.max_duration, duration or self.max_duration)
+        if duration <= 0:
+            raise ValueError('Heap trace duration should be positive')
+        with self.lock:
+            if self.running:
+                raise ValueError('Heap tracing is already running, {:.0f}s left'.format(self.window.remaining()))
+            if tracemalloc.is_tracing():
+                raise ValueError('tracemalloc is already enabled outside mishards')
+            tracemalloc.start(self.frames)
+            self.previous = None
+            self.window = _Window(duration, self._expire)
+        logger.info('Heap tracing started for %ss', duration)
+        return self.stats()
+
+    def _expire(self):
+        try:
+            self.stop()
+        except ValueError:
+            # Stopped by hand meanwhile
+            return
+        logger.warning('Heap tracing reached its time limit and was stopped')
+
+    def snapshot(self):
+        with self.lock:
+            if not self.running:
+                raise ValueError('Heap tracing is not running, start it with "heap start"')
+            return self._snapshot_no_lock()
+
+    def _snapshot_no_lock(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        path = _report_path(self.output_dir, 'heap', 'txt')
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path, 'w') as f:
+            f.write('traced {} bytes, peak {} bytes\n\n'.format(current, peak))
+            f.write('Top {} allocation sites\n'.format(self.top))
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                f.write('{}\n'.format(stat))
+            if self.previous is not None:
+                f.write('\nTop {} growths since the previous snapshot\n'.format(self.top))
+                for stat in snapshot.compare_to(self.previous, 'lineno')[:self.top]:
+                    f.write('{}\n'.format(stat))
+        self.previous = snapshot
+        self.last_report = path
+        logger.info('Heap snapshot written to %s', path)
+        return self.stats()
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                raise ValueError('Heap tracing is not running')
+            self.window.cancel()
+            try:
+                self._snapshot_no_lock()
+            finally:
+                self.window = None
+                self.previous = None
+                tracemalloc.stop()
+        logger.info('Heap tracing stopped')
+        return self.stats()
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'remaining': round(self.window.remaining(), 1) if self.running else None,
+            'report': self.last_report
+        }
@@ -1,14 +1,316 @@
-from mishards import exceptions
+import logging
+import re
+import time
+from collections import defaultdict
+from sqlalchemy import exc as sqlalchemy_exc
+from sqlalchemy import and_, or_, select
+from mishards import exceptions, db, settings
+from mishards.models import Tables, TableFiles
+from mishards.hash_ring import HashRing
+
+logger = logging.getLogger(__name__)
+
+
+# host -> {file_id: update_time} of the segments each readonly node has served or reloaded
+file_updatetime_map = defaultdict(dict)
+# Called with (host, {file_id: update_time}) whenever filter_file_to_update marks files updated
+file_update_listeners = []
+# Called with (host, {file_id: update_time}) whenever forget_file_updates drops files after a failed reload
+file_forget_listeners = []
+
+
+def filter_file_to_update(host, files_list):
+    host_files = file_updatetime_map[host]
+
+    file_need_update_list = []
+    updated = {}
+    for fl in files_list:
+        file_id, update_time = fl
+        pre_update_time = host_files.get(file_id, 0)
+
+        if pre_update_time >= update_time:
+            continue
+        logger.debug("[%s] file id: %s.  pre update time %s is small than %s",
+                     host, file_id, pre_update_time, update_time)
+        host_files[file_id] = update_time
+        updated[file_id] = update_time
+        # if pre_update_time > 0:
+        file_need_update_list.append(file_id)
+
+    if updated:
+        for listener in file_update_listeners:
+            listener(host, updated)
+
+    return file_need_update_list
+
+
+def borrow_files(owner, host, file_ids):
+    """Let `host` search files routed to `owner`, return those it has to reload first"""
+    owner_files = file_updatetime_map[owner]
+    files = [(file_id, owner_files[file_id]) for file_id in file_ids if file_id in owner_files]
+    return filter_file_to_update(host, files)
+
+
+def forget_file_updates(host, file_ids):
+    host_files = file_updatetime_map[host]
+    forgotten = {}
+    for file_id in file_ids:
+        update_time = host_files.pop(file_id, None)
+        if update_time is not None:
+            forgotten[file_id] = update_time
+
+    if forgotten:
+        for listener in file_forget_listeners:
+            listener(host, forgotten)
+
+
+def drop_file_updates(host, files):
+    """Forget files another worker failed to reload, unless they were reloaded since"""
+    host_files = file_updatetime_map[host]
+    for file_id, update_time in files.items():
+        if host_files.get(file_id, 0) <= update_time:
+            host_files.pop(file_id, None)
+
+
+def merge_file_updates(host, files):
+    host_files = file_updatetime_map[host]
+    for file_id, update_time in files.items():
+        if host_files.get(file_id, 0) < update_time:
+            host_files[file_id] = update_time
+
+
+# Routing reads these columns only, as plain rows instead of ORM entities
+ROUTING_FILE_COLUMNS = [TableFiles.id, TableFiles.table_id, TableFiles.file_type,
+                        TableFiles.file_size, TableFiles.row_count, TableFiles.updated_time]
+
+FILE_TYPE_NAMES = {getattr(TableFiles, name): name[len('FILE_TYPE_'):].lower()
+                   for name in dir(TableFiles) if name.startswith('FILE_TYPE_')}
+
+
+def dump_file_updates():
+    return {host: dict(files) for host, files in list(file_updatetime_map.items()) if files}
+
+
+def restore_file_updates(snapshot):
+    for host, files in snapshot.items():
+        merge_file_updates(host, files)
+
+
+def is_plain_tag(tag):
+    return not re.search(r'[.^$*+?{}\[\]\\|()]', tag)
+
+
+def is_file_warm(host, file_id, update_time):
+    return file_updatetime_map.get(host, {}).get(file_id, 0) >= update_time
 
 
 class RouterMixin:
     def __init__(self, writable_topo, readonly_topo):
         self.writable_topo = writable_topo
         self.readonly_topo = readonly_topo
+        # A MetadataMirror answering metadata lookups instead of the database once synced
+        self.mirror = None
+
+    @property
+    def mirror_ready(self):
+        return self.mirror is not None and self.mirror.ready
 
     def routing(self, collection_name, metadata=None, **kwargs):
         raise NotImplemented()
 
+    def assign(self, files, servers):
+        ring = HashRing(servers)
+        routing = {}
+        for f in files:
+            target_host = ring.get_node(str(f.id))
+            routing.setdefault(target_host, []).append((str(f.id), int(f.updated_time)))
+        return routing
+
+    def place(self, files, servers):
+        """Readonly node of each file, without reloading anything"""
+        return self.assign(files, servers)
+
+    def explain(self, collection_name, partition_tags=None, metadata=None):
+        """The routing plan of a search on the collection right now, as a dict.
+
+        Nothing is reloaded nor marked as reloaded, the plan only tells which
+        segments would be reloaded first.
+        """
+        partitions = self.match_collections(collection_name, partition_tags=partition_tags, metadata=metadata)
+        files = self.query_files(collection_name, partition_tags=partition_tags, metadata=metadata)
+        servers = list(self.readonly_topo.routable_names)
+        placement = self.place(files, servers) if servers and files else {}
+
+        files_by_id = {str(f.id): f for f in files}
+        nodes = {}
+        for host, placed in placement.items():
+            node = nodes[host] = {'files': [], 'rows': 0, 'bytes': 0, 'reload_files': 0, 'reload_bytes': 0}
+            for file_id, update_time in placed:
+                f = files_by_id[file_id]
+                warm = is_file_warm(host, file_id, update_time)
+                node['files'].append({
+                    'id': file_id,
+                    'partition': f.table_id,
+                    'type': FILE_TYPE_NAMES.get(f.file_type, f.file_type),
+                    'rows': f.row_count,
+                    'bytes': f.file_size,
+                    'reload': not warm
+                })
+                node['rows'] += f.row_count or 0
+                node['bytes'] += f.file_size or 0
+                if not warm:
+                    node['reload_files'] += 1
+                    node['reload_bytes'] += f.file_size or 0
+
+        scanned = [node['bytes'] for node in nodes.values()]
+        mean = sum(scanned) / len(scanned) if scanned else 0
+        return {
+            'collection': collection_name,
+            'partition_tags': partition_tags,
+            'partitions': partitions,
+            'servers': servers,
+            'fan_out': len(nodes),
+            'files': len(files),
+            'rows': sum(node['rows'] for node in nodes.values()),
+            'bytes': sum(scanned),
+            'reload_files': sum(node['reload_files'] for node in nodes.values()),
+            'reload_bytes': sum(node['reload_bytes'] for node in nodes.values()),
+            # Bytes scanned by the busiest node over the mean, 1.0 is an even placement
+            'skew': round(max(scanned) / mean, 3) if mean else None,
+            'nodes': nodes
+        }
+
+    def collection_names(self, metadata=None):
+        if self.mirror_ready:
+            return self.mirror.collection_names()
+        cond = and_(or_(Tables.owner_table == None, Tables.owner_table == ''),
+                    Tables.state != Tables.TO_DELETE)
+        try:
+            collections = db.ReadSession.query(Tables.table_id).filter(cond).all()
+        except sqlalchemy_exc.SQLAlchemyError as e:
+            raise exceptions.DBError(message=str(e), metadata=metadata)
+        finally:
+            db.remove_read_session()
+        return [collection.table_id for collection in collections]
+
+    def prewarm(self, group, timeout=None):
+        """Reload the segments a joining group will own before it enters the ring"""
+        servers = list(self.readonly_topo.routable_names)
+        if not servers:
+            # Bootstrapping, there is no traffic to protect yet
+            return
+
+        start = time.time()
+        conn = group.get(group.name)
+        reloaded = 0
+        for collection_name in self.collection_names():
+            if timeout is not None and time.time() - start > timeout:
+                logger.warning('Prewarm group \"{}\" timeout after {}s'.format(group.name, timeout))
+                break
+            files = self.query_files(collection_name)
+            owned = self.assign(files, servers + [group.name]).get(group.name, [])
+            ud_files = filter_file_to_update(group.name, owned)
+            if not ud_files:
+                continue
+            status = conn.reload_segments(collection_name, ud_files)
+            if not status.OK():
+                logger.error('Prewarm {} on \"{}\" failed: {}'.format(collection_name, group.name, status.message))
+                forget_file_updates(group.name, ud_files)
+                continue
+            reloaded += len(ud_files)
+
+        logger.info('Prewarm group \"{}\" reloaded {} segments in {:.3f}s'.format(group.name, reloaded,
+                                                                                  time.time() - start))
+
+    def match_collections(self, collection_name, partition_tags=None, metadata=None):
+        """Table ids of the collection and the partitions `partition_tags` match"""
+        return self._match_collections(collection_name, partition_tags, metadata)[0]
+
+    def _query_collections(self, collection_name, partition_tags=None, metadata=None):
+        if self.mirror_ready:
+            collections = self.mirror.collections(collection_name)
+            # A collection created since the last poll is looked up in the database
+            if collections:
+                return collections, True
+
+        if not partition_tags:
+            cond = and_(
+                or_(Tables.table_id == collection_name, Tables.owner_table == collection_name),
+                Tables.state != Tables.TO_DELETE)
+        else:
+            # TODO: collection default partition is '_default'
+            cond = and_(Tables.state != Tables.TO_DELETE,
+                        Tables.owner_table == collection_name)
+            # Tags without regex syntax are prefix matches, let the database pre-filter them
+            if all(is_plain_tag(tag) for tag in partition_tags):
+                cond = and_(cond, or_(*[Tables.partition_tag.like('{}%'.format(tag))
+                                        for tag in partition_tags]))
+            # The collection itself is always fetched to tell a missing collection from unmatched tags
+            default_par_cond = and_(Tables.table_id == collection_name, Tables.state != Tables.TO_DELETE)
+            cond = or_(cond, default_par_cond)
+        try:
+            collections = db.ReadSession.execute(
+                select([Tables.table_id, Tables.partition_tag]).where(cond)).fetchall()
+        except sqlalchemy_exc.SQLAlchemyError as e:
+            raise exceptions.DBError(message=str(e), metadata=metadata)
+        return collections, False
+
+    def _match_collections(self, collection_name, partition_tags=None, metadata=None):
+        collections, mirrored = self._query_collections(collection_name, partition_tags, metadata)
+        if not collections:
+            logger.error("Cannot find collection {} / {} in metadata".format(collection_name, partition_tags))
+            raise exceptions.CollectionNotFoundError('{}:{}'.format(collection_name, partition_tags), metadata=metadata)
+
+        collection_list = []
+        if not partition_tags:
+            collection_list = [str(collection.table_id) for collection in collections]
+        else:
+            for collection in collections:
+                if collection.table_id == collection_name:
+                    if '_default' in partition_tags:
+                        collection_list.append(collection_name)
+                    continue
+
+                for tag in partition_tags:
+                    if re.match(tag, collection.partition_tag):
+                        collection_list.append(collection.table_id)
+                        break
+
+        return collection_list, mirrored
+
+    def query_files(self, collection_name, partition_tags=None, metadata=None, range_array=None, **kwargs):
+        # PXU TODO: Implement Thread-local Context
+        # PXU TODO: Session life mgt
+
+        collection_list, mirrored = self._match_collections(collection_name, partition_tags=partition_tags,
+                                                            metadata=metadata)
+        if not collection_list:
+            db.remove_read_session()
+            return []
+
+        if mirrored:
+            return self.mirror.query_files(collection_list, range_array=range_array,
+                                           prune_empty=settings.ROUTER_PRUNE_EMPTY_FILES)
+
+        file_cond = and_(TableFiles.files_to_search_cond(range_array),
+                         TableFiles.table_id.in_(collection_list))
+        if settings.ROUTER_PRUNE_EMPTY_FILES:
+            file_cond = and_(file_cond, TableFiles.row_count > 0)
+        try:
+            files = db.ReadSession.execute(select(ROUTING_FILE_COLUMNS).where(file_cond)).fetchall()
+        except sqlalchemy_exc.SQLAlchemyError as e:
+            raise exceptions.DBError(message=str(e), metadata=metadata)
+
+        if not files:
+            logger.warning("Collection file is empty. {}".format(collection_list))
+        #     logger.error("Cannot find collection file id {} / {} in metadata".format(collection_name, partition_tags))
+        #     raise exceptions.CollectionNotFoundError('Collection file id not found. {}:{}'.format(collection_name, partition_tags),
+        #                                              metadata=metadata)
+
+        db.remove_read_session()
+
+        return files
+
     def connection(self, metadata=None):
         # conn = self.writable_topo.get_group('default').get('WOSERVER').fetch()
         conn = self.writable_topo.get_group('default').get('WOSERVER')
@@ -0,0 +1,109 @@
+import logging
+from collections import defaultdict
+from mishards.router import (RouterMixin, filter_file_to_update,
+                             file_updatetime_map, is_file_warm)
+from mishards.hash_ring import HashRing
+from mishards import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Factory(RouterMixin):
+    """Hash ring router that prefers nodes which already have a segment warm.
+
+    Every file may be served by the first `candidates` distinct ring nodes of its id.
+    The ring owner is used when it is warm or when no candidate is warm. Otherwise the
+    file stays on a warm candidate and at most `max_migrations` files per owner and
+    routing call are handed over to their cold ring owner, so ownership converges to
+    the ring gradually instead of all at once after a topology change.
+    """
+    name = 'CacheAffinityRouter'
+
+    def __init__(self, writable_topo, readonly_topo, **kwargs):
+        super(Factory, self).__init__(writable_topo=writable_topo,
+                                      readonly_topo=readonly_topo)
+        self.candidates = max(1, kwargs.get('candidates', settings.ROUTER_AFFINITY_CANDIDATES))
+        self.max_migrations = kwargs.get('max_migrations', settings.ROUTER_AFFINITY_MAX_MIGRATIONS)
+
+    def routing(self, collection_name, partition_tags=None, metadata=None, **kwargs):
+        range_array = kwargs.pop('range_array', None)
+        return self._route(collection_name, range_array, partition_tags, metadata, **kwargs)
+
+    def _forget_departed(self, servers):
+        # A node which left the topology lost its cache, treat it as cold if it comes back
+        # Joining and draining nodes keep their cache
+        for host in list(file_updatetime_map.keys()):
+            if host not in servers and self.readonly_topo.get_group(host) is None:
+                file_updatetime_map.pop(host, None)
+
+    def _candidates(self, ring, file_id):
+        nodes = []
+        for node in ring.iterate_nodes(file_id):
+            if node is None:
+                break
+            nodes.append(node)
+            if len(nodes) >= self.candidates:
+                break
+        return nodes
+
+    def place(self, files, servers):
+        ring = HashRing(servers)
+        migrations = defaultdict(int)
+        routing = {}
+
+        for f in files:
+            file_id, update_time = str(f.id), int(f.updated_time)
+            nodes = self._candidates(ring, file_id)
+            owner = nodes[0]
+            target = owner
+            if not is_file_warm(owner, file_id, update_time):
+                warm = [node for node in nodes[1:] if is_file_warm(node, file_id, update_time)]
+                if warm:
+                    if migrations[owner] < self.max_migrations:
+                        migrations[owner] += 1
+                    else:
+                        target = warm[0]
+
+            routing.setdefault(target, []).append((file_id, update_time))
+
+        if migrations:
+            logger.debug('Migrating files to ring owners: %s', dict(migrations))
+
+        return routing
+
+    def _route(self, collection_name, range_array, partition_tags=None, metadata=None, **kwargs):
+        files = self.query_files(collection_name, partition_tags=partition_tags,
+                                 metadata=metadata, range_array=range_array)
+
+        servers = list(self.readonly_topo.routable_names)
+        logger.info('Available servers: %s', servers)
+        self._forget_departed(servers)
+
+        if not servers:
+            return {}
+
+        routing = self.place(files, servers)
+
+        filter_routing = {}
+        for host, filess in routing.items():
+            ud_files = filter_file_to_update(host, filess)
+            search_files = [f[0] for f in filess]
+            filter_routing[host] = (search_files, ud_files)
+
+        return filter_routing
+
+    @classmethod
+    def Create(cls, **kwargs):
+        writable_topo = kwargs.pop('writable_topo', None)
+        if not writable_topo:
+            raise RuntimeError('Cannot find \'writable_topo\' to initialize \'{}\''.format(cls.name))
+        readonly_topo = kwargs.pop('readonly_topo', None)
+        if not readonly_topo:
+            raise RuntimeError('Cannot find \'readonly_topo\' to initialize \'{}\''.format(cls.name))
+        router = cls(writable_topo=writable_topo, readonly_topo=readonly_topo, **kwargs)
+        return router
+
+
+def setup(app):
+    logger.info('Plugin \'{}\' Installed In Package: {}'.format(__file__, app.plugin_package_name))
+    app.on_plugin_setup(Factory)
@@ -3,15 +3,19 @@ import sys
 import grpc
 import time
 import socket
+import threading
 import inspect
 from urllib.parse import urlparse
 from functools import wraps
+from collections import defaultdict
 from concurrent import futures
 from grpc._cython import cygrpc
 import milvus
 from milvus.grpc_gen.milvus_pb2_grpc import add_MilvusServiceServicer_to_server
 from mishards.grpc_utils import is_grpc_method
 from mishards.service_handler import ServiceHandler
+from mishards.lanes import resp_class_of, SAMPLED_METHODS
+from mishards.perf import RequestTimer
 from mishards import settings
 
 logger = logging.getLogger(__name__)
@@ -23,6 +27,9 @@ class Server:
         self.grpc_methods = set()
         self.error_handlers = {}
         self.exit_flag = False
+        self.request_counter = defaultdict(int)
+        self.counter_lock = threading.Lock()
+        self.startup_timer = RequestTimer()
 
     def init_app(self,
                  writable_topo,
@@ -30,8 +37,11 @@ class Server:
                  tracer,
                  router,
                  discover,
+                 bus,
+                 lanes,
+                 outliers=None,
+                 snapshot=None,
                  port=19530,
-                 max_workers=10,
                  **kwargs):
         self.port = int(port)
         self.writable_topo = writable_topo
@@ -39,13 +49,22 @@ class Server:
         self.tracer = tracer
         self.router = router
         self.discover = discover
-
+        self.bus = bus
+        self.bus.register_stats_provider(self.stats)
+        self.lanes = lanes
+        self.outliers = outliers
+        self.snapshot = snapshot
+
+        # Every lane holds at most its workers plus its queue of pool threads
+        max_workers = self.lanes.capacity
         logger.debug('Init grpc server with max_workers: {}'.format(max_workers))
 
         self.server_impl = grpc.server(
             thread_pool=futures.ThreadPoolExecutor(max_workers=max_workers),
+            maximum_concurrent_rpcs=max_workers,
             options=[(cygrpc.ChannelArgKey.max_send_message_length, -1),
-                     (cygrpc.ChannelArgKey.max_receive_message_length, -1)])
+                     (cygrpc.ChannelArgKey.max_receive_message_length, -1),
+                     ('grpc.so_reuseport', 1)])
 
         self.server_impl = self.tracer.decorate(self.server_impl)
 
@@ -65,10 +84,17 @@ class Server:
         return func
 
     def wrap_method_with_errorhandler(self, func):
+        lane = self.lanes.get(func.__name__)
+        metadata = {'resp_class': resp_class_of(func.__name__)}
+        sample = func.__name__ in SAMPLED_METHODS
+
         @wraps(func)
         def wrapper(*args, **kwargs):
+            with self.counter_lock:
+                self.request_counter[func.__name__] += 1
             try:
-                return func(*args, **kwargs)
+                with lane.enter(metadata=metadata, sample=sample):
+                    return func(*args, **kwargs)
             except Exception as e:
                 if e.__class__ in self.error_handlers:
                     return self.error_handlers[e.__class__](e)
@@ -86,6 +112,17 @@ class Server:
             return wrapper
         return exception
 
+    def stats(self):
+        with self.counter_lock:
+            requests = dict(self.request_counter)
+        return {
+            'requests': requests,
+            'lanes': self.lanes.stats(),
+            'readonly_nodes': list(self.readonly_topo.group_names),
+            'ejected_nodes': [name for name in list(self.readonly_topo.group_names)
+                              if self.readonly_topo.is_ejected(name)]
+        }
+
     def on_pre_run(self):
         for handler in self.pre_run_handlers:
             handler()
@@ -93,23 +130,38 @@ class Server:
 
     def start(self, port=None):
         handler_class = self.decorate_handler(ServiceHandler)
-        add_MilvusServiceServicer_to_server(
-            handler_class(tracer=self.tracer,
-                          router=self.router), self.server_impl)
+        self.handler = handler_class(tracer=self.tracer, router=self.router, bus=self.bus,
+                                     outliers=self.outliers, snapshot=self.snapshot)
+        add_MilvusServiceServicer_to_server(self.handler, self.server_impl)
         self.server_impl.add_insecure_port("[::]:{}".format(
             str(port or self.port)))
         self.server_impl.start()
+        self.bus.start()
+
+        if settings.WARMUP_ON_START:
+            threading.Thread(target=self.handler.warmup, name='Warmup', daemon=True).start()
+        if self.handler.restored_meta:
+            threading.Thread(target=self.handler.revalidate_collection_meta, name='RevalidateMeta',
+                             daemon=True).start()
 
     def run(self, port):
         logger.info('Milvus server start ......')
         port = port or self.port
         ok = self.on_pre_run()
+        self.startup_timer.lap('pre_run')
 
         if not ok:
             logger.error('Terminate server due to error found in on_pre_run')
             sys.exit(1)
 
         self.start(port)
+        self.startup_timer.lap('bind')
+        if self.snapshot:
+            self._check_restored_ring()
+            self.snapshot.start()
+        stages = self.startup_timer.stages
+        logger.info('Server is ready after %.3fs: %s', sum(stages.values()),
+                    ', '.join('{} {:.3f}s'.format(name, elapsed) for name, elapsed in stages.items()))
         logger.info(f'Server Version: {settings.SERVER_VERSIONS[-1]}')
         logger.info(f'Python SDK Version: {milvus.__version__}')
         logger.info('Listening on port {}'.format(port))
@@ -120,9 +172,22 @@ class Server:
         except KeyboardInterrupt:
             self.stop()
 
+    def _check_restored_ring(self):
+        ring = getattr(self.snapshot, 'restored_ring', None)
+        if not ring:
+            return
+        from mishards.snapshot import ring_epoch
+        names = set(self.readonly_topo.routable_names)
+        missing = sorted(set(ring['nodes']) - names)
+        logger.info('Ring epoch %s, %s in snapshot, snapshot nodes not discovered yet: %s',
+                    ring_epoch(names), ring['epoch'], missing)
+
     def stop(self):
         logger.info('Server is shuting down ......')
         self.exit_flag = True
+        if self.snapshot:
+            self.snapshot.stop()
+        self.bus.stop()
         self.server_impl.stop(0)
         self.tracer.close()
         logger.info('Server is closed')
@@ -1,15 +1,31 @@
+import os
 import logging
 import time
 import json
+import hashlib
+import threading
 import ujson
+import grpc
 
 import multiprocessing
+from concurrent import futures
+from contextlib import contextmanager
 from milvus.grpc_gen import milvus_pb2, milvus_pb2_grpc, status_pb2
 from milvus.client import types as Types
+from milvus.client.types import Status
+from milvus.client.abstract import CollectionSchema
 from milvus import MetricType
 
-from mishards import (db, exceptions)
-from mishards.grpc_utils import mark_grpc_method
+from mishards import (db, exceptions, settings)
+from mishards.utilities import ranges_to_date, parse_partial_result
+from mishards.jobs import JobManager
+from mishards.singleflight import SingleFlight
+from mishards.perf import RequestTimer, PerfStats, SlowRequestRecorder
+from mishards.profiling import SamplingProfiler, HeapTracer
+from mishards.models import TableFiles
+from mishards.router import forget_file_updates, borrow_files
+from mishards.hash_ring import HashRing
+from mishards.grpc_utils import mark_grpc_method, add_done_callback
 from mishards.grpc_utils.grpc_args_parser import GrpcArgsParser as Parser
 
 logger = logging.getLogger(__name__)
@@ -18,13 +34,108 @@ logger = logging.getLogger(__name__)
 class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
     MAX_NPROBE = 2048
     MAX_TOPK = 2048
+    ROUTE_ATTEMPTS = 3
 
-    def __init__(self, tracer, router, max_workers=multiprocessing.cpu_count(), **kwargs):
+    def __init__(self, tracer, router, bus, outliers=None, snapshot=None, max_workers=multiprocessing.cpu_count(),
+                 **kwargs):
         self.collection_meta = {}
+        # Names of collection_meta entries restored from a snapshot and not refreshed since
+        self.restored_meta = set()
         self.error_handlers = {}
         self.tracer = tracer
         self.router = router
+        self.bus = bus
+        self.outliers = outliers
         self.max_workers = max_workers
+        # Workers sharing the port tell each other about their jobs, ids carry the pid to stay unique
+        self.jobs = JobManager(max_workers=settings.JOB_WORKERS, retention=settings.JOB_RETENTION,
+                               id_prefix=os.getpid() if bus.enabled else None)
+        self.jobs.listeners.append(lambda key, state: self.bus.publish('job_updated', (key, state)))
+        self.bus.subscribe('job_updated', lambda payload: self.jobs.on_peer_job(*payload))
+        self.singleflight = SingleFlight()
+        self.perf_stats = PerfStats(window=settings.PERF_STATS_WINDOW)
+        self.slow_requests = SlowRequestRecorder(threshold=settings.SLOW_REQUEST_THRESHOLD,
+                                                 capacity=settings.SLOW_REQUEST_CAPACITY)
+        self.profiler = SamplingProfiler(settings.LOG_PATH, interval=settings.PROFILE_INTERVAL,
+                                         max_duration=settings.PROFILE_MAX_DURATION)
+        self.heap_tracer = HeapTracer(settings.LOG_PATH, max_duration=settings.PROFILE_MAX_DURATION)
+        self.bus.register_stats_provider(lambda: {'singleflight': self.singleflight.stats()})
+        if self.bus.enabled:
+            self.bus.register_stats_provider(lambda: {'perf_stats': self.perf_stats.export(),
+                                                      'slow_requests': self.slow_requests.list()})
+        self.bus.subscribe('collection_dropped', self.on_collection_dropped)
+        if snapshot:
+            snapshot.register('collections', self.dump_collection_meta, self.restore_collection_meta)
+
+    def on_collection_dropped(self, collection_name):
+        self.collection_meta.pop(collection_name, None)
+        self.restored_meta.discard(collection_name)
+
+    def dump_collection_meta(self):
+        return {name: {'dimension': info.dimension, 'index_file_size': info.index_file_size,
+                       'metric_type': int(info.metric_type)}
+                for name, info in list(self.collection_meta.items())}
+
+    def restore_collection_meta(self, snapshot):
+        for name, info in snapshot.items():
+            if name in self.collection_meta:
+                continue
+            self.collection_meta[name] = CollectionSchema(
+                collection_name=name, dimension=info['dimension'], index_file_size=info['index_file_size'],
+                metric_type=MetricType(info['metric_type']))
+            self.restored_meta.add(name)
+
+    def drop_restored_meta(self, collection_name):
+        if collection_name in self.restored_meta:
+            self.restored_meta.discard(collection_name)
+            self.collection_meta.pop(collection_name, None)
+
+    def revalidate_collection_meta(self):
+        """Replace the schemas restored from a snapshot with the current ones"""
+        start = time.time()
+        for name in list(self.restored_meta):
+            try:
+                status, info = self.router.connection().get_collection_info(name)
+            except Exception as exc:
+                status = Status(code=Status.UNEXPECTED_ERROR, message=str(exc))
+            if name not in self.restored_meta:
+                continue
+            if status.OK():
+                self.collection_meta[name] = info
+                self.restored_meta.discard(name)
+            else:
+                # Gone or unreachable, the first search of the collection fetches its schema
+                logger.warning('Cannot revalidate restored schema of {}: {}'.format(name, status.message))
+                self.drop_restored_meta(name)
+        logger.info('Revalidate restored schemas takes {:.3f}s'.format(time.time() - start))
+
+    def warmup(self):
+        start = time.time()
+        conn = self.router.connection()
+        status, collection_names = conn.list_collections()
+        if not status.OK():
+            logger.error('Warmup cannot list collections: {}'.format(status.message))
+            return
+
+        for collection_name in collection_names:
+            status, info = conn.get_collection_info(collection_name)
+            if status.OK():
+                self.collection_meta[collection_name] = info
+            try:
+                # Opens the metadata database connections the first searches would open
+                self.router.query_files(collection_name)
+            except exceptions.BaseException as exc:
+                logger.warning('Warmup cannot query files of {}: {}'.format(collection_name, exc))
+
+        for name in list(self.router.readonly_topo.routable_names):
+            try:
+                status, _ = self.router.query_conn(name).server_version(timeout=settings.WARMUP_TIMEOUT)
+            except Exception as exc:
+                status = Status(code=Status.UNEXPECTED_ERROR, message=str(exc))
+            if not status.OK():
+                logger.warning('Warmup cannot reach <{}>: {}'.format(name, status.message))
+
+        logger.info('Warmup {} collections takes {}'.format(len(collection_names), time.time() - start))
 
     def _reduce(self, source_ids, ids, source_diss, diss, k, reverse):
         if source_diss[k - 1] <= diss[0]:
@@ -88,7 +199,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
                                      reverse)
 
         calc_time = time.time() - calc_time
-        logger.info('Merge takes {}'.format(calc_time))
+        logger.info('Merge takes %s', calc_time)
 
         id_mrege_list = []
         dis_mrege_list = []
@@ -99,6 +210,153 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
         return status, id_mrege_list, dis_mrege_list
 
+    def _time_left(self, context):
+        # None when the client set no deadline
+        return context.time_remaining()
+
+    def _ensure_active(self, context, metadata=None):
+        if not context.is_active():
+            raise exceptions.RequestCancelledError('Request is cancelled or its deadline exceeded',
+                                                   metadata=metadata)
+
+    def _shard_result(self, context, future, metadata=None):
+        try:
+            return future.result(raw=True)
+        except Exception as exc:
+            # A shard call failing because the request went away is a cancellation, not a shard error
+            self._ensure_active(context, metadata=metadata)
+            # Shard calls run with the time left to the request, their deadline is the request's
+            if isinstance(exc, grpc.RpcError) and exc.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+                raise exceptions.RequestCancelledError('Request deadline exceeded', metadata=metadata)
+            raise
+
+    def _collect_partial(self, shard_futures, partial, start):
+        """Wait for shard results until all arrived, the quorum of segments was searched or the deadline passed"""
+        cv = threading.Condition()
+        done = set()
+        succeeded = set()
+
+        def on_done(idx, grpc_future):
+            ok = not grpc_future.cancelled() and grpc_future.exception() is None \
+                and grpc_future.result().status.error_code == 0
+            with cv:
+                done.add(idx)
+                ok and succeeded.add(idx)
+                cv.notify()
+
+        for idx, (_, _, f) in enumerate(shard_futures):
+            add_done_callback(f, lambda grpc_future, idx=idx: on_done(idx, grpc_future))
+
+        total = sum(n for _, n, _ in shard_futures)
+        deadline_ms = partial.get('deadline_ms', None)
+        deadline = start + deadline_ms / 1000.0 if deadline_ms else None
+        quorum = partial.get('quorum', None)
+
+        with cv:
+            while len(done) < len(shard_futures):
+                if quorum is not None and sum(shard_futures[idx][1] for idx in succeeded) >= quorum * total:
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                cv.wait(remaining)
+            finished = set(done)
+
+        results = []
+        searched = 0
+        for idx, (addr, n, f) in enumerate(shard_futures):
+            if idx not in finished:
+                logger.warning('Partial search drops <{}> with {} segments'.format(addr, n))
+                if self.outliers:
+                    self.outliers.drop(f)
+                f.cancel()
+                continue
+            try:
+                ret = f.result(raw=True)
+            except Exception as exc:
+                logger.warning('Partial search drops <{}> with {} segments: {}'.format(addr, n, exc))
+                continue
+            if ret.status.error_code != 0:
+                logger.warning('Partial search drops <{}> with {} segments: {}'.format(addr, n, ret.status.reason))
+                continue
+            results.append(ret)
+            searched += n
+
+        return results, (searched, total)
+
+    def _split_chunks(self, nq, partial=None):
+        """Row ranges the query batch is split into, one per routable node at most"""
+        min_nq = settings.SEARCH_SPLIT_MIN_NQ
+        if partial is not None or min_nq <= 0 or nq < 2 * min_nq:
+            return [(0, nq)]
+        n = min(len(self.router.readonly_topo.routable_names), nq // min_nq)
+        if n <= 1:
+            return [(0, nq)]
+        size = -(-nq // n)
+        return [(begin, min(nq, begin + size)) for begin in range(0, nq, size)]
+
+    def _plan_shard_calls(self, routing, chunks):
+        """(addr, search_file_ids, ud_file_ids, chunk) of every shard call.
+
+        The first chunk of a file set goes to its routed node, the others to the
+        next nodes on the ring, which reload whatever they hold older than it.
+        """
+        if len(chunks) == 1:
+            return [(addr, ids, ud_ids, 0) for addr, (ids, ud_ids) in routing.items()]
+
+        ring = HashRing(list(self.router.readonly_topo.routable_names))
+        calls = []
+        for addr, (ids, ud_ids) in routing.items():
+            nodes = [addr] + [node for node in ring.iterate_nodes(addr) if node and node != addr]
+            for chunk in range(len(chunks)):
+                node = nodes[chunk % len(nodes)]
+                calls.append((node, ids, ud_ids if chunk == 0 else borrow_files(addr, node, ids), chunk))
+        return calls
+
+    def _route_and_reserve(self, collection_id, chunks, metadata=None, **kwargs):
+        """Route the query and reserve every node it calls before any of them is called.
+
+        A reserved node deleted by discovery keeps draining until the query
+        releases it. A node deleted between routing and the reservation is gone
+        already, the query is routed again without it.
+        """
+        for attempt in range(self.ROUTE_ATTEMPTS):
+            routing = self.router.routing(collection_id, metadata=metadata, **kwargs)
+            calls = self._plan_shard_calls(routing, chunks)
+            names = sorted({addr for addr, _, _, _ in calls})
+            groups = self.router.readonly_topo.reserve(names)
+            if None not in groups or attempt == self.ROUTE_ATTEMPTS - 1:
+                return routing, calls, groups
+
+            for group in groups:
+                group is not None and group.release()
+            # Routing marked these segments loaded, they are not reloaded if routed the same way again
+            for addr, _, ud_file_ids, _ in calls:
+                forget_file_updates(addr, ud_file_ids)
+            gone = [name for name, group in zip(names, groups) if group is None]
+            logger.info('Nodes %s left while routing %s, route again', gone, collection_id)
+
+    @contextmanager
+    def _reserved(self, groups):
+        try:
+            yield
+        finally:
+            for group in groups:
+                group is not None and group.release()
+
+    def _do_merge_chunks(self, chunk_results, topk, reverse=False, **kwargs):
+        if len(chunk_results) == 1:
+            return self._do_merge(chunk_results[0], topk, reverse=reverse, **kwargs)
+
+        id_results, dis_results = [], []
+        for results in chunk_results:
+            status, ids, diss = self._do_merge(results, topk, reverse=reverse, **kwargs)
+            if status.error_code != status_pb2.SUCCESS:
+                return status, [], []
+            id_results.extend(ids)
+            dis_results.extend(diss)
+        return status, id_results, dis_results
+
     def _do_query(self,
                   context,
                   collection_id,
@@ -107,58 +365,97 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
                   topk,
                   search_params,
                   partition_tags=None,
+                  partial=None,
                   **kwargs):
+        query_start = time.time()
+        coverage = None
         metadata = kwargs.get('metadata', None)
+        timer = kwargs.get('timer', None) or RequestTimer()
 
         routing = {}
+        chunks = self._split_chunks(len(vectors), partial)
         p_span = None if self.tracer.empty else context.get_active_span(
         ).context
-        with self.tracer.start_span('get_routing', child_of=p_span):
-            routing = self.router.routing(collection_id,
-                                          partition_tags=partition_tags,
-                                          metadata=metadata)
-        logger.info('Routing: {}'.format(routing))
-
-        metadata = kwargs.get('metadata', None)
-
-        all_topk_results = []
-
-        with self.tracer.start_span('do_search', child_of=p_span) as span:
-            if len(routing) == 0:
-                ft = self.router.connection().search(collection_id, topk, vectors, list(partition_tags), search_params, _async=True)
-                ret = ft.result(raw=True)
-                all_topk_results.append(ret)
+        with self.tracer.start_span('get_routing', child_of=p_span), timer.stage('route'):
+            routing, calls, groups = self._route_and_reserve(collection_id, chunks,
+                                                             partition_tags=partition_tags,
+                                                             range_array=kwargs.get('range_array', None),
+                                                             metadata=metadata)
+        logger.info('Routing %s to %d nodes', collection_id, len(routing))
+        logger.debug('Routing: %s', routing)
+
+        # Shard results of every chunk of the query batch
+        all_topk_results = [[]]
+
+        with self.tracer.start_span('do_search', child_of=p_span) as span, self._reserved(groups):
+            self._ensure_active(context, metadata=metadata)
+            if len(routing) == 0 and settings.ROUTER_SKIP_EMPTY_ROUTING:
+                logger.info('No segment of %s is left to search after pruning', collection_id)
+            elif len(routing) == 0:
+                ft = self.router.connection().search(collection_id, topk, vectors, list(partition_tags), search_params,
+                                                     timeout=self._time_left(context), _async=True)
+                context.add_callback(ft.cancel)
+                ret = self._shard_result(context, ft, metadata=metadata)
+                all_topk_results[0].append(ret)
             else:
-                futures = []
-                for addr, files_tuple in routing.items():
-                    search_file_ids, ud_file_ids = files_tuple
-                    logger.info(f"<{addr}> needed update segment ids {ud_file_ids}")
+                shard_futures = []
+                shard_chunks = []
+
+                def cancel_shards():
+                    for addr, _, f in shard_futures:
+                        if not f.is_done():
+                            logger.info('Cancel search on <%s> of terminated request', addr)
+                            f.cancel()
+
+                context.add_callback(cancel_shards)
+                for addr, search_file_ids, ud_file_ids, chunk in calls:
+                    self._ensure_active(context, metadata=metadata)
+                    logger.debug('<%s> needed update segment ids %s', addr, ud_file_ids)
                     conn = self.router.query_conn(addr, metadata=metadata)
-                    start = time.time()
-                    ud_file_ids and conn.reload_segments(collection_id, ud_file_ids)
+                    with timer.stage('reload', addr=addr, segments=len(ud_file_ids)):
+                        ud_file_ids and conn.reload_segments(collection_id, ud_file_ids)
                     span = kwargs.get('span', None)
                     span = span if span else (None if self.tracer.empty else
                                               context.get_active_span().context)
 
+                    begin, end = chunks[chunk]
                     with self.tracer.start_span('search_{}'.format(addr),
                                                 child_of=span):
                         future = conn.search_in_segment(collection_name=collection_id,
                                                               file_ids=search_file_ids,
-                                                              query_records=vectors,
+                                                              query_records=vectors[begin:end],
                                                               top_k=topk,
-                                                              params=search_params, _async=True)
-                        futures.append(future)
-
-                    for f in futures:
-                        ret = f.result(raw=True)
-                        all_topk_results.append(ret)
+                                                              params=search_params,
+                                                              timeout=self._time_left(context), _async=True)
+                        shard_futures.append((addr, len(search_file_ids), future))
+                        shard_chunks.append(chunk)
+                        timer.track('search_{}'.format(addr), future, segments=len(search_file_ids), chunk=chunk)
+                        if self.outliers:
+                            self.outliers.track(addr, future)
+
+                timer.lap()
+                if partial is None:
+                    chunk_results = [[] for _ in chunks]
+                    for (_, _, f), chunk in zip(shard_futures, shard_chunks):
+                        ret = self._shard_result(context, f, metadata=metadata)
+                        chunk_results[chunk].append(ret)
+                    all_topk_results = chunk_results
+                else:
+                    results, coverage = self._collect_partial(shard_futures, partial, query_start)
+                    all_topk_results = [results]
+                timer.lap('search')
 
+        self._ensure_active(context, metadata=metadata)
         reverse = collection_meta.metric_type == Types.MetricType.IP
-        with self.tracer.start_span('do_merge', child_of=p_span):
-            return self._do_merge(all_topk_results,
-                                  topk,
-                                  reverse=reverse,
-                                  metadata=metadata)
+        with self.tracer.start_span('do_merge', child_of=p_span), timer.stage('merge'):
+            status, id_results, dis_results = self._do_merge_chunks(all_topk_results,
+                                                                    topk,
+                                                                    reverse=reverse,
+                                                                    metadata=metadata)
+
+        if coverage is not None and coverage[0] < coverage[1] and status.error_code == status_pb2.SUCCESS:
+            status.reason = 'Partial result: searched {}/{} segments'.format(*coverage)
+        return status, id_results, dis_results
 
     def _create_collection(self, collection_schema):
         return self.router.connection().create_collection(collection_schema)
@@ -176,7 +473,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
         #     logging.warning('[CreateCollection] collection schema error occurred: {}'.format(_status))
         #     return _status
 
-        logger.info('CreateCollection {}'.format(_collection_schema['collection_name']))
+        logger.info('CreateCollection %s', _collection_schema['collection_name'])
 
         _status = self._create_collection(_collection_schema)
 
@@ -195,7 +492,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
                 error_code=_status.code, reason=_status.message),
                 bool_reply=False)
 
-        logger.info('HasCollection {}'.format(_collection_name))
+        logger.info('HasCollection %s', _collection_name)
 
         _status, _bool = self._has_collection(_collection_name,
                                          metadata={'resp_class': milvus_pb2.BoolReply})
@@ -234,7 +531,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
                 error_code=_status.code, reason=_status.message),
                 partition_array=[])
 
-        logger.info('ShowPartitions {}'.format(_collection_name))
+        logger.info('ShowPartitions %s', _collection_name)
 
         _status, partition_array = self.router.connection().list_partitions(_collection_name)
 
@@ -253,9 +550,11 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             return status_pb2.Status(error_code=_status.code,
                                      reason=_status.message)
 
-        logger.info('DropCollection {}'.format(_collection_name))
+        logger.info('DropCollection %s', _collection_name)
 
         _status = self._drop_collection(_collection_name)
+        self.on_collection_dropped(_collection_name)
+        self.bus.publish('collection_dropped', _collection_name)
 
         return status_pb2.Status(error_code=_status.code,
                                  reason=_status.message)
@@ -273,7 +572,14 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
         _collection_name, _index_type, _index_param = unpacks
 
-        logger.info('CreateIndex {}'.format(_collection_name))
+        logger.info('CreateIndex %s', _collection_name)
+
+        if settings.ASYNC_ADMIN_JOBS:
+            key = ('CreateIndex', _collection_name, int(_index_type), json.dumps(_index_param, sort_keys=True))
+            return self._submit_job('CreateIndex', key,
+                                    lambda: self._create_index(_collection_name, _index_type, _index_param),
+                                    progress=lambda: self._index_progress(_collection_name),
+                                    collection_name=_collection_name)
 
         # TODO: interface create_collection incompleted
         _status = self._create_index(_collection_name, _index_type, _index_param)
@@ -281,6 +587,21 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
         return status_pb2.Status(error_code=_status.code,
                                  reason=_status.message)
 
+    def _index_progress(self, collection_name):
+        files = self.router.query_files(collection_name)
+        to_index = [f for f in files if f.file_type in (TableFiles.FILE_TYPE_TO_INDEX, TableFiles.FILE_TYPE_INDEX)]
+        if not to_index:
+            return None
+        indexed = [f for f in to_index if f.file_type == TableFiles.FILE_TYPE_INDEX]
+        return round(len(indexed) / len(to_index), 3)
+
+    def _submit_job(self, kind, key, func, progress=None, **kwargs):
+        job, created = self.jobs.submit(kind, key, func, progress=progress, **kwargs)
+        if created:
+            logger.info('{} submitted as job {}'.format(kind, job.id))
+        return status_pb2.Status(error_code=status_pb2.SUCCESS,
+                                 reason='job_id={}'.format(job.id))
+
     def _add_vectors(self, param, metadata=None):
         return self.router.connection(metadata=metadata).insert(
             None, None, insert_param=param)
@@ -297,7 +618,60 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
     @mark_grpc_method
     def Search(self, request, context):
-
+        timer = RequestTimer()
+        try:
+            result = self._single_flight_search(request, context, timer)
+        except Exception as exc:
+            # A schema restored from a snapshot may be outdated, fetch it again next time
+            self.drop_restored_meta(request.collection_name)
+            self._observe_slow('Search', request.collection_name, timer, error=str(exc))
+            raise
+        error = None if result.status.error_code == status_pb2.SUCCESS else result.status.reason
+        if error is not None:
+            self.drop_restored_meta(request.collection_name)
+        self._observe_slow('Search', request.collection_name, timer, error=error)
+        return result
+
+    def _observe_slow(self, method, collection_name, timer, error=None):
+        record = self.slow_requests.observe(method, collection_name, timer, error=error)
+        if record is None:
+            return
+        logger.warning('Slow %s on %s takes %.3fs%s', method, collection_name, record['total'],
+                       '' if error is None else ': {}'.format(error))
+        if settings.SLOW_REQUEST_EXPORT and not self.tracer.empty:
+            self._export_slow(record)
+
+    def _export_slow(self, record):
+        root = self.tracer.start_span('slow_{}'.format(record['method']), start_time=record['time'],
+                                      tags={'collection': record['collection'], 'error': record['error'] is not None},
+                                      ignore_active_span=True)
+        for span in record['spans']:
+            child = self.tracer.start_span(span['name'], child_of=root, tags=span['tags'],
+                                           start_time=record['time'] + span['start'])
+            child.finish(finish_time=record['time'] + span['start'] + span['duration'])
+        root.finish(finish_time=record['time'] + record['total'])
+
+    def _single_flight_search(self, request, context, timer):
+        if not settings.SEARCH_SINGLEFLIGHT:
+            return self._search(request, context, timer)
+
+        key = hashlib.sha1(request.SerializeToString(deterministic=True)).digest()
+        try:
+            result, shared = self.singleflight.do(key, lambda: self._search(request, context, timer),
+                                                  timeout=self._time_left(context), is_active=context.is_active)
+        except TimeoutError:
+            raise exceptions.RequestCancelledError('Request is cancelled or its deadline exceeded',
+                                                   metadata={'resp_class': milvus_pb2.TopKQueryResult})
+        except exceptions.RequestCancelledError:
+            if not context.is_active():
+                raise
+            # The leader went away, search on behalf of this request
+            return self._search(request, context, timer)
+        if shared:
+            logger.info('Search %s shares an identical in-flight request', request.collection_name)
+        return result
+
+    def _search(self, request, context, timer):
         metadata = {'resp_class': milvus_pb2.TopKQueryResult}
 
         collection_name = request.collection_name
@@ -308,8 +682,15 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             raise exceptions.SearchParamError(message="Search parma loss", metadata=metadata)
         params = ujson.loads(str(request.extra_params[0].value))
 
-        logger.info('Search {}: topk={} params={}'.format(
-            collection_name, topk, params))
+        range_array = None
+        partial = None
+        for extra_param in request.extra_params[1:]:
+            if extra_param.key == 'date_ranges':
+                range_array = ranges_to_date(ujson.loads(str(extra_param.value)), metadata=metadata)
+            elif extra_param.key == 'partial_result':
+                partial = parse_partial_result(ujson.loads(str(extra_param.value)), metadata=metadata)
+
+        logger.info('Search %s: topk=%s params=%s', collection_name, topk, params)
 
         # if nprobe > self.MAX_NPROBE or nprobe <= 0:
         #     raise exceptions.InvalidArgumentError(
@@ -318,6 +699,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
         if topk > self.MAX_TOPK or topk <= 0:
             raise exceptions.InvalidTopKError(
                 message='Invalid topk: {}'.format(topk), metadata=metadata)
+        timer.lap('parse')
 
         collection_meta = self.collection_meta.get(collection_name, None)
 
@@ -330,6 +712,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
             self.collection_meta[collection_name] = info
             collection_meta = info
+        timer.lap('meta')
 
         start = time.time()
 
@@ -340,6 +723,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
         else:
             for query_record in request.query_record_array:
                 query_record_array.append(list(query_record.float_data))
+        timer.lap('convert')
 
         status, id_results, dis_results = self._do_query(context,
                                                          collection_name,
@@ -348,10 +732,14 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
                                                          topk,
                                                          params,
                                                          partition_tags=getattr(request, "partition_tag_array", []),
+                                                         range_array=range_array,
+                                                         partial=partial,
+                                                         timer=timer,
                                                          metadata=metadata)
+        timer.lap()
 
         now = time.time()
-        logger.info('SearchVector takes: {}'.format(now - start))
+        logger.info('SearchVector takes: %s', now - start)
 
         topk_result_list = milvus_pb2.TopKQueryResult(
             status=status_pb2.Status(error_code=status.error_code,
@@ -359,6 +747,8 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             row_num=len(request.query_record_array) if len(id_results) else 0,
             ids=id_results,
             distances=dis_results)
+        timer.lap('response')
+        self.perf_stats.record(collection_name, timer)
         return topk_result_list
 
     @mark_grpc_method
@@ -444,7 +834,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
         metadata = {'resp_class': milvus_pb2.CollectionSchema}
 
-        logger.info('DescribeCollection {}'.format(_collection_name))
+        logger.info('DescribeCollection %s', _collection_name)
         _status, _collection = self._describe_collection(metadata=metadata,
                                                collection_name=_collection_name)
 
@@ -506,7 +896,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
             return milvus_pb2.CollectionRowCount(status=status)
 
-        logger.info('CountCollection {}'.format(_collection_name))
+        logger.info('CountCollection %s', _collection_name)
 
         metadata = {'resp_class': milvus_pb2.CollectionRowCount}
         _status, _count = self._count_collection(_collection_name, metadata=metadata)
@@ -525,7 +915,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
     @mark_grpc_method
     def Cmd(self, request, context):
         _status, _cmd = Parser.parse_proto_Command(request)
-        logger.info('Cmd: {}'.format(_cmd))
+        logger.info('Cmd: %s', _cmd)
 
         if not _status.OK():
             return milvus_pb2.StringReply(status=status_pb2.Status(
@@ -535,10 +925,66 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
         if _cmd == 'conn_stats':
             stats = self.router.readonly_topo.stats()
+            if self.outliers:
+                for addr, health in self.outliers.stats().items():
+                    if addr in stats:
+                        stats[addr]['health'] = health
             return milvus_pb2.StringReply(status=status_pb2.Status(
                 error_code=status_pb2.SUCCESS),
                 string_reply=json.dumps(stats, indent=2))
 
+        if _cmd == 'jobs' or _cmd.startswith('job '):
+            jobs = self.jobs.stats()
+            if _cmd != 'jobs':
+                job_id = _cmd[len('job '):].strip()
+                jobs = [job for job in jobs if str(job['id']) == job_id]
+                if not jobs:
+                    return milvus_pb2.StringReply(status=status_pb2.Status(
+                        error_code=status_pb2.ILLEGAL_ARGUMENT, reason='Job {} not found'.format(job_id)))
+                jobs = jobs[0]
+            return milvus_pb2.StringReply(status=status_pb2.Status(
+                error_code=status_pb2.SUCCESS),
+                string_reply=json.dumps(jobs, indent=2))
+
+        if _cmd.startswith('explain'):
+            args = _cmd.split()
+            if len(args) < 2 or args[0] != 'explain':
+                return milvus_pb2.StringReply(status=status_pb2.Status(
+                    error_code=status_pb2.ILLEGAL_ARGUMENT, reason='Usage: explain <collection> [tags]'))
+            plan = self.router.explain(args[1], partition_tags=args[2:] or None, metadata=metadata)
+            return milvus_pb2.StringReply(status=status_pb2.Status(
+                error_code=status_pb2.SUCCESS),
+                string_reply=json.dumps(plan, indent=2))
+
+        if _cmd == 'slow_requests':
+            if self.bus.enabled:
+                records = SlowRequestRecorder.merge(
+                    [[dict(record, worker=stats['worker']) for record in stats.get('slow_requests', [])]
+                     for stats in self.bus.stats()['workers']], settings.SLOW_REQUEST_CAPACITY)
+            else:
+                records = self.slow_requests.list()
+            return milvus_pb2.StringReply(status=status_pb2.Status(
+                error_code=status_pb2.SUCCESS),
+                string_reply=json.dumps(records, indent=2))
+
+        if _cmd == 'perf_stats':
+            if self.bus.enabled:
+                summary = PerfStats.merge(stats['perf_stats'] for stats in self.bus.stats()['workers']
+                                          if 'perf_stats' in stats)
+            else:
+                summary = self.perf_stats.summary()
+            return milvus_pb2.StringReply(status=status_pb2.Status(
+                error_code=status_pb2.SUCCESS),
+                string_reply=json.dumps(summary, indent=2))
+
+        if _cmd.split(' ', 1)[0] in ('profile', 'heap'):
+            return self._profile_cmd(_cmd)
+
+        if _cmd == 'worker_stats':
+            return milvus_pb2.StringReply(status=status_pb2.Status(
+                error_code=status_pb2.SUCCESS),
+                string_reply=json.dumps(self._worker_stats(), indent=2))
+
         # if _cmd == 'version':
         #     _status, _reply = self._get_server_version(metadata=metadata)
         # else:
@@ -550,6 +996,34 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             error_code=_status.code, reason=_status.message),
             string_reply=_reply)
 
+    def _worker_stats(self):
+        stats = self.bus.stats()
+        # Latency histograms and slow request spans are served by perf_stats and slow_requests
+        stats['workers'] = [{key: value for key, value in worker.items() if key not in ('perf_stats', 'slow_requests')}
+                            for worker in stats['workers']]
+        return stats
+
+    def _profile_cmd(self, cmd):
+        args = cmd.split()
+        tool = self.profiler if args[0] == 'profile' else self.heap_tracer
+        actions = {'start': tool.start, 'stop': tool.stop}
+        if tool is self.heap_tracer:
+            actions['snapshot'] = tool.snapshot
+        try:
+            if len(args) == 1:
+                stats = tool.stats()
+            elif args[1] in actions and (args[1] == 'start' or len(args) == 2):
+                duration = float(args[2]) if len(args) > 2 else None
+                stats = actions[args[1]](duration) if args[1] == 'start' else actions[args[1]]()
+            else:
+                raise ValueError('Usage: {} [{}]'.format(args[0], '|'.join(sorted(actions))))
+        except ValueError as exc:
+            return milvus_pb2.StringReply(status=status_pb2.Status(
+                error_code=status_pb2.ILLEGAL_ARGUMENT, reason=str(exc)))
+        return milvus_pb2.StringReply(status=status_pb2.Status(
+            error_code=status_pb2.SUCCESS),
+            string_reply=json.dumps(stats, indent=2))
+
     def _show_collections(self, metadata=None):
         return self.router.connection(metadata=metadata).list_collections()
 
@@ -563,8 +1037,45 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             error_code=_status.code, reason=_status.message),
             collection_names=_results)
 
+    def _preload_segments(self, addr, collection_name, files_tuple):
+        search_file_ids, ud_file_ids = files_tuple
+        start = time.time()
+        try:
+            conn = self.router.query_conn(addr)
+            status = conn.reload_segments(collection_name, search_file_ids)
+        except Exception as exc:
+            status = Status(code=Status.UNEXPECTED_ERROR, message=str(exc))
+        if not status.OK():
+            forget_file_updates(addr, ud_file_ids)
+        logger.info('Preload {} segments of {} on <{}> {} in {:.3f}s'.format(
+            len(search_file_ids), collection_name, addr, 'done' if status.OK() else 'failed: ' + status.message,
+            time.time() - start))
+        return status
+
     def _preload_collection(self, collection_name):
-        return self.router.connection().load_collection(collection_name)
+        routing = self.router.routing(collection_name)
+        logger.info('Preload {} on {} readonly nodes'.format(collection_name, len(routing)))
+
+        with futures.ThreadPoolExecutor(max_workers=len(routing) + 1) as executor:
+            writable = executor.submit(self.router.connection().load_collection, collection_name)
+            readonly = {addr: executor.submit(self._preload_segments, addr, collection_name, files_tuple)
+                        for addr, files_tuple in routing.items()}
+
+            status = writable.result()
+            failed = []
+            for addr, future in readonly.items():
+                node_status = future.result()
+                if not node_status.OK():
+                    failed.append('{}: {}'.format(addr, node_status.message))
+                    if status.OK():
+                        status = node_status
+
+        if failed:
+            return Status(code=status.code, message='Preload failed on {}'.format('; '.join(failed)))
+        if not status.OK():
+            return status
+        segments = sum(len(files_tuple[0]) for files_tuple in routing.values())
+        return Status(message='Preloaded {} segments on {} readonly nodes'.format(segments, len(routing)))
 
     @mark_grpc_method
     def PreloadCollection(self, request, context):
@@ -574,7 +1085,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             return status_pb2.Status(error_code=_status.code,
                                      reason=_status.message)
 
-        logger.info('PreloadCollection {}'.format(_collection_name))
+        logger.info('PreloadCollection %s', _collection_name)
         _status = self._preload_collection(_collection_name)
         return status_pb2.Status(error_code=_status.code,
                                  reason=_status.message)
@@ -595,7 +1106,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
 
         metadata = {'resp_class': milvus_pb2.IndexParam}
 
-        logger.info('DescribeIndex {}'.format(_collection_name))
+        logger.info('DescribeIndex %s', _collection_name)
         _status, _index_param = self._describe_index(collection_name=_collection_name,
                                                      metadata=metadata)
 
@@ -625,7 +1136,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
         metadata = {'resp_class': milvus_pb2.VectorsData}
 
         _collection_name, _ids = unpacks
-        logger.info('GetVectorByID {}'.format(_collection_name))
+        logger.info('GetVectorByID %s', _collection_name)
         _status, vectors = self._get_vectors_by_id(_collection_name, _ids, metadata)
         _rpc_status = status_pb2.Status(error_code=_status.code, reason=_status.message)
         if not vectors:
@@ -656,7 +1167,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
         metadata = {'resp_class': milvus_pb2.VectorIds}
 
         _collection_name, _segment_name = unpacks
-        logger.info('GetVectorIDs {}'.format(_collection_name))
+        logger.info('GetVectorIDs %s', _collection_name)
         _status, ids = self._get_vector_ids(_collection_name, _segment_name, metadata)
 
         if not ids:
@@ -681,7 +1192,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
                                      reason=_status.message)
 
         _collection_name, _ids = unpacks
-        logger.info('DeleteByID {}'.format(_collection_name))
+        logger.info('DeleteByID %s', _collection_name)
         _status = self._delete_by_id(_collection_name, _ids)
 
         return status_pb2.Status(error_code=_status.code,
@@ -698,7 +1209,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             return status_pb2.Status(error_code=_status.code,
                                      reason=_status.message)
 
-        logger.info('DropIndex {}'.format(_collection_name))
+        logger.info('DropIndex %s', _collection_name)
         _status = self._drop_index(_collection_name)
         return status_pb2.Status(error_code=_status.code,
                                  reason=_status.message)
@@ -714,7 +1225,7 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             return status_pb2.Status(error_code=_status.code,
                                      reason=_status.message)
 
-        logger.info('Flush {}'.format(_collection_names))
+        logger.info('Flush %s', _collection_names)
         _status = self._flush(_collection_names)
         return status_pb2.Status(error_code=_status.code,
                                  reason=_status.message)
@@ -730,7 +1241,12 @@ class ServiceHandler(milvus_pb2_grpc.MilvusServiceServicer):
             return status_pb2.Status(error_code=_status.code,
                                      reason=_status.message)
 
-        logger.info('Compact {}'.format(_collection_name))
+        logger.info('Compact %s', _collection_name)
+        if settings.ASYNC_ADMIN_JOBS:
+            return self._submit_job('Compact', ('Compact', _collection_name),
+                                    lambda: self._compact(_collection_name),
+                                    collection_name=_collection_name)
+
         _status = self._compact(_collection_name)
         return status_pb2.Status(error_code=_status.code,
                                  reason=_status.message)
@@ -20,14 +20,70 @@ LOG_LEVEL = env.str('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
 LOG_PATH = env.str('LOG_PATH', '/tmp/mishards')
 LOG_NAME = env.str('LOG_NAME', 'logfile')
 TIMEZONE = env.str('TIMEZONE', 'UTC')
+LOG_ASYNC = env.bool('LOG_ASYNC', True)
+LOG_FORMAT = env.str('LOG_FORMAT', 'default')
+LOG_RATE_LIMIT = env.float('LOG_RATE_LIMIT', 0)
 
 from utils.logger_helper import config
-config(LOG_LEVEL, LOG_PATH, LOG_NAME, TIMEZONE)
+config(LOG_LEVEL, LOG_PATH, LOG_NAME, TIMEZONE, async_mode=LOG_ASYNC, log_format=LOG_FORMAT,
+       rate_limit=LOG_RATE_LIMIT)
 
 SERVER_PORT = env.int('SERVER_PORT', 19530)
 SERVER_TEST_PORT = env.int('SERVER_TEST_PORT', 19530)
 WOSERVER = env.str('WOSERVER')
 MAX_WORKERS = env.int('MAX_WORKERS', 50)
+LANE_SEARCH_QUEUE = env.int('LANE_SEARCH_QUEUE', 50)
+LANE_SEARCH_ADAPTIVE = env.bool('LANE_SEARCH_ADAPTIVE', False)
+LANE_SEARCH_MIN_WORKERS = env.int('LANE_SEARCH_MIN_WORKERS', 4)
+LANE_SEARCH_MAX_WORKERS = env.int('LANE_SEARCH_MAX_WORKERS', 200)
+LANE_WRITE_WORKERS = env.int('LANE_WRITE_WORKERS', 10)
+LANE_WRITE_QUEUE = env.int('LANE_WRITE_QUEUE', 20)
+LANE_ADMIN_WORKERS = env.int('LANE_ADMIN_WORKERS', 2)
+LANE_ADMIN_QUEUE = env.int('LANE_ADMIN_QUEUE', 8)
+LANE_QUEUE_TIMEOUT = env.float('LANE_QUEUE_TIMEOUT', 10)
+ASYNC_ADMIN_JOBS = env.bool('ASYNC_ADMIN_JOBS', False)
+JOB_WORKERS = env.int('JOB_WORKERS', 2)
+JOB_RETENTION = env.int('JOB_RETENTION', 3600)
+WORKER_PROCESSES = env.int('WORKER_PROCESSES', 1)
+WORKER_STATS_INTERVAL = env.int('WORKER_STATS_INTERVAL', 5)
+WARMUP_ON_START = env.bool('WARMUP_ON_START', False)
+WARMUP_TIMEOUT = env.float('WARMUP_TIMEOUT', 5)
+READONLY_PREWARM_ON_JOIN = env.bool('READONLY_PREWARM_ON_JOIN', False)
+READONLY_PREWARM_TIMEOUT = env.int('READONLY_PREWARM_TIMEOUT', 60)
+READONLY_DRAIN_TIMEOUT = env.int('READONLY_DRAIN_TIMEOUT', 30)
+
+SEARCH_SINGLEFLIGHT = env.bool('SEARCH_SINGLEFLIGHT', True)
+SEARCH_SPLIT_MIN_NQ = env.int('SEARCH_SPLIT_MIN_NQ', 0)
+PERF_STATS_WINDOW = env.int('PERF_STATS_WINDOW', 1024)
+SLOW_REQUEST_THRESHOLD = env.float('SLOW_REQUEST_THRESHOLD', 1.0)
+SLOW_REQUEST_CAPACITY = env.int('SLOW_REQUEST_CAPACITY', 100)
+SLOW_REQUEST_EXPORT = env.bool('SLOW_REQUEST_EXPORT', False)
+PROFILE_INTERVAL = env.float('PROFILE_INTERVAL', 0.01)
+PROFILE_MAX_DURATION = env.float('PROFILE_MAX_DURATION', 300)
+
+OUTLIER_DETECTION = env.bool('OUTLIER_DETECTION', True)
+OUTLIER_EWMA_ALPHA = env.float('OUTLIER_EWMA_ALPHA', 0.2)
+OUTLIER_LATENCY_FACTOR = env.float('OUTLIER_LATENCY_FACTOR', 3.0)
+OUTLIER_MIN_LATENCY = env.float('OUTLIER_MIN_LATENCY', 0.05)
+OUTLIER_ERROR_RATE = env.float('OUTLIER_ERROR_RATE', 0.5)
+OUTLIER_MIN_REQUESTS = env.int('OUTLIER_MIN_REQUESTS', 20)
+OUTLIER_BASE_EJECTION = env.int('OUTLIER_BASE_EJECTION', 30)
+OUTLIER_MAX_EJECTION = env.int('OUTLIER_MAX_EJECTION', 300)
+OUTLIER_MAX_EJECTED_PERCENT = env.int('OUTLIER_MAX_EJECTED_PERCENT', 34)
+
+ROUTER_PRUNE_EMPTY_FILES = env.bool('ROUTER_PRUNE_EMPTY_FILES', True)
+ROUTER_SKIP_EMPTY_ROUTING = env.bool('ROUTER_SKIP_EMPTY_ROUTING', False)
+ROUTER_AFFINITY_CANDIDATES = env.int('ROUTER_AFFINITY_CANDIDATES', 2)
+ROUTER_AFFINITY_MAX_MIGRATIONS = env.int('ROUTER_AFFINITY_MAX_MIGRATIONS', 16)
+
+SNAPSHOT_PATH = env.str('SNAPSHOT_PATH', '')
+SNAPSHOT_INTERVAL = env.float('SNAPSHOT_INTERVAL', 60)
+SNAPSHOT_MAX_AGE = env.float('SNAPSHOT_MAX_AGE', 3600)
+
+METADATA_MIRROR = env.bool('METADATA_MIRROR', False)
+METADATA_MIRROR_POLL_INTERVAL = env.float('METADATA_MIRROR_POLL_INTERVAL', 1.0)
+METADATA_MIRROR_RECONCILE_INTERVAL = env.float('METADATA_MIRROR_RECONCILE_INTERVAL', 300)
+METADATA_MIRROR_MAX_STALENESS = env.float('METADATA_MIRROR_MAX_STALENESS', 30)
 
 
 class TracingConfig:
@@ -61,6 +117,11 @@ class DefaultConfig:
     SQL_POOL_TIMEOUT = env.int('pool_timeout', 30)
     SQL_POOL_PRE_PING = env.bool('pool_pre_ping', True)
     SQL_MAX_OVERFLOW = env.int('max_overflow', 0)
+    SQLALCHEMY_DATABASE_REPLICA_URIS = env.list('SQLALCHEMY_DATABASE_REPLICA_URIS', [])
+    SQL_REPLICA_POOL_SIZE = env.int('SQL_REPLICA_POOL_SIZE', 100)
+    SQL_REPLICA_MAX_OVERFLOW = env.int('SQL_REPLICA_MAX_OVERFLOW', 0)
+    SQL_REPLICA_MAX_LAG = env.float('SQL_REPLICA_MAX_LAG', 5)
+    SQL_REPLICA_CHECK_INTERVAL = env.float('SQL_REPLICA_CHECK_INTERVAL', 10)
     TRACER_PLUGIN_PATH = env.str('TRACER_PLUGIN_PATH', '')
     TRACER_CLASS_NAME = env.str('TRACER_CLASS_NAME', '')
     ROUTER_PLUGIN_PATH = env.str('ROUTER_PLUGIN_PATH', '')
@@ -77,5 +138,6 @@ class TestingConfig(DefaultConfig):
     SQL_POOL_TIMEOUT = env.int('pool_timeout', 30)
     SQL_POOL_PRE_PING = env.bool('pool_pre_ping', True)
     SQL_MAX_OVERFLOW = env.int('max_overflow', 0)
+    SQLALCHEMY_DATABASE_REPLICA_URIS = []
     TRACER_CLASS_NAME = env.str('TRACER_CLASS_TEST_NAME', '')
     ROUTER_CLASS_NAME = env.str('ROUTER_CLASS_TEST_NAME', 'FileBasedHashRingRouter')
@@ -0,0 +1,76 @@
+import time
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc = None
+        self.dups = 0
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    The first caller of a key runs `func`; callers arriving while it runs wait for
+    it and get the same result or exception. Nothing is kept once the call ends.
+    A waiting caller gives up with a TimeoutError after its own `timeout`, or as
+    soon as its `is_active` callback returns False.
+    """
+    CHECK_INTERVAL = 0.1
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, func, timeout=None, is_active=None):
+        with self.lock:
+            call = self.calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.dups += 1
+                self.shared += 1
+
+        if not leader:
+            self._wait(call, timeout, is_active)
+            if call.exc is not None:
+                raise call.exc
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as exc:
+            call.exc = exc
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def _wait(self, call, timeout, is_active):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            interval = self.CHECK_INTERVAL if is_active is not None else None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                interval = remaining if interval is None else min(interval, remaining)
+            if call.done.wait(None if interval is None else max(0, interval)):
+                return
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError('Deadline exceeded waiting for an identical in-flight call')
+            if is_active is not None and not is_active():
+                raise TimeoutError('Caller went away waiting for an identical in-flight call')
+
+    def stats(self):
+        return {
+            'inflight': len(self.calls),
+            'executed': self.executed,
+            'shared': self.shared
+        }
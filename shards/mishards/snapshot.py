@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def ring_epoch(names):
+    """Short digest identifying the hash ring built from `names`"""
+    return hashlib.sha1(','.join(sorted(names)).encode()).hexdigest()[:12]
+
+
+class StateSnapshot:
+    """Periodically persists warm proxy state to `path` and restores it at startup.
+
+    State is made of named sections, each registered with a `dump` function
+    returning something JSON serializable and a `load` function taking it back.
+    A section found in a snapshot younger than `max_age` seconds is loaded when
+    it is registered. The file is rewritten every `interval` seconds and on
+    `stop`, through a rename so a crash never leaves a partial snapshot.
+    """
+    VERSION = 1
+
+    def __init__(self, path, interval=60, max_age=3600):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.sections = {}
+        self.saved_at = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.restored = self._read()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as exc:
+            logger.warning('Ignore unreadable snapshot %s: %s', self.path, exc)
+            return {}
+        age = time.time() - snapshot.get('saved_at', 0)
+        if snapshot.get('version') != self.VERSION or age > self.max_age:
+            logger.info('Ignore snapshot %s saved %.0fs ago with version %s', self.path, age,
+                        snapshot.get('version'))
+            return {}
+        logger.info('Restore snapshot %s saved %.0fs ago', self.path, age)
+        return snapshot.get('sections', {})
+
+    def register(self, name, dump, load=None):
+        self.sections[name] = dump
+        if load is None or name not in self.restored:
+            return
+        start = time.time()
+        try:
+            load(self.restored.pop(name))
+        except Exception as exc:
+            logger.error('Cannot restore snapshot section %s: %s', name, exc)
+            return
+        logger.info('Restore snapshot section %s in %.3fs', name, time.time() - start)
+
+    def save(self):
+        sections = {}
+        for name, dump in list(self.sections.items()):
+            try:
+                sections[name] = dump()
+            except Exception as exc:
+                logger.error('Cannot dump snapshot section %s: %s', name, exc)
+        snapshot = {'version': self.VERSION, 'saved_at': time.time(), 'sections': sections}
+
+        directory = os.path.dirname(self.path)
+        directory and os.makedirs(directory, exist_ok=True)
+        # Worker processes may share the path, each writes its own temporary file
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.saved_at = snapshot['saved_at']
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.save()
+            except OSError as exc:
+                logger.error('Cannot save snapshot %s: %s', self.path, exc)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='Snapshot', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        try:
+            self.save()
+        except OSError as exc:
+            logger.error('Cannot save snapshot %s: %s', self.path, exc)
@@ -0,0 +1,38 @@
+import os
+from mishards.db_base import DB
+from mishards.models import TableFiles
+
+
+class TestReplicas:
+    def create_db(self, tmpdir, name, updated_time):
+        uri = 'sqlite:///{}'.format(os.path.join(str(tmpdir), name))
+        db = DB(uri)
+        db.create_all()
+        with db.engine.connect() as conn:
+            conn.execute(TableFiles.__table__.insert(), id=1, table_id='c1', updated_time=updated_time)
+        return db, uri
+
+    def test_round_robin_and_staleness(self, tmpdir):
+        db, _ = self.create_db(tmpdir, 'primary.sqlite', 100 * 1000000)
+        _, fresh = self.create_db(tmpdir, 'fresh.sqlite', 99 * 1000000)
+        _, stale = self.create_db(tmpdir, 'stale.sqlite', 10 * 1000000)
+
+        db.init_replicas([fresh, stale], max_lag=5, check_interval=3600)
+        db.start_replica_check()
+        engine = db.read_engine()
+        assert engine is db.replicas[0].engine
+        assert db.replicas[1].stale
+        assert db.replicas[1].lag == 90
+        # The stale replica is skipped
+        assert db.read_engine() is engine
+
+        session = db.ReadSession
+        assert session.bind is engine
+        assert session.execute('select count(*) from TableFiles').scalar() == 1
+        db.remove_read_session()
+
+        assert db.replica_stats()[1]['lag'] == 90
+
+        db.replicas[0].stale = True
+        assert db.read_engine() is db.engine
+        db.stop_replica_check()
@@ -0,0 +1,187 @@
+import time
+import queue
+import threading
+import pytest
+from kubernetes.client import V1Pod, V1ObjectMeta, V1PodStatus, V1PodCondition, V1PodList, V1ListMeta
+from mishards.topology import Topology, TopoGroup, StatusType
+from discovery.plugins import static_provider, kubernetes_provider
+from discovery.plugins.static_provider import StaticDiscovery
+from discovery.plugins.kubernetes_provider import K8SPodInformer, EventHandler, KubernetesProvider
+
+HOSTS = ['127.0.0.1:19531', '127.0.0.1:19532']
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class FakeConnectionGroup(TopoGroup):
+    """Probes succeed or fail as told by `nodes`, a probe of a held node blocks until released"""
+    nodes = {}
+    held = {}
+
+    def __init__(self, name, probe_timeout=30):
+        super().__init__(name)
+
+    def create(self, name, **kwargs):
+        hold = self.held.get(name, None)
+        if hold is not None:
+            hold.wait(5)
+        if self.nodes.get(name, 'up') != 'up':
+            return StatusType.ADD_ERROR, None
+        return StatusType.OK, None
+
+
+class TestStaticDiscovery:
+    @pytest.fixture
+    def discovery(self, monkeypatch):
+        monkeypatch.setenv('DISCOVERY_STATIC_HOSTS', ','.join(HOSTS))
+        monkeypatch.setenv('DISCOVERY_STATIC_PROBE_TIMEOUT', '0.1')
+        monkeypatch.setenv('DISCOVERY_STATIC_RETRY_INTERVAL', '0.05')
+        monkeypatch.setattr(static_provider, 'ConnectionGroup', FakeConnectionGroup)
+        FakeConnectionGroup.nodes = {}
+        FakeConnectionGroup.held = {}
+        discovery = StaticDiscovery(config=None, readonly_topo=Topology())
+        yield discovery
+        for hold in FakeConnectionGroup.held.values():
+            hold.set()
+        discovery.stop()
+
+    def test_unreachable_node_does_not_block_startup(self, discovery):
+        FakeConnectionGroup.held[HOSTS[1]] = threading.Event()
+
+        start = time.time()
+        assert discovery.start()
+        assert time.time() - start < 1
+        assert list(discovery.readonly_topo.group_names) == [HOSTS[0]]
+
+    def test_retry_node_back_later(self, discovery):
+        FakeConnectionGroup.nodes[HOSTS[1]] = 'down'
+
+        assert discovery.start()
+        assert wait_for(lambda: HOSTS[1] in discovery.unreachable)
+        assert HOSTS[1] not in discovery.readonly_topo.group_names
+
+        FakeConnectionGroup.nodes[HOSTS[1]] = 'up'
+        assert wait_for(lambda: HOSTS[1] in discovery.readonly_topo.group_names)
+        assert HOSTS[1] not in discovery.unreachable
+
+    def test_publish_after_probe(self, discovery):
+        hold = FakeConnectionGroup.held[HOSTS[0]] = threading.Event()
+
+        assert discovery.start()
+        assert HOSTS[0] in discovery.probing
+        assert not discovery.readonly_topo.has_group(HOSTS[0])
+
+        hold.set()
+        assert wait_for(lambda: HOSTS[0] in discovery.readonly_topo.group_names)
+
+
+def make_pod(name, ip='10.0.0.1', ready=True, resource_version='1'):
+    condition = V1PodCondition(type='Ready', status='True' if ready else 'False')
+    return V1Pod(metadata=V1ObjectMeta(name=name, resource_version=resource_version),
+                 status=V1PodStatus(pod_ip=ip, conditions=[condition]))
+
+
+class RecordingTopology(Topology):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def add_group(self, group):
+        self.calls.append(('register', group.name))
+        return super().add_group(group)
+
+    def delete_group(self, group):
+        self.calls.append(('unregister', group))
+        return super().delete_group(group)
+
+
+class FakeWatch:
+    """Replays one scripted list of events per stream, stops the informer when none is left"""
+    streams = []
+    resource_versions = []
+    informer = None
+
+    def stream(self, func, **kwargs):
+        self.resource_versions.append(kwargs['resource_version'])
+        if not self.streams:
+            self.informer.terminate = True
+            return
+        for event in self.streams.pop(0):
+            yield event
+
+    def stop(self):
+        pass
+
+
+class FakeV1:
+    def __init__(self, lists):
+        self.lists = lists
+
+    def list_namespaced_pod(self, namespace, label_selector):
+        pods, resource_version = self.lists.pop(0)
+        return V1PodList(items=pods, metadata=V1ListMeta(resource_version=resource_version))
+
+
+class TestPodInformer:
+    @pytest.fixture
+    def informer(self, monkeypatch):
+        monkeypatch.setattr(kubernetes_provider.watch, 'Watch', FakeWatch)
+        monkeypatch.setattr(kubernetes_provider, 'ConnectionGroup', FakeConnectionGroup)
+        FakeConnectionGroup.nodes = {}
+        FakeConnectionGroup.held = {}
+        FakeWatch.resource_versions = []
+
+        provider = KubernetesProvider.__new__(KubernetesProvider)
+        provider.readonly_topo = RecordingTopology()
+        provider.pod_ips = {}
+        provider.port = 19530
+        informer = K8SPodInformer(queue.Queue(), namespace='milvus', label_selector='tier=ro', v1=FakeV1([]),
+                                  retry_interval=0)
+        informer.handler = EventHandler(mgr=provider, message_queue=informer.queue, namespace='milvus',
+                                        pod_patt='.*-ro-.*')
+        informer.provider = provider
+        FakeWatch.informer = informer
+        return informer
+
+    def run(self, informer, lists, streams):
+        informer.v1.lists = lists
+        FakeWatch.streams = streams
+        informer.terminate = False
+        informer.run()
+        while not informer.queue.empty():
+            informer.handler.handle_event(informer.queue.get())
+        return informer.provider.readonly_topo.calls
+
+    def test_readiness_changes(self, informer):
+        calls = self.run(informer, [([make_pod('m-ro-0', ready=False), make_pod('m-ro-1', ip='10.0.0.2')], '10')], [[
+            {'type': 'MODIFIED', 'object': make_pod('m-ro-0', resource_version='11')},
+            {'type': 'MODIFIED', 'object': make_pod('m-ro-1', ip='10.0.0.2', ready=False, resource_version='12')},
+        ]])
+        assert calls == [('register', 'm-ro-1'), ('register', 'm-ro-0'), ('unregister', 'm-ro-1')]
+        assert list(informer.provider.readonly_topo.group_names) == ['m-ro-0']
+        # The watch starts from the listed version and resumes from the last event
+        assert FakeWatch.resource_versions == ['10', '12']
+
+    def test_ip_change(self, informer):
+        calls = self.run(informer, [([make_pod('m-ro-0')], '10')], [[
+            {'type': 'MODIFIED', 'object': make_pod('m-ro-0', resource_version='11')},
+            {'type': 'MODIFIED', 'object': make_pod('m-ro-0', ip='10.0.0.9', resource_version='12')},
+        ]])
+        assert calls == [('register', 'm-ro-0'), ('unregister', 'm-ro-0'), ('register', 'm-ro-0')]
+        assert informer.provider.pod_ips == {'m-ro-0': '10.0.0.9'}
+
+    def test_gone_relists(self, informer):
+        lists = [([make_pod('m-ro-0'), make_pod('m-ro-1', ip='10.0.0.2')], '10'),
+                 ([make_pod('m-ro-1', ip='10.0.0.2')], '20')]
+        calls = self.run(informer, lists, [
+            [{'type': 'ERROR', 'object': None, 'raw_object': {'code': 410, 'reason': 'Gone'}}],
+            []
+        ])
+        assert calls == [('register', 'm-ro-0'), ('register', 'm-ro-1'), ('unregister', 'm-ro-0')]
+        assert list(informer.provider.readonly_topo.group_names) == ['m-ro-1']
+        assert FakeWatch.resource_versions == ['10', '20', '20']
@@ -0,0 +1,72 @@
+import threading
+import time
+from milvus.client.types import Status
+from mishards.jobs import JobManager, JobState
+
+
+def wait_done(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.done and time.time() < deadline:
+        time.sleep(0.01)
+    return job.done
+
+
+class TestJobManager:
+    def test_dedupe(self):
+        manager = JobManager(max_workers=2)
+        release = threading.Event()
+        calls = []
+
+        def build():
+            calls.append(1)
+            release.wait(5)
+            return Status()
+
+        job, created = manager.submit('CreateIndex', ('CreateIndex', 'c1'), build, collection_name='c1')
+        dup, dup_created = manager.submit('CreateIndex', ('CreateIndex', 'c1'), build, collection_name='c1')
+        assert created and not dup_created
+        assert dup is job
+
+        release.set()
+        manager.shutdown(wait=True)
+        assert len(calls) == 1
+        assert job.state == JobState.SUCCEEDED
+        assert manager.get(job.id).to_dict()['progress'] == 1.0
+
+    def test_peer_jobs(self):
+        updates = []
+        manager = JobManager(max_workers=1, id_prefix=100)
+        manager.listeners.append(lambda key, state: updates.append((key, state)))
+        job, _ = manager.submit('Compact', ('Compact', 'c1'), lambda: Status())
+        assert wait_done(job)
+        manager.shutdown(wait=True)
+        assert job.id == '100-1'
+        assert [state['state'] for _, state in updates] == [JobState.PENDING, JobState.RUNNING, JobState.SUCCEEDED]
+
+        peer = JobManager(max_workers=1, id_prefix=200)
+        peer.on_peer_job(*updates[1])
+        dup, created = peer.submit('Compact', ('Compact', 'c1'), lambda: Status())
+        assert not created and dup.id == '100-1'
+        assert peer.get('100-1').to_dict()['state'] == JobState.RUNNING
+
+        peer.on_peer_job(*updates[2])
+        assert [state['state'] for state in peer.stats()] == [JobState.SUCCEEDED]
+        again, created = peer.submit('Compact', ('Compact', 'c1'), lambda: Status())
+        assert created and again.id == '200-1'
+        peer.shutdown(wait=True)
+
+    def test_failed(self):
+        manager = JobManager(max_workers=1)
+        job, _ = manager.submit('Compact', ('Compact', 'c1'),
+                                lambda: Status(code=Status.UNEXPECTED_ERROR, message='boom'))
+        assert wait_done(job)
+        assert job.state == JobState.FAILED
+        assert job.message == 'boom'
+
+        for _ in range(100):
+            if not manager.inflight:
+                break
+            time.sleep(0.01)
+        again, created = manager.submit('Compact', ('Compact', 'c1'), lambda: Status())
+        assert created and again.id != job.id
+        manager.shutdown(wait=True)
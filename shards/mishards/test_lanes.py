@@ -0,0 +1,65 @@
+import threading
+import pytest
+from milvus.grpc_gen import milvus_pb2, status_pb2
+from mishards import exceptions
+from mishards.lanes import Lane, Lanes, lane_of, resp_class_of, SEARCH, ADMIN
+from mishards.limiter import GradientLimit
+
+
+class TestLanes:
+    def test_classify(self):
+        assert lane_of('Search') == SEARCH
+        assert lane_of('CreateIndex') == ADMIN
+        assert resp_class_of('Search') == milvus_pb2.TopKQueryResult
+        assert resp_class_of('CreateIndex') == status_pb2.Status
+
+        lanes = Lanes([Lane(SEARCH, 4, 4), Lane(ADMIN, 1, 2)])
+        assert lanes.capacity == 11
+        assert lanes.get('Flush').name == ADMIN
+
+    def test_overload(self):
+        lane = Lane(ADMIN, workers=1, queue=1, timeout=0.1)
+        lane.acquire()
+
+        with pytest.raises(exceptions.LaneOverloadError):
+            lane.acquire()
+        assert lane.waiting == 0
+
+        entered = threading.Event()
+        waiter = threading.Thread(target=lambda: lane.acquire() or entered.set())
+        lane.timeout = 5
+        waiter.start()
+        while lane.waiting == 0:
+            pass
+        with pytest.raises(exceptions.LaneOverloadError):
+            lane.acquire()
+
+        lane.release()
+        assert entered.wait(1)
+        waiter.join()
+        assert lane.running == 1
+        assert lane.stats()['rejected'] == 2
+
+    def test_gradient_limit(self):
+        limiter = GradientLimit(10, min_limit=2, max_limit=100)
+        for _ in range(100):
+            limiter.on_sample(0.01, inflight=int(limiter.limit))
+        grown = limiter.limit
+        assert grown > 10
+
+        for _ in range(100):
+            limiter.on_sample(0.1, inflight=int(limiter.limit))
+        assert limiter.limit < grown
+
+        idle = GradientLimit(10)
+        for _ in range(100):
+            idle.on_sample(0.01, inflight=1)
+        assert idle.limit == 10
+
+    def test_adaptive_lane(self):
+        lane = Lane(SEARCH, 0, queue=5, limiter=GradientLimit(2, max_limit=8))
+        assert lane.workers == 2
+        assert lane.capacity == 13
+        with lane.enter(sample=True):
+            pass
+        assert lane.stats()['limiter']['short_rtt'] is not None
@@ -0,0 +1,49 @@
+import logging
+import queue
+from utils.logger_helper import RateLimitFilter, DeferredQueueHandler
+
+
+def make_record(msg='Routing: %s', args=('x',), lineno=1, level=logging.INFO):
+    return logging.LogRecord('mishards', level, 'service_handler.py', lineno, msg, args, None)
+
+
+class TestLoggerHelper:
+    def test_rate_limit(self):
+        limiter = RateLimitFilter(rate=1, burst=2)
+        passed = [limiter.filter(make_record()) for _ in range(5)]
+        assert passed == [True, True, False, False, False]
+
+        # Another call site and warnings are not limited
+        assert limiter.filter(make_record(lineno=2))
+        assert limiter.filter(make_record(level=logging.WARNING))
+
+        # A record is judged once however many handlers filter it
+        record = make_record(lineno=3)
+        assert limiter.filter(record) and limiter.filter(record)
+
+        limiter.buckets[('service_handler.py', 1)] = (1, limiter.buckets[('service_handler.py', 1)][1], 3)
+        record = make_record()
+        assert limiter.filter(record)
+        assert record.getMessage() == 'Routing: x [3 similar suppressed]'
+
+        # Messages without args are not %-formatted
+        limiter.filter(make_record(msg='Hit 100%', args=(), lineno=4))
+        limiter.buckets[('service_handler.py', 4)] = (1, limiter.buckets[('service_handler.py', 4)][1], 2)
+        record = make_record(msg='Hit 100%', args=(), lineno=4)
+        assert limiter.filter(record)
+        assert record.getMessage() == 'Hit 100% [2 similar suppressed]'
+
+        limiter.filter(make_record(msg='Hit %(rate)s', args=({'rate': '5%'},), lineno=5))
+        limiter.buckets[('service_handler.py', 5)] = (1, limiter.buckets[('service_handler.py', 5)][1], 4)
+        record = make_record(msg='Hit %(rate)s', args=({'rate': '5%'},), lineno=5)
+        assert limiter.filter(record)
+        assert record.getMessage() == 'Hit 5% [4 similar suppressed]'
+
+    def test_deferred_queue_handler(self):
+        handler = DeferredQueueHandler(queue.Queue(maxsize=1))
+        record = make_record()
+        handler.handle(record)
+        handler.handle(make_record())
+        assert handler.dropped == 1
+        assert handler.queue.get_nowait() is record
+        assert record.args == ('x',)
@@ -0,0 +1,65 @@
+import time
+import grpc
+from concurrent.futures import Future
+from mishards.topology import Topology, TopoGroup
+from mishards.outlier import OutlierDetector
+
+
+class TestOutlierDetector:
+    def create(self, names, **kwargs):
+        topo = Topology()
+        for name in names:
+            topo.add_group(TopoGroup(name))
+        return topo, OutlierDetector(topo, alpha=0.5, min_requests=5, **kwargs)
+
+    def test_eject_slow_node(self):
+        topo, detector = self.create(['n1', 'n2', 'n3', 'n4'], base_ejection=0.2)
+        for _ in range(10):
+            detector.record('n1', 0.1, True)
+            detector.record('n2', 0.1, True)
+            detector.record('n3', 0.1, True)
+            detector.record('n4', 1.0, True)
+
+        assert topo.is_ejected('n4')
+        assert 'n4' not in topo.routable_names
+        assert 'n4' in topo.group_names
+        assert detector.stats()['n4']['ejections'] == 1
+
+        time.sleep(0.3)
+        assert 'n4' in topo.routable_names
+        for _ in range(10):
+            detector.record('n4', 0.1, True)
+        assert not topo.is_ejected('n4')
+        assert detector.stats()['n4']['ejections'] == 0
+
+    def test_error_rate_and_ejection_limit(self):
+        topo, detector = self.create(['n1', 'n2', 'n3'])
+        for _ in range(10):
+            detector.record('n2', 0.1, False)
+            detector.record('n3', 0.1, False)
+
+        assert len([name for name in topo.group_names if topo.is_ejected(name)]) == 1
+
+    def test_track_deadline_exceeded(self):
+        class DeadlineExceeded(grpc.RpcError):
+            def code(self):
+                return grpc.StatusCode.DEADLINE_EXCEEDED
+
+        class SdkFuture:
+            def __init__(self):
+                self._future = Future()
+
+        topo, detector = self.create(['n1', 'n2'])
+        expired = SdkFuture()
+        detector.track('n1', expired, start=time.time() - 2)
+        expired._future.set_exception(DeadlineExceeded())
+
+        cancelled = SdkFuture()
+        detector.track('n2', cancelled)
+        cancelled._future.cancel()
+
+        stats = detector.stats()
+        assert stats['n1']['samples'] == 1
+        assert stats['n1']['error_rate'] == 0
+        assert stats['n1']['latency'] >= 2
+        assert 'n2' not in stats
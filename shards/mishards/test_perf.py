@@ -0,0 +1,59 @@
+from mishards.perf import RequestTimer, PerfStats, SlowRequestRecorder
+
+
+class TestPerfStats:
+    def test_summary(self):
+        stats = PerfStats(window=3)
+        for i in range(5):
+            timer = RequestTimer()
+            timer.add('route', i)
+            with timer.stage('merge'):
+                pass
+            timer.lap('parse')
+            stats.record('c1', timer)
+
+        summary = stats.summary()['c1']
+        assert summary['route']['count'] == 3
+        assert summary['route']['p50'] == 3
+        assert summary['route']['max'] == 4
+        assert set(summary) == {'route', 'merge', 'parse', 'total'}
+
+    def test_merge(self):
+        workers = []
+        for offset in (0, 100):
+            stats = PerfStats(window=100)
+            for i in range(1, 101):
+                timer = RequestTimer()
+                timer.add('route', (offset + i) / 1000.0)
+                stats.record('c1', timer)
+            workers.append(stats.export())
+
+        summary = PerfStats.merge(workers)['c1']['route']
+        assert summary['count'] == 200
+        assert abs(summary['mean'] - 0.1005) < 1e-6
+        assert abs(summary['p50'] - 0.1) / 0.1 < 0.02
+        assert abs(summary['p99'] - 0.198) / 0.198 < 0.02
+        assert summary['max'] == 0.2
+
+
+class TestSlowRequestRecorder:
+    def test_observe(self):
+        recorder = SlowRequestRecorder(threshold=10, capacity=2)
+        timer = RequestTimer()
+        timer.lap('parse')
+        with timer.stage('reload', addr='ro-0'):
+            pass
+        assert recorder.observe('Search', 'c1', timer) is None
+
+        for i in range(3):
+            recorder.observe('Search', 'c{}'.format(i), timer, error='failed')
+        records = recorder.list()
+        assert [r['collection'] for r in records] == ['c1', 'c2']
+        assert [s['name'] for s in records[0]['spans']] == ['parse', 'reload']
+        assert records[0]['spans'][1]['tags'] == {'addr': 'ro-0'}
+
+        recorder.threshold = 0
+        assert recorder.observe('Search', 'c3', timer)['error'] is None
+
+        merged = SlowRequestRecorder.merge([[{'time': 1}, {'time': 4}], [{'time': 2}, {'time': 3}]], 3)
+        assert [r['time'] for r in merged] == [2, 3, 4]
@@ -0,0 +1,40 @@
+import os
+import time
+import pytest
+from mishards.profiling import SamplingProfiler, HeapTracer
+
+
+class TestProfiling:
+    def test_profiler(self, tmpdir):
+        profiler = SamplingProfiler(str(tmpdir), interval=0.001)
+        with pytest.raises(ValueError):
+            profiler.stop()
+        profiler.start(5)
+        with pytest.raises(ValueError):
+            profiler.start()
+        time.sleep(0.05)
+        stats = profiler.stop()
+        assert not stats['running']
+        assert stats['samples'] > 0
+        for path in stats['reports']:
+            assert os.path.getsize(path) > 0
+
+    def test_profiler_hard_timeout(self, tmpdir):
+        profiler = SamplingProfiler(str(tmpdir), interval=0.001, max_duration=0.05)
+        profiler.start(3600)
+        time.sleep(0.3)
+        assert not profiler.running
+        assert len(profiler.stats()['reports']) == 2
+
+    def test_heap(self, tmpdir):
+        tracer = HeapTracer(str(tmpdir))
+        with pytest.raises(ValueError):
+            tracer.snapshot()
+        tracer.start(5)
+        first = tracer.snapshot()['report']
+        garbage = [bytearray(1024) for _ in range(100)]
+        last = tracer.stop()['report']
+        assert first != last
+        with open(last) as f:
+            assert 'growths since the previous snapshot' in f.read()
+        assert len(garbage) == 100
@@ -0,0 +1,186 @@
+import logging
+import itertools
+import pytest
+from collections import namedtuple
+from mishards import db, settings
+from mishards.models import Tables, TableFiles
+from mishards.router import RouterMixin, file_updatetime_map, is_plain_tag
+from mishards.router.factory import RouterFactory
+from mishards.hash_ring import HashRing
+from mishards.metadata_mirror import MetadataMirror
+
+logger = logging.getLogger(__name__)
+
+File = namedtuple('File', ['id', 'updated_time'])
+
+
+class FakeTopo:
+    def __init__(self, names):
+        self.group_names = names
+        self.routable_names = names
+
+    def get_group(self, name):
+        return name if name in self.group_names else None
+
+
+class TestRouterFactory:
+    def test_lazy_load(self):
+        factory = RouterFactory()
+        assert not factory.loaded
+        router = factory.create('CacheAffinityRouter', writable_topo=FakeTopo([]), readonly_topo=FakeTopo([]))
+        assert router.name == 'CacheAffinityRouter'
+        assert factory.loaded == {'cache_affinity_router'}
+        with pytest.raises(RuntimeError):
+            factory.create('NoSuchRouter')
+        assert factory.loaded == {'cache_affinity_router', 'file_based_hash_ring_router'}
+
+
+@pytest.mark.usefixtures('app')
+class TestCacheAffinityRouter:
+    def create_router(self, servers, **kwargs):
+        topo = FakeTopo(servers)
+        return RouterFactory().create('CacheAffinityRouter', writable_topo=topo,
+                                      readonly_topo=topo, **kwargs)
+
+    def test_prefer_warm_node(self):
+        file_updatetime_map.clear()
+        servers = ['n1', 'n2', 'n3']
+        router = self.create_router(servers, candidates=2, max_migrations=0)
+        files = [File(id=i, updated_time=10) for i in range(100)]
+
+        ring = HashRing(servers)
+        for f in files:
+            owner, second = list(ring.iterate_nodes(str(f.id)))[:2]
+            file_updatetime_map[second][str(f.id)] = 10
+
+        routing = router.place(files, servers)
+        for host, placed in routing.items():
+            for file_id, _ in placed:
+                assert file_updatetime_map[host].get(file_id) == 10
+
+    def test_gradual_migration(self):
+        file_updatetime_map.clear()
+        servers = ['n1', 'n2']
+        router = self.create_router(servers, candidates=2, max_migrations=3)
+        files = [File(id=i, updated_time=10) for i in range(60)]
+
+        ring = HashRing(servers)
+        for f in files:
+            second = list(ring.iterate_nodes(str(f.id)))[1]
+            file_updatetime_map[second][str(f.id)] = 10
+
+        routing = router.place(files, servers)
+        for host in servers:
+            owned = [f for f in files if ring.get_node(str(f.id)) == host]
+            placed = routing.get(host, [])
+            migrated = [fid for fid, _ in placed if fid in {str(f.id) for f in owned}]
+            assert len(migrated) == min(3, len(owned))
+
+    def test_stale_cache_is_cold(self):
+        file_updatetime_map.clear()
+        servers = ['n1', 'n2']
+        router = self.create_router(servers, candidates=2, max_migrations=0)
+        files = [File(id=i, updated_time=20) for i in range(20)]
+        for host in servers:
+            for f in files:
+                file_updatetime_map[host][str(f.id)] = 10
+
+        ring = HashRing(servers)
+        routing = router.place(files, servers)
+        for host, placed in routing.items():
+            for file_id, _ in placed:
+                assert ring.get_node(file_id) == host
+
+
+@pytest.mark.usefixtures('app')
+class TestQueryFiles:
+    ids = itertools.count(1)
+
+    def add_collection(self, table_id, owner_table=None, partition_tag=None):
+        session = db.Session
+        session.add(Tables(id=next(self.ids), table_id=table_id, owner_table=owner_table,
+                           partition_tag=partition_tag, state=Tables.NORMAL))
+        session.commit()
+
+    def add_files(self, table_id, cnt, date=110, row_count=10, file_type=TableFiles.FILE_TYPE_RAW):
+        session = db.Session
+        for _ in range(cnt):
+            session.add(TableFiles(id=next(self.ids), table_id=table_id, file_type=file_type, date=date,
+                                   row_count=row_count, updated_time=1))
+        session.commit()
+
+    def test_prune(self):
+        router = RouterMixin(writable_topo=None, readonly_topo=None)
+        self.add_collection('c1')
+        self.add_collection('c1_p1', owner_table='c1', partition_tag='2020-01')
+        self.add_collection('c1_p2', owner_table='c1', partition_tag='2020-02')
+        self.add_collection('c1_p3', owner_table='c1', partition_tag='2021-01')
+        self.add_files('c1', 2)
+        self.add_files('c1', 3, row_count=0)
+        self.add_files('c1', 4, file_type=TableFiles.FILE_TYPE_NEW)
+        self.add_files('c1_p1', 5, date=110)
+        self.add_files('c1_p2', 6, date=120)
+        self.add_files('c1_p3', 7, date=120)
+
+        assert len(router.query_files('c1')) == 2 + 5 + 6 + 7
+        assert len(router.query_files('c1', range_array=[(115, 125)])) == 6 + 7
+        assert len(router.query_files('c1', partition_tags=['2020'])) == 5 + 6
+        assert len(router.query_files('c1', partition_tags=['2020-02', '_default'])) == 6 + 2
+        assert len(router.query_files('c1', partition_tags=['20.*-01'])) == 5 + 7
+        assert len(router.query_files('c1', partition_tags=['2022'])) == 0
+
+        assert is_plain_tag('2020-02') and is_plain_tag('_default')
+        assert not is_plain_tag('20.*-01') and not is_plain_tag('2020|2021')
+
+        settings.ROUTER_PRUNE_EMPTY_FILES = False
+        try:
+            assert len(router.query_files('c1', partition_tags=['_default'])) == 2 + 3
+        finally:
+            settings.ROUTER_PRUNE_EMPTY_FILES = True
+
+    def test_explain(self):
+        file_updatetime_map.clear()
+        router = RouterMixin(writable_topo=None, readonly_topo=FakeTopo(['n1', 'n2']))
+        self.add_collection('c2')
+        self.add_collection('c2_p1', owner_table='c2', partition_tag='p1')
+        self.add_files('c2', 3)
+        self.add_files('c2_p1', 4)
+
+        plan = router.explain('c2', partition_tags=['p1'])
+        assert plan['partitions'] == ['c2_p1']
+        assert plan['files'] == 4
+        assert plan['rows'] == 40
+        assert plan['reload_files'] == 4
+        assert sum(len(node['files']) for node in plan['nodes'].values()) == 4
+        assert plan['fan_out'] == len(plan['nodes'])
+        assert not file_updatetime_map
+
+    def test_mirror(self):
+        router = RouterMixin(writable_topo=None, readonly_topo=None)
+        self.add_collection('c3')
+        self.add_collection('c3_p1', owner_table='c3', partition_tag='2020-01')
+        self.add_collection('c3_p2', owner_table='c3', partition_tag='2021-01')
+        self.add_files('c3', 2)
+        self.add_files('c3', 3, row_count=0)
+        self.add_files('c3_p1', 4, date=110)
+        self.add_files('c3_p2', 5, date=120)
+
+        cases = [{}, {'partition_tags': ['2020']}, {'partition_tags': ['20.*-01', '_default']},
+                 {'range_array': [(115, 125)]}, {'partition_tags': ['2022']}]
+        expected = [sorted((f.id, f.updated_time) for f in router.query_files('c3', **case)) for case in cases]
+
+        router.mirror = MetadataMirror(db)
+        router.mirror.reconcile()
+        assert router.mirror_ready
+        for case, files in zip(cases, expected):
+            assert sorted((f.id, f.updated_time) for f in router.query_files('c3', **case)) == files
+        assert 'c3' in router.collection_names()
+
+        self.add_files('c3_p2', 1, date=120)
+        router.mirror.poll()
+        assert len(router.query_files('c3')) == 2 + 4 + 5 + 1
+
+        db.Session.query(TableFiles).filter(TableFiles.table_id == 'c3_p1').delete()
+        db.Session.commit()
+        router.mirror.reconcile()
+        assert len(router.query_files('c3')) == 2 + 5 + 1
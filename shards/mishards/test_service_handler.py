@@ -0,0 +1,355 @@
+import threading
+import time
+from concurrent.futures import Future
+import pytest
+import mock
+from milvus.client.types import Status
+from milvus.grpc_gen import milvus_pb2, status_pb2
+from mishards import exceptions, settings
+from mishards.utilities import parse_partial_result
+from mishards.service_handler import ServiceHandler
+from mishards.workers import WorkerBus
+from mishards.router import file_updatetime_map
+from mishards.singleflight import SingleFlight
+from mishards.topology import Topology, TopoGroup
+from mishards.outlier import OutlierDetector
+
+
+class TestPreload:
+    def create_handler(self, routing, conns):
+        router = mock.MagicMock()
+        router.routing.return_value = routing
+        router.query_conn.side_effect = lambda addr, metadata=None: conns[addr]
+        router.connection.return_value.load_collection.return_value = Status()
+        return ServiceHandler(tracer=None, router=router, bus=WorkerBus())
+
+    def test_preload_all_nodes(self):
+        conns = {'n1': mock.MagicMock(), 'n2': mock.MagicMock()}
+        for conn in conns.values():
+            conn.reload_segments.return_value = Status()
+        handler = self.create_handler({'n1': (['1', '2'], ['1']), 'n2': (['3'], [])}, conns)
+
+        status = handler._preload_collection('c1')
+        assert status.OK()
+        conns['n1'].reload_segments.assert_called_once_with('c1', ['1', '2'])
+        conns['n2'].reload_segments.assert_called_once_with('c1', ['3'])
+
+    def test_preload_node_failure(self):
+        file_updatetime_map.clear()
+        file_updatetime_map['n2']['3'] = 10
+        conns = {'n1': mock.MagicMock(), 'n2': mock.MagicMock()}
+        conns['n1'].reload_segments.return_value = Status()
+        conns['n2'].reload_segments.return_value = Status(code=Status.UNEXPECTED_ERROR, message='oom')
+        handler = self.create_handler({'n1': (['1'], []), 'n2': (['3'], ['3'])}, conns)
+
+        status = handler._preload_collection('c1')
+        assert not status.OK()
+        assert 'n2: oom' in status.message
+        assert '3' not in file_updatetime_map['n2']
+
+
+class TestSingleFlight:
+    def test_share_inflight(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def leader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        results = []
+        t1 = threading.Thread(target=lambda: results.append(flight.do('k', leader)))
+        t1.start()
+        assert started.wait(1)
+        t2 = threading.Thread(target=lambda: results.append(flight.do('k', leader)))
+        t2.start()
+        while flight.shared == 0:
+            time.sleep(0.01)
+        release.set()
+        t1.join()
+        t2.join()
+
+        assert len(calls) == 1
+        assert sorted(results) == [('result', False), ('result', True)]
+        assert flight.do('k', lambda: 'again') == ('again', False)
+
+    def test_follower_deadline(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+
+        def leader():
+            started.set()
+            release.wait()
+            return 'result'
+
+        t = threading.Thread(target=lambda: flight.do('k', leader))
+        t.start()
+        assert started.wait(1)
+
+        start = time.time()
+        with pytest.raises(TimeoutError):
+            flight.do('k', leader, timeout=0.05)
+        assert time.time() - start < 1
+        with pytest.raises(TimeoutError):
+            flight.do('k', leader, is_active=lambda: False)
+
+        release.set()
+        t.join()
+        assert flight.stats()['inflight'] == 0
+
+    def test_share_exception(self):
+        flight = SingleFlight()
+        with pytest.raises(ValueError):
+            flight.do('k', mock.MagicMock(side_effect=ValueError('boom')))
+        assert flight.stats()['inflight'] == 0
+
+
+class FakeShardFuture:
+    def __init__(self, response=None):
+        self.response = response
+        self.cancelled = False
+        self._future = Future()
+        if response is not None:
+            self._future.set_result(response)
+
+    def result(self, raw=False):
+        return self.response
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TestPartialResult:
+    def test_deadline(self):
+        handler = ServiceHandler(tracer=None, router=mock.MagicMock(), bus=WorkerBus())
+        ok = milvus_pb2.TopKQueryResult(status=status_pb2.Status(error_code=status_pb2.SUCCESS), row_num=0)
+        slow = FakeShardFuture()
+        shard_futures = [('n1', 3, FakeShardFuture(ok)), ('n2', 2, slow)]
+
+        start = time.time()
+        results, coverage = handler._collect_partial(shard_futures, {'deadline_ms': 50}, start)
+        assert time.time() - start < 1
+        assert results == [ok]
+        assert coverage == (3, 5)
+        assert slow.cancelled
+
+    def test_quorum(self):
+        handler = ServiceHandler(tracer=None, router=mock.MagicMock(), bus=WorkerBus())
+        ok = milvus_pb2.TopKQueryResult(status=status_pb2.Status(error_code=status_pb2.SUCCESS), row_num=0)
+        shard_futures = [('n1', 9, FakeShardFuture(ok)), ('n2', 1, FakeShardFuture())]
+        results, coverage = handler._collect_partial(shard_futures, {'quorum': 0.9}, time.time())
+        assert coverage == (9, 10)
+
+    def test_quorum_counts_successes(self):
+        handler = ServiceHandler(tracer=None, router=mock.MagicMock(), bus=WorkerBus())
+        ok = milvus_pb2.TopKQueryResult(status=status_pb2.Status(error_code=status_pb2.SUCCESS), row_num=0)
+        failed = milvus_pb2.TopKQueryResult(status=status_pb2.Status(error_code=status_pb2.UNEXPECTED_ERROR))
+        slow = FakeShardFuture()
+        shard_futures = [('n1', 9, FakeShardFuture(failed)), ('n2', 1, FakeShardFuture(ok)), ('n3', 1, slow)]
+
+        start = time.time()
+        results, coverage = handler._collect_partial(shard_futures, {'quorum': 0.5, 'deadline_ms': 100}, start)
+        assert time.time() - start >= 0.1
+        assert results == [ok]
+        assert coverage == (1, 11)
+        assert slow.cancelled
+
+    def test_dropped_shard_is_ejected(self):
+        topo = Topology()
+        for name in ('n1', 'n2', 'n3'):
+            topo.add_group(TopoGroup(name))
+        outliers = OutlierDetector(topo, alpha=0.5, min_requests=5, min_latency=0.01)
+        handler = ServiceHandler(tracer=None, router=mock.MagicMock(), bus=WorkerBus(), outliers=outliers)
+        ok = milvus_pb2.TopKQueryResult(status=status_pb2.Status(error_code=status_pb2.SUCCESS), row_num=0)
+
+        for _ in range(5):
+            shard_futures = [('n1', 1, FakeShardFuture(ok)), ('n2', 1, FakeShardFuture(ok)), ('n3', 1, FakeShardFuture())]
+            for addr, _, f in shard_futures:
+                outliers.track(addr, f)
+            handler._collect_partial(shard_futures, {'deadline_ms': 20}, time.time())
+
+        assert outliers.stats()['n3']['ejections'] == 1
+        assert topo.is_ejected('n3')
+
+        # A call cancelled because the client went away is not a sample
+        cancelled = FakeShardFuture()
+        outliers.track('n1', cancelled)
+        cancelled._future.cancel()
+        assert outliers.stats()['n1']['samples'] == 5
+
+    def test_parse(self):
+        assert parse_partial_result({'deadline_ms': 50}) == {'deadline_ms': 50.0, 'quorum': None}
+        with pytest.raises(exceptions.InvalidArgumentError):
+            parse_partial_result({'quorum': 2})
+        with pytest.raises(exceptions.InvalidArgumentError):
+            parse_partial_result([])
+
+
+class TestCancellation:
+    def test_skip_inactive_request(self):
+        router = mock.MagicMock()
+        router.routing.return_value = {'n1': (['1'], [])}
+        tracer = mock.MagicMock()
+        tracer.empty = True
+        handler = ServiceHandler(tracer=tracer, router=router, bus=WorkerBus())
+        context = mock.MagicMock()
+        context.is_active.return_value = False
+
+        with pytest.raises(exceptions.RequestCancelledError):
+            handler._do_query(context, 'c1', mock.MagicMock(), [[0.1]], 1, {})
+        router.query_conn.assert_not_called()
+
+    def test_cancel_shards_on_termination(self):
+        conn = mock.MagicMock()
+        router = mock.MagicMock()
+        router.routing.return_value = {'n1': (['1'], [])}
+        router.query_conn.return_value = conn
+        tracer = mock.MagicMock()
+        tracer.empty = True
+        handler = ServiceHandler(tracer=tracer, router=router, bus=WorkerBus())
+        context = mock.MagicMock()
+        context.time_remaining.return_value = 0.5
+        context.is_active.side_effect = [True, True, False]
+        future = conn.search_in_segment.return_value
+        future.is_done.return_value = False
+
+        with pytest.raises(exceptions.RequestCancelledError):
+            handler._do_query(context, 'c1', mock.MagicMock(), [[0.1]], 1, {})
+        assert conn.search_in_segment.call_args[1]['timeout'] == 0.5
+
+        callback = context.add_callback.call_args[0][0]
+        callback()
+        future.cancel.assert_called_once_with()
+
+
+class TestSplitQuery:
+    def test_split_and_stitch(self):
+        settings.SEARCH_SPLIT_MIN_NQ = 2
+        try:
+            file_updatetime_map.clear()
+            file_updatetime_map['n1']['1'] = 10
+            topo = mock.MagicMock()
+            topo.routable_names = ['n1', 'n2']
+            router = mock.MagicMock()
+            router.readonly_topo = topo
+            router.routing.return_value = {'n1': (['1'], [])}
+            conns = {'n1': mock.MagicMock(), 'n2': mock.MagicMock()}
+            router.query_conn.side_effect = lambda addr, metadata=None: conns[addr]
+
+            def search(collection_name, file_ids, query_records, top_k, params, timeout, _async):
+                future = mock.MagicMock()
+                future.result.return_value = milvus_pb2.TopKQueryResult(
+                    status=status_pb2.Status(error_code=status_pb2.SUCCESS),
+                    row_num=len(query_records),
+                    ids=[int(q[0]) for q in query_records],
+                    distances=[q[0] for q in query_records])
+                return future
+
+            for conn in conns.values():
+                conn.search_in_segment.side_effect = search
+            tracer = mock.MagicMock()
+            tracer.empty = True
+            handler = ServiceHandler(tracer=tracer, router=router, bus=WorkerBus())
+            context = mock.MagicMock()
+            context.time_remaining.return_value = None
+
+            vectors = [[float(i)] for i in range(4)]
+            status, ids, distances = handler._do_query(context, 'c1', mock.MagicMock(), vectors, 1, {})
+            assert status.error_code == status_pb2.SUCCESS
+            assert list(ids) == [0, 1, 2, 3]
+            assert conns['n1'].search_in_segment.call_args[1]['query_records'] == vectors[:2]
+            assert conns['n2'].search_in_segment.call_args[1]['query_records'] == vectors[2:]
+            conns['n2'].reload_segments.assert_called_once_with('c1', ['1'])
+        finally:
+            settings.SEARCH_SPLIT_MIN_NQ = 0
+
+
+class TestScaleDown:
+    def create(self):
+        topo = Topology(drain_timeout=1)
+        for name in ('n1', 'n2'):
+            topo.add_group(TopoGroup(name))
+        router = mock.MagicMock()
+        router.readonly_topo = topo
+        conns = {'n1': mock.MagicMock(), 'n2': mock.MagicMock()}
+
+        def query_conn(addr, metadata=None):
+            if topo.get_group(addr) is None:
+                raise exceptions.ConnectionNotFoundError(message=addr)
+            return conns[addr]
+
+        router.query_conn.side_effect = query_conn
+        ok = milvus_pb2.TopKQueryResult(status=status_pb2.Status(error_code=status_pb2.SUCCESS), row_num=0)
+        for conn in conns.values():
+            conn.search_in_segment.return_value.result.return_value = ok
+        tracer = mock.MagicMock()
+        tracer.empty = True
+        handler = ServiceHandler(tracer=tracer, router=router, bus=WorkerBus())
+        context = mock.MagicMock()
+        context.time_remaining.return_value = None
+        return topo, router, conns, handler, context
+
+    def wait_drained(self, topo, name):
+        for _ in range(100):
+            if name not in topo.draining_names:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_node_deleted_between_routing_and_dispatch(self):
+        topo, router, conns, handler, context = self.create()
+        file_updatetime_map.clear()
+        file_updatetime_map['n1']['1'] = 10
+
+        def routing(collection_id, **kwargs):
+            if router.routing.call_count == 1:
+                topo.delete_group('n1')
+                assert self.wait_drained(topo, 'n1')
+                return {'n1': (['1'], ['1'])}
+            return {'n2': (['1'], ['1'])}
+
+        router.routing.side_effect = routing
+        status, _, _ = handler._do_query(context, 'c1', mock.MagicMock(), [[0.1]], 1, {})
+        assert status.error_code == status_pb2.SUCCESS
+        assert router.routing.call_count == 2
+        assert '1' not in file_updatetime_map['n1']
+        assert not conns['n1'].search_in_segment.called
+        conns['n2'].reload_segments.assert_called_once_with('c1', ['1'])
+
+    def test_reserved_node_drains_after_query(self):
+        topo, router, conns, handler, context = self.create()
+        def reload_segments(collection_id, file_ids):
+            # Scale down while the query still has to call n2
+            topo.delete_group('n2')
+            time.sleep(0.05)
+
+        conns['n1'].reload_segments.side_effect = reload_segments
+        router.routing.return_value = {'n1': (['1'], ['1']), 'n2': (['2'], [])}
+        status, _, _ = handler._do_query(context, 'c1', mock.MagicMock(), [[0.1]], 1, {})
+        assert status.error_code == status_pb2.SUCCESS
+        assert conns['n2'].search_in_segment.called
+        assert self.wait_drained(topo, 'n2')
+        assert topo.get_group('n2') is None
+
+
+class TestRestoredMeta:
+    def test_revalidate(self):
+        router = mock.MagicMock()
+        handler = ServiceHandler(tracer=None, router=router, bus=WorkerBus())
+        handler.restore_collection_meta({
+            'c1': {'dimension': 8, 'index_file_size': 1024, 'metric_type': 1},
+            'c2': {'dimension': 8, 'index_file_size': 1024, 'metric_type': 1}
+        })
+        assert handler.restored_meta == {'c1', 'c2'}
+        assert handler.collection_meta['c1'].dimension == 8
+
+        fresh = mock.MagicMock(dimension=16)
+        router.connection.return_value.get_collection_info.side_effect = lambda name: \
+            (Status(), fresh) if name == 'c1' else (Status(code=Status.COLLECTION_NOT_EXISTS, message='gone'), None)
+        handler.revalidate_collection_meta()
+        assert handler.collection_meta == {'c1': fresh}
+        assert not handler.restored_meta
@@ -0,0 +1,33 @@
+import json
+from mishards.snapshot import StateSnapshot, ring_epoch
+from mishards.router import file_updatetime_map, dump_file_updates, restore_file_updates
+
+
+class TestStateSnapshot:
+    def test_save_and_restore(self, tmpdir):
+        path = str(tmpdir.join('state', 'snapshot.json'))
+        file_updatetime_map.clear()
+        file_updatetime_map['n1'].update({'1': 10, '2': 20})
+
+        snapshot = StateSnapshot(path)
+        assert not snapshot.restored
+        snapshot.register('file_updates', dump_file_updates, restore_file_updates)
+        snapshot.register('ring', lambda: {'epoch': ring_epoch(['n2', 'n1'])})
+        snapshot.stop()
+
+        file_updatetime_map.clear()
+        file_updatetime_map['n1']['2'] = 30
+        restored = StateSnapshot(path)
+        restored.register('file_updates', dump_file_updates, restore_file_updates)
+        assert file_updatetime_map['n1'] == {'1': 10, '2': 30}
+        assert restored.restored['ring']['epoch'] == ring_epoch(['n1', 'n2'])
+
+    def test_ignore_old_snapshot(self, tmpdir):
+        path = str(tmpdir.join('snapshot.json'))
+        with open(path, 'w') as f:
+            json.dump({'version': StateSnapshot.VERSION, 'saved_at': 0, 'sections': {'ring': {}}}, f)
+        assert not StateSnapshot(path, max_age=60).restored
+
+        with open(path, 'w') as f:
+            f.write('{')
+        assert not StateSnapshot(path).restored
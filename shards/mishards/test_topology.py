@@ -0,0 +1,63 @@
+import threading
+import time
+from mishards.topology import Topology, TopoGroup, StatusType
+
+
+class TestTopology:
+    def test_join(self):
+        topo = Topology(join_timeout=1)
+        started, release = threading.Event(), threading.Event()
+
+        def handler(group, timeout=None):
+            started.set()
+            release.wait(timeout)
+
+        topo.register_join_handler(handler)
+        assert topo.add_group(TopoGroup('g1')) == StatusType.OK
+        assert started.wait(1)
+        assert 'g1' not in topo.group_names
+        assert 'g1' in topo.joining_names
+        assert topo.get_group('g1') is not None
+        assert topo.add_group(TopoGroup('g1')) == StatusType.DUPLICATED
+
+        release.set()
+        for _ in range(100):
+            if 'g1' in topo.group_names:
+                break
+            time.sleep(0.01)
+        assert 'g1' in topo.group_names
+        assert 'g1' not in topo.joining_names
+
+    def test_drain(self):
+        topo = Topology(drain_timeout=1)
+        group = TopoGroup('g1')
+        topo.add_group(group)
+        group.acquire()
+
+        topo.delete_group('g1')
+        assert 'g1' not in topo.group_names
+        assert topo.get_group('g1') is group
+        assert not topo.has_group('g1')
+
+        group.release()
+        for _ in range(100):
+            if 'g1' not in topo.draining_names:
+                break
+            time.sleep(0.01)
+        assert topo.get_group('g1') is None
+
+    def test_reserve(self):
+        topo = Topology(drain_timeout=1)
+        group = TopoGroup('g1')
+        topo.add_group(group)
+        assert topo.reserve(['g1', 'g2']) == [group, None]
+
+        topo.delete_group('g1')
+        time.sleep(0.05)
+        assert topo.get_group('g1') is group
+        group.release()
+        for _ in range(100):
+            if 'g1' not in topo.draining_names:
+                break
+            time.sleep(0.01)
+        assert topo.get_group('g1') is None
@@ -0,0 +1,41 @@
+from mishards.workers import WorkerBus
+from mishards.router import (file_updatetime_map, file_forget_listeners, merge_file_updates,
+                             forget_file_updates, drop_file_updates)
+
+
+class TestWorkerBus:
+    def test_stats(self):
+        bus = WorkerBus(worker_id=0)
+        bus.register_stats_provider(lambda: {'requests': {'Search': 2}})
+        bus.dispatch('stats', {'worker': 1, 'pid': 2, 'requests': {'Search': 3, 'Insert': 1}}, 1)
+
+        stats = bus.stats()
+        assert [s['worker'] for s in stats['workers']] == [0, 1]
+        assert stats['requests'] == {'Search': 5, 'Insert': 1}
+
+    def test_publish_without_master(self):
+        bus = WorkerBus()
+        assert not bus.enabled
+        bus.publish('collection_dropped', 'c1')
+
+    def test_merge_file_updates(self):
+        file_updatetime_map.clear()
+        file_updatetime_map['n1']['1'] = 20
+        merge_file_updates('n1', {'1': 10, '2': 10})
+        assert file_updatetime_map['n1'] == {'1': 20, '2': 10}
+
+    def test_forget_file_updates(self):
+        file_updatetime_map.clear()
+        forgotten = []
+        file_forget_listeners.append(lambda host, files: forgotten.append((host, files)))
+        try:
+            merge_file_updates('n1', {'1': 10, '2': 10})
+            forget_file_updates('n1', ['1', '3'])
+        finally:
+            file_forget_listeners.pop()
+        assert forgotten == [('n1', {'1': 10})]
+
+        # A peer drops the files unless it reloaded them since
+        file_updatetime_map['n2'].update({'1': 10, '2': 30})
+        drop_file_updates('n2', {'1': 10, '2': 10})
+        assert file_updatetime_map['n2'] == {'2': 30}
@@ -1,5 +1,6 @@
 import logging
 import threading
+import time
 import enum
 
 logger = logging.getLogger(__name__)
@@ -32,8 +33,23 @@ class TopoGroup:
     def __init__(self, name):
         self.name = name
         self.items = {}
+        self.inflight = 0
         self.cv = threading.Condition()
 
+    def acquire(self):
+        with self.cv:
+            self.inflight += 1
+
+    def release(self):
+        with self.cv:
+            self.inflight -= 1
+            if self.inflight <= 0:
+                self.cv.notify_all()
+
+    def wait_idle(self, timeout=None):
+        with self.cv:
+            return self.cv.wait_for(lambda: self.inflight <= 0, timeout)
+
     def on_duplicate(self, topo_object):
         pass
         # logger.warning('Duplicated topo_object \"{}\" into group \"{}\"'.format(topo_object, self.name))
@@ -81,8 +97,24 @@ class TopoGroup:
 
 
 class Topology:
-    def __init__(self):
+    """Groups of topo objects, keyed by group name.
+
+    A group added while join handlers are registered is `joining`: it is invisible
+    to `group_names` until every handler has run, so callers can prepare a group
+    before it takes traffic. A group deleted with a positive `drain_timeout` is
+    `draining`: it is removed from `group_names` at once but stays reachable by
+    `get_group` until its in-flight requests finish or the timeout expires.
+    An `ejected` group stays a member but is left out of `routable_names` until
+    its ejection expires.
+    """
+    def __init__(self, drain_timeout=0, join_timeout=None):
         self.topo_groups = {}
+        self.joining_groups = {}
+        self.draining_groups = {}
+        self.ejected = {}
+        self.join_handlers = []
+        self.drain_timeout = drain_timeout
+        self.join_timeout = join_timeout
         self.cv = threading.Condition()
 
     def on_duplicated_group(self, group):
@@ -97,23 +129,58 @@ class Topology:
         # logger.debug('Post add group \"{}\"'.format(group))
         return StatusType.OK
 
+    def register_join_handler(self, func):
+        logger.info('Registering {} into topology join_handlers'.format(func))
+        self.join_handlers.append(func)
+        return func
+
     def get_group(self, name):
-        return self.topo_groups.get(name, None)
+        for groups in (self.topo_groups, self.joining_groups, self.draining_groups):
+            group = groups.get(name, None)
+            if group is not None:
+                return group
+        return None
 
     def has_group(self, group):
         key = group if isinstance(group, str) else group.name
-        return key in self.topo_groups
+        return key in self.topo_groups or key in self.joining_groups
 
     def _add_group_no_lock(self, group):
         logger.info('Adding group \"{}\"'.format(group))
         self.topo_groups[group.name] = group
 
+    def _join(self, group):
+        start = time.time()
+        for handler in self.join_handlers:
+            try:
+                handler(group, timeout=self.join_timeout)
+            except Exception as exc:
+                logger.error('Join handler {} of group \"{}\" failed: {}'.format(handler, group, exc))
+
+        with self.cv:
+            if self.joining_groups.get(group.name, None) is not group:
+                logger.info('Group \"{}\" is deleted while joining'.format(group))
+                return
+            self.joining_groups.pop(group.name)
+            self._add_group_no_lock(group)
+        logger.info('Group \"{}\" joined in {:.3f}s'.format(group, time.time() - start))
+        self.on_post_add_group(group)
+
     def add_group(self, group):
         self.on_pre_add_group(group)
-        if self.has_group(group):
-            return self.on_duplicated_group(group)
         with self.cv:
-            self._add_group_no_lock(group)
+            if self.has_group(group):
+                return self.on_duplicated_group(group)
+            if self.join_handlers:
+                logger.info('Joining group \"{}\"'.format(group))
+                self.joining_groups[group.name] = group
+            else:
+                self._add_group_no_lock(group)
+
+        if self.join_handlers:
+            threading.Thread(target=self._join, args=(group,),
+                             name='Join-{}'.format(group.name), daemon=True).start()
+            return StatusType.OK
         return self.on_post_add_group(group)
 
     def on_delete_not_existed_group(self, group):
@@ -131,16 +198,80 @@ class Topology:
     def _delete_group_no_lock(self, group):
         logger.info('Deleting group \"{}\"'.format(group))
         delete_key = group if isinstance(group, str) else group.name
-        return self.topo_groups.pop(delete_key, None)
+        deleted_group = self.topo_groups.pop(delete_key, None)
+        self.ejected.pop(delete_key, None)
+        joining_group = self.joining_groups.pop(delete_key, None)
+        return deleted_group if deleted_group is not None else joining_group
+
+    def reserve(self, names):
+        """Acquire the groups named `names`, draining ones included, None for those gone"""
+        with self.cv:
+            groups = [self.get_group(name) for name in names]
+            for group in groups:
+                group is not None and group.acquire()
+        return groups
+
+    def _drain(self, group):
+        deadline = time.time() + self.drain_timeout
+        while True:
+            idle = group.wait_idle(max(0, deadline - time.time()))
+            with self.cv:
+                # A request may reserve the group between the wait and the lock
+                if idle and group.inflight > 0:
+                    continue
+                if self.draining_groups.get(group.name, None) is group:
+                    self.draining_groups.pop(group.name)
+                break
+        if idle:
+            logger.info('Group \"{}\" is drained'.format(group))
+        else:
+            logger.warning('Group \"{}\" is removed with {} requests in flight after {}s'.format(
+                group, group.inflight, self.drain_timeout))
 
     def delete_group(self, group):
         self.on_pre_delete_group(group)
         with self.cv:
             deleted_group = self._delete_group_no_lock(group)
-        if not deleted_group:
+            drain = deleted_group is not None and self.drain_timeout > 0
+            if drain:
+                self.draining_groups[deleted_group.name] = deleted_group
+        if deleted_group is None:
             return self.on_delete_not_existed_group(group)
+        if drain:
+            threading.Thread(target=self._drain, args=(deleted_group,),
+                             name='Drain-{}'.format(deleted_group.name), daemon=True).start()
         return self.on_post_delete_group(group)
 
     @property
     def group_names(self):
         return self.topo_groups.keys()
+
+    def eject(self, name, duration):
+        with self.cv:
+            self.ejected[name] = time.time() + duration
+        logger.warning('Group \"{}\" is ejected for {}s'.format(name, duration))
+
+    def readmit(self, name):
+        with self.cv:
+            return self.ejected.pop(name, None) is not None
+
+    def ejected_remaining(self, name):
+        until = self.ejected.get(name, None)
+        if until is None:
+            return 0
+        return max(0, until - time.time())
+
+    def is_ejected(self, name):
+        return self.ejected_remaining(name) > 0
+
+    @property
+    def routable_names(self):
+        return [name for name in list(self.topo_groups.keys()) if not self.is_ejected(name)]
+
+    @property
+    def joining_names(self):
+        return self.joining_groups.keys()
+
+    @property
+    def draining_names(self):
+        return self.draining_groups.keys()
@@ -1,4 +1,5 @@
 import datetime
+from collections import namedtuple
 from mishards import exceptions
 
 
@@ -18,3 +19,33 @@ def range_to_date(range_obj, metadata=None):
             metadata=metadata)
 
     return format_date(start, end)
+
+
+DateRange = namedtuple('DateRange', ['start_date', 'end_date'])
+
+
+def ranges_to_date(ranges, metadata=None):
+    try:
+        range_objs = [DateRange(start_date=start, end_date=end) for start, end in ranges]
+    except (TypeError, ValueError):
+        raise exceptions.InvalidRangeError('Invalid time ranges: {}'.format(ranges),
+                                           metadata=metadata)
+
+    return [range_to_date(range_obj, metadata=metadata) for range_obj in range_objs]
+
+
+def parse_partial_result(value, metadata=None):
+    try:
+        deadline_ms = value.get('deadline_ms', None)
+        quorum = value.get('quorum', None)
+        assert deadline_ms is not None or quorum is not None
+        assert deadline_ms is None or float(deadline_ms) > 0
+        assert quorum is None or 0 < float(quorum) <= 1
+    except (AttributeError, TypeError, ValueError, AssertionError):
+        raise exceptions.InvalidArgumentError('Invalid partial_result: {}'.format(value),
+                                              metadata=metadata)
+
+    return {
+        'deadline_ms': None if deadline_ms is None else float(deadline_ms),
+        'quorum': None if quorum is None else float(quorum)
+    }
@@ -0,0 +1,203 @@
+import logging
+import os
+import signal
+import threading
+import time
+import multiprocessing
+from multiprocessing import connection
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerBus:
+    """Broadcast channel between pre-forked workers.
+
+    Every worker holds one end of a pipe to the master, which relays each message
+    to all other workers. A bus without a pipe is a single process bus: publishing
+    is a no-op and only the local stats are reported.
+    """
+    def __init__(self, conn=None, worker_id=0, stats_interval=5):
+        self.conn = conn
+        self.worker_id = worker_id
+        self.stats_interval = stats_interval
+        self.subscribers = defaultdict(list)
+        self.close_handlers = []
+        self.stats_providers = []
+        self.peer_stats = {}
+        self.send_lock = threading.Lock()
+        self.terminate = False
+        self.subscribe('stats', self.on_peer_stats)
+
+    @property
+    def enabled(self):
+        return self.conn is not None
+
+    def subscribe(self, topic, func):
+        self.subscribers[topic].append(func)
+        return func
+
+    def register_close_handler(self, func):
+        self.close_handlers.append(func)
+        return func
+
+    def register_stats_provider(self, func):
+        self.stats_providers.append(func)
+        return func
+
+    def publish(self, topic, payload):
+        if not self.enabled:
+            return
+        try:
+            with self.send_lock:
+                self.conn.send((topic, payload, self.worker_id))
+        except (OSError, EOFError) as exc:
+            logger.warning('Worker {} cannot publish {}: {}'.format(self.worker_id, topic, exc))
+
+    def dispatch(self, topic, payload, sender):
+        for func in self.subscribers.get(topic, []):
+            try:
+                func(payload)
+            except Exception as exc:
+                logger.error('Worker {} failed to handle {} from worker {}: {}'.format(
+                    self.worker_id, topic, sender, exc))
+
+    def local_stats(self):
+        stats = {'worker': self.worker_id, 'pid': os.getpid(), 'time': time.time()}
+        for provider in self.stats_providers:
+            stats.update(provider())
+        return stats
+
+    def on_peer_stats(self, payload):
+        self.peer_stats[payload['worker']] = payload
+
+    def stats(self):
+        workers = dict(self.peer_stats)
+        workers[self.worker_id] = self.local_stats()
+        requests = defaultdict(int)
+        for stats in workers.values():
+            for method, count in stats.get('requests', {}).items():
+                requests[method] += count
+        return {
+            'workers': [workers[worker_id] for worker_id in sorted(workers)],
+            'requests': dict(requests)
+        }
+
+    def _listen(self):
+        while not self.terminate:
+            try:
+                topic, payload, sender = self.conn.recv()
+            except (OSError, EOFError):
+                if not self.terminate:
+                    logger.error('Worker {} lost the master process'.format(self.worker_id))
+                    for handler in self.close_handlers:
+                        handler()
+                return
+            self.dispatch(topic, payload, sender)
+
+    def _report(self):
+        while not self.terminate:
+            self.publish('stats', self.local_stats())
+            time.sleep(self.stats_interval)
+
+    def start(self):
+        if not self.enabled:
+            return
+        threading.Thread(target=self._listen, name='WorkerBusListener', daemon=True).start()
+        threading.Thread(target=self._report, name='WorkerBusReporter', daemon=True).start()
+
+    def stop(self):
+        self.terminate = True
+
+
+class Master:
+    """Pre-forks `num_workers` processes running `target(bus)` and relays their bus messages.
+
+    Workers must create their gRPC server and database engine after the fork, so
+    `target` is expected to build the whole app itself. A worker that exits is
+    respawned at most once per `respawn_interval` seconds.
+    """
+    def __init__(self, num_workers, target, stats_interval=5, respawn_interval=1):
+        self.num_workers = num_workers
+        self.target = target
+        self.stats_interval = stats_interval
+        self.respawn_interval = respawn_interval
+        self.ctx = multiprocessing.get_context('fork')
+        self.workers = {}
+        self.conns = {}
+        self.started_at = {}
+        self.terminate = False
+
+    def _worker_main(self, worker_id, conn):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        bus = WorkerBus(conn, worker_id=worker_id, stats_interval=self.stats_interval)
+        os._exit(self.target(bus) or 0)
+
+    def spawn(self, worker_id):
+        parent_conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(target=self._worker_main, args=(worker_id, child_conn),
+                                   name='mishards-worker-{}'.format(worker_id), daemon=False)
+        process.start()
+        child_conn.close()
+        self.workers[worker_id] = process
+        self.conns[worker_id] = parent_conn
+        self.started_at[worker_id] = time.time()
+        logger.info('Worker {} started with pid {}'.format(worker_id, process.pid))
+
+    def relay(self, sender, message):
+        for worker_id, conn in list(self.conns.items()):
+            if worker_id == sender:
+                continue
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass
+
+    def _on_exit(self, worker_id):
+        process = self.workers[worker_id]
+        process.join()
+        self.conns.pop(worker_id).close()
+        logger.error('Worker {} (pid {}) exited with code {}'.format(worker_id, process.pid, process.exitcode))
+        if self.terminate:
+            return
+        delay = self.started_at[worker_id] + self.respawn_interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.spawn(worker_id)
+
+    def _on_signal(self, signum, frame):
+        self.terminate = True
+
+    def stop(self, timeout=10):
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.time() + timeout
+        for process in self.workers.values():
+            process.join(max(0, deadline - time.time()))
+            if process.is_alive():
+                process.kill()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        for worker_id in range(self.num_workers):
+            self.spawn(worker_id)
+
+        while not self.terminate:
+            by_conn = {conn: worker_id for worker_id, conn in self.conns.items()}
+            by_sentinel = {self.workers[worker_id].sentinel: worker_id for worker_id in self.conns}
+            for ready in connection.wait(list(by_conn) + list(by_sentinel), timeout=1):
+                if ready in by_conn:
+                    try:
+                        message = ready.recv()
+                    except (OSError, EOFError):
+                        continue
+                    self.relay(by_conn[ready], message)
+                elif by_sentinel[ready] in self.conns:
+                    self._on_exit(by_sentinel[ready])
+
+        logger.info('Master is stopping {} workers ......'.format(len(self.workers)))
+        self.stop()
+        return 0
@@ -1,9 +1,14 @@
 import os
+import time
+import queue
+import atexit
 import datetime
 import copy
+import threading
 from pytz import timezone
 from logging import Filter
 import logging.config
+import logging.handlers
 from utils import colors
 
 
@@ -32,6 +37,75 @@ class CriticalFilter(logging.Filter):
         return rec.levelno == logging.CRITICAL
 
 
+class RateLimitFilter(logging.Filter):
+    """Lets at most `rate` records per second through each call site at INFO and below.
+
+    Suppressed records are counted and the count is appended to the next record
+    let through from the same call site.
+    """
+    def __init__(self, rate=0, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, rec):
+        if self.rate <= 0 or rec.levelno > logging.INFO:
+            return True
+        # The same filter may sit on several handlers, decide once per record
+        decision = getattr(rec, 'rate_limited', None)
+        if decision is not None:
+            return not decision
+        rec.rate_limited = self._limited(rec)
+        return not rec.rate_limited
+
+    def _limited(self, rec):
+        key = (rec.pathname, rec.lineno)
+        now = time.monotonic()
+        with self.lock:
+            tokens, last, suppressed = self.buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now, suppressed + 1)
+                return True
+            self.buckets[key] = (tokens - 1, now, 0)
+        if not suppressed:
+            return False
+        if isinstance(rec.args, tuple) and rec.args:
+            rec.msg = '{} [%d similar suppressed]'.format(rec.msg)
+            rec.args = rec.args + (suppressed,)
+        else:
+            # Without positional args the message is not %-formatted, it may hold a literal '%'
+            rec.msg = '{} [{} similar suppressed]'.format(rec.getMessage(), suppressed)
+            rec.args = ()
+        return False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread unformatted and never blocks.
+
+    Messages are formatted by the listener, so arguments must not be mutated after
+    the logging call. Records are dropped and counted when the queue is full.
+    """
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks hold frames of the calling thread, render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
 COLORS = {
     'HEADER': colors.BWhite,
     'INFO': colors.On_IWhite + colors.BBlack,
@@ -89,7 +163,15 @@ class ColorfulFormatter(ColorFulFormatColMixin, logging.Formatter):
         return message_str
 
 
-def config(log_level, log_path, name, tz='UTC'):
+def config(log_level, log_path, name, tz='UTC', async_mode=False, log_format='default',
+           rate_limit=0, queue_size=10000):
+    """Configure the root logger.
+
+    With `async_mode` request threads only put records on a bounded queue and a
+    QueueListener thread formats and writes them. `log_format` 'compact' writes
+    one logfmt style line per record. `rate_limit` caps records per second per
+    call site at INFO and below.
+    """
     def build_log_file(level, log_path, name, tz):
         utc_now = datetime.datetime.utcnow()
         utc_tz = timezone('UTC')
@@ -108,6 +190,10 @@ def config(log_level, log_path, name, tz='UTC'):
             'default': {
                 'format': '%(asctime)s | %(levelname)s | %(name)s | %(threadName)s: %(message)s (%(filename)s:%(lineno)s)',
             },
+            'compact': {
+                'format': 'ts=%(asctime)s lvl=%(levelname)s pid=%(process)d thread=%(threadName)s '
+                          'logger=%(name)s src=%(filename)s:%(lineno)s msg=%(message)r',
+            },
             'colorful_console': {
                 'format': '%(asctime)s | %(levelname)s: %(message)s (%(filename)s:%(lineno)s) (%(threadName)s)',
                 # 'format': '%(asctime)s | %(levelname)s | %(threadName)s: %(message)s (%(filename)s:%(lineno)s)',
@@ -131,45 +217,49 @@ def config(log_level, log_path, name, tz='UTC'):
             'CriticalFilter': {
                 '()': CriticalFilter,
             },
+            'RateLimitFilter': {
+                '()': RateLimitFilter,
+                'rate': rate_limit,
+            },
         },
         'handlers': {
             'milvus_celery_console': {
                 'class': 'logging.StreamHandler',
-                'formatter': 'colorful_console',
+                'formatter': 'colorful_console' if log_format == 'default' else log_format,
             },
             'milvus_debug_file': {
                 'level': 'DEBUG',
                 'filters': ['DebugFilter'],
                 'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'default',
+                'formatter': log_format,
                 'filename': build_log_file('debug', log_path, name, tz)
             },
             'milvus_info_file': {
                 'level': 'INFO',
                 'filters': ['InfoFilter'],
                 'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'default',
+                'formatter': log_format,
                 'filename': build_log_file('info', log_path, name, tz)
             },
             'milvus_warn_file': {
                 'level': 'WARN',
                 'filters': ['WarnFilter'],
                 'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'default',
+                'formatter': log_format,
                 'filename': build_log_file('warn', log_path, name, tz)
             },
             'milvus_error_file': {
                 'level': 'ERROR',
                 'filters': ['ErrorFilter'],
                 'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'default',
+                'formatter': log_format,
                 'filename': build_log_file('error', log_path, name, tz)
             },
             'milvus_critical_file': {
                 'level': 'CRITICAL',
                 'filters': ['CriticalFilter'],
                 'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'default',
+                'formatter': log_format,
                 'filename': build_log_file('critical', log_path, name, tz)
             },
         },
@@ -184,4 +274,27 @@ def config(log_level, log_path, name, tz='UTC'):
         'propagate': False,
     }
 
+    if not async_mode:
+        for handler in LOGGING['handlers'].values():
+            handler.setdefault('filters', []).insert(0, 'RateLimitFilter')
+
     logging.config.dictConfig(LOGGING)
+
+    if async_mode:
+        root = logging.getLogger()
+        handler = DeferredQueueHandler(queue.Queue(maxsize=queue_size))
+        handler.addFilter(RateLimitFilter(rate=rate_limit))
+        listener = logging.handlers.QueueListener(handler.queue, *root.handlers,
+                                                  respect_handler_level=True)
+        root.handlers = [handler]
+        listener.start()
+        atexit.register(listener.stop)
+
+        def restart_in_child():
+            # The listener thread does not survive fork, workers need their own
+            handler.queue = listener.queue = queue.Queue(maxsize=queue_size)
+            listener._thread = None
+            listener.start()
+
+        os.register_at_fork(after_in_child=restart_in_child)
+        return listener
@@ -1,33 +1,84 @@
 import os
+import re
+import time
 import inspect
+import logging
 from functools import partial
 from utils.pluginextension import MiPluginBase as PluginBase
 
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name):
+    return re.sub('[^a-z0-9]', '', name.lower())
+
 
 class BaseMixin(object):
+    """Plugin registry of a factory.
+
+    Plugin modules are listed by file name only. A module is imported and set
+    up the first time `create()` asks for a class it may provide: modules whose
+    normalized name equals or starts with the normalized class name are tried
+    first, e.g. `static_provider` for `static`, then the remaining ones.
+    """
 
     def __init__(self, package_name, searchpath=None):
         self.plugin_package_name = package_name
-        caller_path = os.path.dirname(inspect.stack()[1][1])
+        caller_path = os.path.dirname(inspect.currentframe().f_back.f_code.co_filename)
         get_path = partial(os.path.join, caller_path)
         plugin_base = PluginBase(package=self.plugin_package_name,
                                  searchpath=[get_path('./plugins')])
         self.class_map = {}
+        self.loaded = set()
         searchpath = searchpath if searchpath else []
         searchpath = [searchpath] if isinstance(searchpath, str) else searchpath
         self.source = plugin_base.make_plugin_source(searchpath=searchpath,
                                                      identifier=self.__class__.__name__)
 
-        for plugin_name in self.source.list_plugins():
-            plugin = self.source.load_plugin(plugin_name)
-            plugin.setup(self)
+    def load_plugin(self, plugin_name):
+        if plugin_name in self.loaded:
+            return
+        self.loaded.add(plugin_name)
+        start = time.time()
+        plugin = self.source.load_plugin(plugin_name)
+        plugin.setup(self)
+        logger.debug('Load plugin %s.%s takes %.3fs', self.plugin_package_name, plugin_name, time.time() - start)
+
+    def candidates(self, name):
+        key = normalize_name(name)
+        plugin_names = sorted(self.source.list_plugins())
+        likely = [plugin_name for plugin_name in plugin_names if normalize_name(plugin_name) == key]
+        likely += [plugin_name for plugin_name in plugin_names
+                   if plugin_name not in likely and normalize_name(plugin_name).startswith(key)]
+        return likely, [plugin_name for plugin_name in plugin_names if plugin_name not in likely]
 
     def on_plugin_setup(self, plugin_class):
         name = getattr(plugin_class, 'name', plugin_class.__name__)
         self.class_map[name.lower()] = plugin_class
 
     def plugin(self, name):
-        return self.class_map.get(name, None)
+        plugin_class = self.class_map.get(name, None)
+        if plugin_class:
+            return plugin_class
+
+        likely, others = self.candidates(name)
+        for plugin_name in likely:
+            self.load_plugin(plugin_name)
+            if name in self.class_map:
+                return self.class_map[name]
+
+        # The class is not named after its module, fall back to scanning the others
+        for plugin_name in others:
+            if plugin_name in self.loaded:
+                continue
+            try:
+                self.load_plugin(plugin_name)
+            except ImportError as exc:
+                logger.warning('Skip %s plugin %s: %s', self.PLUGIN_TYPE, plugin_name, exc)
+                continue
+            if name in self.class_map:
+                return self.class_map[name]
+        return None
 
     def create(self, class_name, **kwargs):
         if not class_name: